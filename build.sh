@@ -58,7 +58,5 @@ else:
     print(f"Found {Customer.objects.count()} existing customers. Skipping data ingestion.")
 END
 
-# Start the server
-echo "Starting Django server..."
-PORT=${PORT:-8000}
-python manage.py runserver 0.0.0.0:$PORT
+# Start the server (see serve.sh)
+exec bash /app/serve.sh
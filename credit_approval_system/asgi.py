@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "credit_approval_system.settings")
+# Serve the read endpoints with their native async views (loans.async_views)
+os.environ.setdefault("ASYNC_VIEWS", "True")
 
 application = get_asgi_application()
@@ -10,9 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import importlib.util
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -72,6 +76,20 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "credit_approval_system.wsgi.application"
 
+# Route check-eligibility, view-loan and view-loans to their async views. asgi.py turns
+# this on, as they only pay off under an ASGI server.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
+# Render JSON with orjson and build the check-eligibility, view-loan and view-loans
+# responses with the flat serializers of loans.flat_serializers. The bytes are the same.
+FAST_RESPONSES = os.getenv('FAST_RESPONSES', 'False').lower() == 'true'
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'loans.renderers.ORJSONRenderer' if FAST_RESPONSES else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -88,6 +106,63 @@ DATABASES = {
     }
 }
 
+# Connection reuse. With psycopg 3 and psycopg_pool installed, each process keeps a pool
+# of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE connections and waits up to DB_POOL_TIMEOUT
+# seconds for a free one. Size it per process type: a web process needs one connection
+# per thread, a prefork Celery child runs one task at a time. DB_POOL_MAX_SIZE=0 turns
+# pooling off; connections are then kept open for DB_CONN_MAX_AGE seconds and checked
+# before reuse. The replica below inherits these options.
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+DATABASES['default']['OPTIONS'] = {}
+if DB_POOL_MAX_SIZE > 0 and importlib.util.find_spec('psycopg_pool') is not None:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        "min_size": min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+        "max_size": DB_POOL_MAX_SIZE,
+        "timeout": DB_POOL_TIMEOUT,
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Server-side prepared statements (psycopg 3): parameters are bound by the server and a
+# query is prepared on a connection once it has run DB_PREPARE_THRESHOLD times there, so
+# the hot create-loan and eligibility queries skip parsing and planning. Pooled and
+# persistent connections keep their prepared statements. Set DB_PREPARE_THRESHOLD to ''
+# when connecting through a transaction-mode pooler such as PgBouncer before 1.21.
+DB_PREPARE_THRESHOLD = os.getenv('DB_PREPARE_THRESHOLD', '2')
+if DB_PREPARE_THRESHOLD and importlib.util.find_spec('psycopg') is not None:
+    DATABASES['default']['OPTIONS']['server_side_binding'] = True
+    DATABASES['default']['OPTIONS']['prepare_threshold'] = int(DB_PREPARE_THRESHOLD)
+
+# How create-loan writes a new loan and the customer's debt increment: 'cte' in one
+# statement (PostgreSQL only), 'orm' as an INSERT and an UPDATE, 'auto' for 'cte' on
+# PostgreSQL
+LOAN_WRITE_METHOD = os.getenv('LOAN_WRITE_METHOD', 'auto')
+
+# Optional read replica, a streaming replica of the primary at DB_REPLICA_HOST. Reads
+# of view-loan, view-loans and check-eligibility go to it (see loans.db_router), unless
+# the rows were written in the last REPLICA_PIN_SECONDS or the replica is unreachable
+# or more than REPLICA_MAX_LAG_SECONDS behind; health is rechecked every
+# REPLICA_HEALTH_CHECK_SECONDS. Tests run the replica alias against the test primary;
+# test_settings gives it a separate SQLite database instead.
+DATABASE_REPLICAS = []
+if os.getenv('DB_REPLICA_HOST'):
+    DB_REPLICA_ALIAS = os.getenv('DB_REPLICA_ALIAS', 'replica')
+    DATABASES[DB_REPLICA_ALIAS] = {
+        **DATABASES['default'],
+        "HOST": os.getenv('DB_REPLICA_HOST'),
+        "PORT": os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS = [DB_REPLICA_ALIAS]
+DATABASE_ROUTERS = ['loans.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '2'))
+REPLICA_HEALTH_CHECK_SECONDS = int(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -125,16 +200,109 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+# Served by WhiteNoise from each worker, precompressed by collectstatic, so gunicorn
+# needs no separate static file server
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedStaticFilesStorage"},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Redis is shared by Celery and the API's keyed stores; an empty REDIS_URL disables
+# the API's use of it. After a failed connection the API retries Redis only every
+# REDIS_RETRY_SECONDS, using its database fallbacks in between.
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.5'))
+REDIS_RETRY_SECONDS = int(os.getenv('REDIS_RETRY_SECONDS', '30'))
+
 # Celery Configuration with environment variable support
-CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
-CELERY_RESULT_BACKEND = os.getenv('REDIS_URL', 'redis://redis:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Long-running ingestion partitions: hand out one task at a time, and only
+# acknowledge it once done so a crashed worker's partition is redelivered
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_ACKS_LATE = True
+# Periodic tasks, run by `celery -A credit_approval_system beat`
+CELERY_BEAT_SCHEDULE = {
+    # Loans that ended yesterday stop counting towards debt and EMI checks
+    'sweep-finished-loans': {
+        'task': 'loans.tasks.sweep_finished_loans',
+        'schedule': crontab(hour=0, minute=5),
+    },
+    # Loan table partitions for the coming periods, created before loans start in them
+    'create-loan-partitions': {
+        'task': 'loans.tasks.create_loan_partitions',
+        'schedule': crontab(hour=0, minute=15),
+    },
+    # Long-closed loans move to cold storage
+    'archive-loans': {
+        'task': 'loans.tasks.archive_old_loans',
+        'schedule': crontab(hour=1, minute=0, day_of_week='sunday'),
+    },
+}
+
+# Data ingestion: source rows read and committed per chunk, rows written per batch,
+# and the write path ('auto' uses COPY on PostgreSQL and bulk upserts elsewhere,
+# or force 'bulk'/'copy'). Ingestion stops, resumably, if the worker process grows
+# past INGEST_MEMORY_LIMIT_MB (0 disables the limit).
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '20000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '5000'))
+INGEST_METHOD = os.getenv('INGEST_METHOD', 'auto')
+INGEST_MEMORY_LIMIT_MB = int(os.getenv('INGEST_MEMORY_LIMIT_MB', '1024'))
+
+# Parallel ingestion splits each source file into INGEST_PARTITIONS files under
+# INGEST_WORK_DIR, which must be shared by every Celery worker
+INGEST_PARTITIONS = int(os.getenv('INGEST_PARTITIONS', '8'))
+INGEST_WORK_DIR = os.getenv('INGEST_WORK_DIR', str(BASE_DIR / 'ingest_work'))
+
+# Excel sources are parsed once into a columnar cache under INGEST_CACHE_DIR,
+# keyed on the workbook's content hash; set it empty to always parse the workbook
+INGEST_CACHE_DIR = os.getenv('INGEST_CACHE_DIR', str(BASE_DIR / 'ingest_cache'))
+
+# Idempotency-Key responses for create-loan are kept for IDEMPOTENCY_TTL_SECONDS.
+# A request whose key is still being processed waits up to IDEMPOTENCY_WAIT_SECONDS
+# for the first response before getting 409 Conflict; an unfinished claim expires
+# after IDEMPOTENCY_LOCK_SECONDS so a crashed request does not hold its key.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '60'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '5'))
+
+# view-loan and view-loans responses are cached in Redis and expired as soon as a
+# loan or customer they show is written; RESPONSE_CACHE_TTL_SECONDS bounds how long
+# an entry lives regardless
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+
+# view-loans pagination (?page_size=, ?cursor=) and streaming (?stream=true); a
+# stream holds LOANS_STREAM_CHUNK_SIZE loans in memory at a time
+LOANS_PAGE_SIZE = int(os.getenv('LOANS_PAGE_SIZE', '100'))
+LOANS_MAX_PAGE_SIZE = int(os.getenv('LOANS_MAX_PAGE_SIZE', '1000'))
+LOANS_STREAM_CHUNK_SIZE = int(os.getenv('LOANS_STREAM_CHUNK_SIZE', '2000'))
+
+# Amortization schedules are cached per (loan_amount, interest_rate, tenure) and format
+# in each process, up to SCHEDULE_CACHE_SIZE of them
+SCHEDULE_CACHE_SIZE = int(os.getenv('SCHEDULE_CACHE_SIZE', '1024'))
+
+# On PostgreSQL the loan table is range-partitioned on start_date: migration 0008 creates
+# yearly partitions, and the create_loan_partitions task keeps LOAN_PARTITIONS_AHEAD future
+# partitions of LOAN_PARTITION_INTERVAL ('year' or 'month') ready next to them
+LOAN_PARTITION_INTERVAL = os.getenv('LOAN_PARTITION_INTERVAL', 'year')
+LOAN_PARTITIONS_AHEAD = int(os.getenv('LOAN_PARTITIONS_AHEAD', '2'))
+
+# Loans closed more than LOAN_ARCHIVE_AFTER_DAYS ago are moved by archive_loans into
+# Parquet files under LOAN_ARCHIVE_DIR, one directory per LOAN_ARCHIVE_CUSTOMER_RANGE
+# customer ids; the directory must be shared by the web and Celery containers
+LOAN_ARCHIVE_DIR = os.getenv('LOAN_ARCHIVE_DIR', str(BASE_DIR / 'loan_archive'))
+LOAN_ARCHIVE_AFTER_DAYS = int(os.getenv('LOAN_ARCHIVE_AFTER_DAYS', '1095'))
+LOAN_ARCHIVE_CUSTOMER_RANGE = int(os.getenv('LOAN_ARCHIVE_CUSTOMER_RANGE', '10000'))
+
+# Admin changelists of tables with at least this many rows (by the planner's
+# estimate, PostgreSQL only) show the estimate instead of running COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))
@@ -0,0 +1,16 @@
+"""Settings for running the test suite without PostgreSQL: python manage.py test loans --settings=credit_approval_system.test_settings
+
+Both databases are SQLite. The replica is a separate database rather than a
+mirror of the primary, so routing tests can tell which one a query reached.
+DATABASE_REPLICAS stays empty; tests that route reads to the replica enable it
+with override_settings.
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test.sqlite3'},
+    'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test_replica.sqlite3'},
+}
+DATABASE_REPLICAS = []
+# SQLite ignores the INCLUDE columns of covering indexes
+SILENCED_SYSTEM_CHECKS = ['models.W040']
@@ -0,0 +1,46 @@
+"""Gunicorn settings for the production server started by build.sh.
+
+SERVER_MODE picks the worker type: 'wsgi' runs the sync views on threaded
+workers, 'asgi' runs uvicorn workers with the async views of loans.async_views.
+Every value can be overridden through the environment.
+"""
+import multiprocessing
+import os
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+if SERVER_MODE not in ('wsgi', 'asgi'):
+    raise ValueError(f"Unknown SERVER_MODE {SERVER_MODE!r}, expected 'wsgi' or 'asgi'")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'credit_approval_system.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # One event loop per core keeps every request of a worker in flight
+    default_workers = multiprocessing.cpu_count()
+else:
+    wsgi_app = 'credit_approval_system.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '4'))
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.getenv('WEB_CONCURRENCY', str(default_workers)))
+
+# Import the app once in the master, so workers share its memory copy-on-write.
+# Nothing connects to PostgreSQL or Redis at import, so each worker opens its own.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Recycle a worker after it has served this many requests (plus up to the jitter,
+# so workers do not restart together), bounding memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+# Seconds an idle keep-alive connection stays open; set it above the idle timeout
+# of the load balancer in front so it never reuses a connection being closed
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Worker heartbeats on tmpfs: a slow disk must not get healthy workers killed
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
@@ -1,13 +1,126 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Customer, Loan
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
+from .credit_profiles import rebuild_credit_profiles
+from .models import ArchivedLoanSummary, Customer, CustomerCreditProfile, IdempotencyRecord, IngestionCheckpoint, Loan
+from .response_cache import invalidate
+
+class EstimatedCountPaginator(Paginator):
+    """Use PostgreSQL's planner estimate instead of COUNT(*) for unfiltered lists of large tables"""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                # A partitioned table has no estimate of its own: add up its partitions'
+                cursor.execute(
+                    'SELECT sum(greatest(reltuples, 0))::bigint FROM pg_class WHERE oid = %s::regclass '
+                    'OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)',
+                    [queryset.model._meta.db_table] * 2,
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelists for tables too large to count exactly on every page view"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(LargeTableAdmin):
     list_display = ('customer_id', 'first_name', 'last_name', 'phone_number', 'monthly_salary', 'approved_limit', 'current_debt')
+    list_filter = ('removed_from_source_at',)
     search_fields = ('first_name', 'last_name', 'phone_number')
 
+    # Expire cached loan responses showing edited customers
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            invalidate(customers=[obj.customer_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            invalidate(customers=[obj.customer_id])
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            invalidate(customers=list(queryset.values_list('customer_id', flat=True)))
+            super().delete_queryset(request, queryset)
+
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(LargeTableAdmin):
     list_display = ('loan_id', 'customer', 'loan_amount', 'interest_rate', 'monthly_installment', 'start_date', 'end_date')
-    list_filter = ('start_date', 'end_date')
-    search_fields = ('customer__first_name', 'customer__last_name', 'loan_id')
+    list_select_related = ('customer',)
+    raw_id_fields = ('customer',)
+    list_filter = ('is_active', 'start_date', 'end_date', 'removed_from_source_at')
+    # Names are served by trigram indexes
+    search_fields = ('customer__first_name', 'customer__last_name')
+
+    def get_search_results(self, request, queryset, search_term):
+        # A numeric term also matches the loan id through the primary key. A '=loan_id'
+        # search field would compare loan_id as text case-insensitively and scan the table.
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if term.isdigit() and int(term) < 2 ** 63:
+            results |= queryset.filter(loan_id=int(term))
+        return results, may_have_duplicates
+
+    # Keep CustomerCreditProfile and cached loan responses in sync with edits made through the admin
+    def save_model(self, request, obj, form, change):
+        affected = {obj.customer_id}
+        if change and 'customer' in form.changed_data:
+            affected.add(form.initial['customer'])
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            rebuild_credit_profiles(affected)
+            invalidate(loans=[obj.loan_id], owners=affected)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            loan_id = obj.loan_id
+            super().delete_model(request, obj)
+            rebuild_credit_profiles([obj.customer_id])
+            invalidate(loans=[loan_id], owners=[obj.customer_id])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            loans = dict(queryset.values_list('loan_id', 'customer_id'))
+            super().delete_queryset(request, queryset)
+            rebuild_credit_profiles(set(loans.values()))
+            invalidate(loans=loans, owners=set(loans.values()))
+
+@admin.register(CustomerCreditProfile)
+class CustomerCreditProfileAdmin(LargeTableAdmin):
+    list_display = (
+        'customer', 'num_loans', 'total_volume', 'total_monthly_installment', 'current_year_volume', 'volume_year',
+        'active_volume', 'active_monthly_installment',
+    )
+    list_select_related = ('customer',)
+    # Derived from the Loan table; active_volume and active_monthly_installment are the eligibility limits' inputs
+    readonly_fields = (
+        'customer', 'num_loans', 'total_emis', 'paid_on_time', 'total_volume', 'total_monthly_installment',
+        'current_year_volume', 'volume_year', 'active_volume', 'active_monthly_installment',
+    )
+
+@admin.register(ArchivedLoanSummary)
+class ArchivedLoanSummaryAdmin(LargeTableAdmin):
+    list_display = ('customer', 'num_loans', 'total_volume', 'total_monthly_installment')
+    list_select_related = ('customer',)
+    readonly_fields = ('customer', 'num_loans', 'total_emis', 'paid_on_time', 'total_volume', 'total_monthly_installment')
+
+@admin.register(IngestionCheckpoint)
+class IngestionCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'source', 'rows_committed', 'completed', 'updated_at')
+    list_filter = ('kind', 'completed')
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(LargeTableAdmin):
+    list_display = ('key', 'status_code', 'expires_at')
+    readonly_fields = ('key', 'request_fingerprint', 'status_code', 'response', 'expires_at')
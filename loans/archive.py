@@ -0,0 +1,153 @@
+"""Cold storage for loans that closed long ago.
+
+Archived loans are moved out of the Loan table into zstd-compressed Parquet
+files under LOAN_ARCHIVE_DIR, one directory per range of
+LOAN_ARCHIVE_CUSTOMER_RANGE customer ids, and counted in the customer's
+ArchivedLoanSummary so credit scoring is unchanged.
+"""
+import os
+import uuid
+from collections import defaultdict
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction
+
+from .credit_profiles import ARCHIVED_FIELDS, started_this_year
+from .models import ArchivedLoanSummary, Loan
+from .response_cache import invalidate
+
+ARCHIVE_SCHEMA = pa.schema([
+    ('loan_id', pa.int64()),
+    ('customer_id', pa.int64()),
+    ('loan_amount', pa.decimal128(15, 2)),
+    ('tenure', pa.int32()),
+    ('interest_rate', pa.decimal128(5, 2)),
+    ('monthly_installment', pa.decimal128(15, 2)),
+    ('emis_paid_on_time', pa.int32()),
+    ('start_date', pa.date32()),
+    ('end_date', pa.date32()),
+])
+
+
+def range_dir(customer_id, archive_dir=None, range_size=None):
+    """The directory holding the archived loans of `customer_id`'s range of customers"""
+    range_size = range_size or settings.LOAN_ARCHIVE_CUSTOMER_RANGE
+    first = customer_id // range_size * range_size
+    return os.path.join(archive_dir or settings.LOAN_ARCHIVE_DIR, f'customers-{first}-{first + range_size - 1}')
+
+
+def archivable_loans(today=None, after_days=None):
+    """Closed loans that ended more than `after_days` (default LOAN_ARCHIVE_AFTER_DAYS) days ago.
+
+    Loans started this year are kept, as they count towards the current-year
+    volume that ArchivedLoanSummary does not track.
+    """
+    after_days = settings.LOAN_ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    horizon = (today or date.today()) - timedelta(days=after_days)
+    return Loan.objects.in_source().filter(is_active=False, end_date__lt=horizon).exclude(started_this_year())
+
+
+def _write_files(rows, archive_dir, range_size):
+    """Write `rows` to one new Parquet file per customer range, returning their paths"""
+    by_range = defaultdict(list)
+    for row in rows:
+        by_range[range_dir(row['customer_id'], archive_dir, range_size)].append(row)
+
+    paths = []
+    for directory, group in by_range.items():
+        os.makedirs(directory, exist_ok=True)
+        name = f'{date.today():%Y%m%d}-{uuid.uuid4().hex}.parquet'
+        # Readers skip dot-files, so a partly written file is never read
+        building = os.path.join(directory, f'.{name}')
+        pq.write_table(pa.Table.from_pylist(group, schema=ARCHIVE_SCHEMA), building, compression='zstd')
+        os.replace(building, os.path.join(directory, name))
+        paths.append(os.path.join(directory, name))
+    return paths
+
+
+def _add_to_summaries(rows):
+    totals = defaultdict(lambda: dict.fromkeys(ARCHIVED_FIELDS, 0))
+    for row in rows:
+        summary = totals[row['customer_id']]
+        summary['num_loans'] += 1
+        summary['total_emis'] += row['tenure']
+        summary['paid_on_time'] += row['emis_paid_on_time']
+        summary['total_volume'] += row['loan_amount']
+        summary['total_monthly_installment'] += row['monthly_installment']
+
+    existing = ArchivedLoanSummary.objects.select_for_update().in_bulk(list(totals))
+    for customer_id, summary in existing.items():
+        for field, value in totals.pop(customer_id).items():
+            setattr(summary, field, getattr(summary, field) + value)
+    ArchivedLoanSummary.objects.bulk_update(existing.values(), ARCHIVED_FIELDS)
+    ArchivedLoanSummary.objects.bulk_create(
+        [ArchivedLoanSummary(customer_id=customer_id, **summary) for customer_id, summary in totals.items()]
+    )
+
+
+def archive_loans(today=None, after_days=None, batch_size=5000, archive_dir=None, range_size=None):
+    """Move archivable loans into Parquet files; returns the number of loans archived.
+
+    Each batch's files are written before the transaction that deletes its
+    loans and adds them to the customers' summaries, and are removed again if
+    that transaction fails. Credit profiles need no rebuild: the summaries
+    account for exactly what left the Loan table.
+    """
+    archive_dir = archive_dir or settings.LOAN_ARCHIVE_DIR
+    archived = 0
+    while True:
+        rows = list(archivable_loans(today, after_days).order_by('loan_id').values(*ARCHIVE_SCHEMA.names)[:batch_size])
+        if not rows:
+            return archived
+        paths = _write_files(rows, archive_dir, range_size)
+        try:
+            with transaction.atomic():
+                _add_to_summaries(rows)
+                loan_ids = [row['loan_id'] for row in rows]
+                Loan.objects.filter(loan_id__in=loan_ids).delete()
+                invalidate(loans=loan_ids, owners={row['customer_id'] for row in rows})
+        except Exception:
+            for path in paths:
+                os.remove(path)
+            raise
+        archived += len(rows)
+
+
+def _read(directory, **options):
+    if not os.path.isdir(directory):
+        return ARCHIVE_SCHEMA.empty_table()
+    return pq.read_table(directory, schema=ARCHIVE_SCHEMA, memory_map=True, **options)
+
+
+def read_archived_loans(customer_id, archive_dir=None, range_size=None):
+    """A customer's archived loans as unsaved Loan instances ordered by loan_id, read through memory maps"""
+    table = _read(range_dir(customer_id, archive_dir, range_size), filters=[('customer_id', '=', customer_id)])
+    # A loan archived again after a failed run appears in more than one file
+    loans = {row['loan_id']: row for row in table.sort_by('loan_id').to_pylist()}
+    return [Loan(is_active=False, **row) for row in loans.values()]
+
+
+def archived_loan_ids(customer_ids, loan_ids, archive_dir=None, range_size=None):
+    """Which of `loan_ids`, loans of `customer_ids`, are in the archive"""
+    directories = {range_dir(customer_id, archive_dir, range_size) for customer_id in customer_ids}
+    filters = [('loan_id', 'in', list(loan_ids))]
+    return {
+        loan_id
+        for directory in directories
+        for loan_id in _read(directory, columns=['loan_id'], filters=filters).column('loan_id').to_pylist()
+    }
+
+
+def archived_rows(frame, closed):
+    """Boolean mask of the rows of a prepared loan frame whose loans are already archived.
+
+    Only loans that are `closed` (a mask over the frame) can have been
+    archived, so only those are looked up.
+    """
+    if not closed.any():
+        return closed
+    archived = archived_loan_ids(frame['customer_id'][closed].tolist(), frame['loan_id'][closed].tolist())
+    return frame['loan_id'].isin(archived).to_numpy()
@@ -0,0 +1,141 @@
+"""Native async versions of the read endpoints, served when ASYNC_VIEWS is set (under ASGI).
+
+They read through Django's async ORM and the asyncio Redis client, so a
+worker keeps many requests in flight while they wait on the database or the
+cache. Responses carry the same JSON as the DRF views in loans.views.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+
+from . import flat_serializers, views
+from .archive import read_archived_loans
+from .db_router import customer_pin, loan_pin, read_alias, replica_reads
+from .eligibility import aget_customer_aggregates, evaluate_eligibility
+from .models import Customer, Loan
+from .pagination import astream_json_array
+from .response_cache import acached_response, customer_version, loan_list_version, loan_version, render_json
+from .serializers import (
+    CustomerLoansSerializer, LoanDetailSerializer, LoanEligibilitySerializer,
+)
+
+
+def async_api_view(methods):
+    """What these views need from DRF's @api_view: allowed methods, parsed JSON bodies and JSON 404s"""
+    allowed = [*methods, 'HEAD'] if 'GET' in methods else list(methods)
+
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                return render_json(
+                    {'detail': f'Method "{request.method}" not allowed.'}, status=405,
+                    headers={'Allow': ', '.join(allowed)},
+                )
+            if request.method == 'POST':
+                try:
+                    request.data = json.loads(request.body) if request.body else {}
+                except ValueError as e:
+                    return render_json({'detail': f'JSON parse error - {e}'}, status=400)
+            try:
+                return await view(request, *args, **kwargs)
+            except Http404 as e:
+                return render_json({'detail': str(e)}, status=404)
+        return wrapper
+    return decorator
+
+
+@async_api_view(['POST'])
+@replica_reads(views._application_pins)
+async def check_eligibility(request):
+    """Check loan eligibility based on credit score"""
+    serializer = LoanEligibilitySerializer(data=request.data)
+    if not serializer.is_valid():
+        return render_json(serializer.errors, status=400)
+
+    data = serializer.validated_data
+    try:
+        customer = await Customer.objects.select_related('credit_profile').aget(customer_id=data['customer_id'])
+    except Customer.DoesNotExist:
+        return render_json({'error': 'Customer not found'}, status=404)
+
+    aggregates = await aget_customer_aggregates(customer)
+    response_data = evaluate_eligibility(
+        customer, data['loan_amount'], data['interest_rate'], data['tenure'], aggregates=aggregates
+    )
+    return render_json(views.eligibility_data(response_data))
+
+
+@async_api_view(['GET'])
+@replica_reads(lambda request, loan_id: [loan_pin(loan_id)])
+async def view_loan(request, loan_id):
+    """View loan details; cached until the loan or its customer changes"""
+    async def build():
+        if settings.FAST_RESPONSES:
+            row = await aget_object_or_404(
+                Loan.objects.in_source().values_list(*flat_serializers.LOAN_DETAIL_FIELDS), loan_id=loan_id
+            )
+            return flat_serializers.loan_detail(row)
+        loan = await aget_object_or_404(Loan.objects.in_source().select_related('customer'), loan_id=loan_id)
+        return LoanDetailSerializer(loan).data
+
+    async def customer_versions():
+        customer_id = await Loan.objects.filter(loan_id=loan_id).values_list('customer_id', flat=True).afirst()
+        return [] if customer_id is None else [customer_version(customer_id)]
+
+    return await acached_response(
+        request, f'loan:{loan_id}', [loan_version(loan_id)], build, resolve_version_keys=customer_versions,
+    )
+
+
+@async_api_view(['GET'])
+async def view_customer_loans(request, customer_id):
+    """View all loans for a customer, with the options of the sync view.
+
+    Keyset pages come from DRF's cursor pagination, which is synchronous, so
+    `?page_size=` and `?cursor=` requests are handed to the sync view.
+    """
+    if 'page_size' in request.GET or 'cursor' in request.GET:
+        return await sync_to_async(views.view_customer_loans)(request, customer_id)
+    return await _customer_loans(request, customer_id)
+
+
+@replica_reads(lambda request, customer_id: [customer_pin(customer_id)])
+async def _customer_loans(request, customer_id):
+    if request.GET.get('stream', '').lower() in ('1', 'true'):
+        customer = await aget_object_or_404(Customer, customer_id=customer_id)
+        # The stream runs after @replica_reads has returned, so it is bound to the view's database here
+        loans = Loan.objects.using(read_alias()).in_source().filter(customer=customer)
+        return astream_json_array(request, loans, CustomerLoansSerializer)
+
+    archived = request.GET.get('archived', '').lower() in ('1', 'true')
+
+    async def build():
+        customer = await aget_object_or_404(Customer, customer_id=customer_id)
+        if settings.FAST_RESPONSES:
+            rows = [row async for row in Loan.objects.in_source().filter(customer=customer).values_list(
+                *flat_serializers.LOAN_ROW_FIELDS
+            )]
+            if archived:
+                current = {row[0] for row in rows}
+                archived_loans = await sync_to_async(read_archived_loans, thread_sensitive=False)(customer_id)
+                rows += [flat_serializers.loan_row(loan) for loan in archived_loans if loan.loan_id not in current]
+            return flat_serializers.customer_loans(rows)
+        loans = [loan async for loan in Loan.objects.in_source().filter(customer=customer)]
+        if archived:
+            # A run interrupted before its commit can leave a loan in both places
+            current = {loan.loan_id for loan in loans}
+            archived_loans = await sync_to_async(read_archived_loans, thread_sensitive=False)(customer_id)
+            loans += [loan for loan in archived_loans if loan.loan_id not in current]
+        return CustomerLoansSerializer(loans, many=True).data
+
+    key = f'customer-loans:{customer_id}' + (':archived' if archived else '')
+    return await acached_response(
+        request, key, [customer_version(customer_id), loan_list_version(customer_id)], build
+    )
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+
+
+def file_digest(file_path, block_size=1024 * 1024):
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _column_to_array(series):
+    """A column as a memory-mappable array, plus a null mask for text columns with gaps"""
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(), None
+    mask = series.isna().to_numpy()
+    values = series.where(~mask, '').astype(str).to_numpy(dtype=str)
+    return values, mask if mask.any() else None
+
+
+def _write_segment(segment_dir, frame):
+    os.makedirs(segment_dir)
+    for position in range(len(frame.columns)):
+        values, mask = _column_to_array(frame.iloc[:, position])
+        np.save(os.path.join(segment_dir, f'{position}.npy'), values, allow_pickle=False)
+        if mask is not None:
+            np.save(os.path.join(segment_dir, f'{position}.mask.npy'), mask, allow_pickle=False)
+
+
+def bundle_path(file_path, cache_dir):
+    """Where the bundle for the file's current contents lives; a changed file maps elsewhere"""
+    return os.path.join(cache_dir, file_digest(file_path))
+
+
+def is_built(bundle_dir):
+    return os.path.exists(os.path.join(bundle_dir, MANIFEST))
+
+
+def build_cache(file_path, bundle_dir, chunks):
+    """Write `chunks` (DataFrames read from `file_path`) to `bundle_dir` as .npy segments.
+
+    The bundle is published with an atomic rename, so concurrent builders never
+    expose a partial bundle. Older bundles of the same source are removed.
+    """
+    source = os.path.abspath(file_path)
+    cache_dir, digest = os.path.split(bundle_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    building_dir = os.path.join(cache_dir, f'.{digest}.{uuid.uuid4().hex}')
+    os.makedirs(building_dir)
+
+    columns = None
+    segments = []
+    try:
+        for chunk in chunks:
+            if columns is None:
+                columns = [str(column) for column in chunk.columns]
+            _write_segment(os.path.join(building_dir, f'segment-{len(segments):05d}'), chunk)
+            segments.append(len(chunk))
+        with open(os.path.join(building_dir, MANIFEST), 'w') as manifest:
+            json.dump({'source': source, 'columns': columns or [], 'segments': segments}, manifest)
+        try:
+            os.rename(building_dir, bundle_dir)
+        except OSError:
+            # Another process published the same bundle first
+            shutil.rmtree(building_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(building_dir, ignore_errors=True)
+        raise
+
+    prune_cache(cache_dir, source, keep=digest)
+
+
+def prune_cache(cache_dir, source, keep=None):
+    """Remove bundles built from `source` other than `keep`"""
+    for name in os.listdir(cache_dir):
+        manifest_path = os.path.join(cache_dir, name, MANIFEST)
+        if name == keep or not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path) as manifest:
+            if json.load(manifest)['source'] == source:
+                shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def read_bundle(bundle_dir, skip_rows=0):
+    """Yield a bundle segment by segment as DataFrames over memory-mapped arrays.
+
+    Segments lying entirely before `skip_rows` are never opened; the first
+    yielded segment starts at row `skip_rows`.
+    """
+    with open(os.path.join(bundle_dir, MANIFEST)) as manifest:
+        meta = json.load(manifest)
+
+    for index, length in enumerate(meta['segments']):
+        if skip_rows >= length:
+            skip_rows -= length
+            continue
+        segment_dir = os.path.join(bundle_dir, f'segment-{index:05d}')
+        data = {}
+        for position, column in enumerate(meta['columns']):
+            values = np.load(os.path.join(segment_dir, f'{position}.npy'), mmap_mode='r')[skip_rows:]
+            mask_path = os.path.join(segment_dir, f'{position}.mask.npy')
+            if os.path.exists(mask_path):
+                series = pd.Series(values, dtype=object)
+                series[np.load(mask_path)[skip_rows:]] = None
+                data[column] = series
+            else:
+                data[column] = values
+        skip_rows = 0
+        yield pd.DataFrame(data, copy=False)
@@ -0,0 +1,132 @@
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Customer, CustomerCreditProfile, Loan
+
+PROFILE_FIELDS = [
+    'num_loans', 'total_emis', 'paid_on_time', 'total_volume',
+    'total_monthly_installment', 'current_year_volume', 'volume_year',
+    'active_volume', 'active_monthly_installment',
+]
+# Totals of archived loans (ArchivedLoanSummary), added to the matching profile fields
+ARCHIVED_FIELDS = ['num_loans', 'total_emis', 'paid_on_time', 'total_volume', 'total_monthly_installment']
+
+
+def started_this_year(prefix=''):
+    """Q for loans started in the current calendar year, as a start_date range the indexes can serve"""
+    year = date.today().year
+    return Q(**{f'{prefix}start_date__gte': date(year, 1, 1), f'{prefix}start_date__lt': date(year + 1, 1, 1)})
+
+
+def compute_credit_profiles(customer_ids=None, chunk_size=2000):
+    """Yield unsaved CustomerCreditProfile rows recomputed from the Loan table and archived loan totals"""
+    current_year = date.today().year
+    customers = Customer.objects.all()
+    if customer_ids is not None:
+        customers = customers.filter(customer_id__in=list(customer_ids))
+
+    # Loans removed from the ingestion source no longer count
+    in_source = Q(loans__removed_from_source_at__isnull=True)
+    rows = customers.order_by('customer_id').annotate(
+        agg_num_loans=Count('loans', filter=in_source),
+        agg_total_emis=Coalesce(Sum('loans__tenure', filter=in_source), 0),
+        agg_paid_on_time=Coalesce(Sum('loans__emis_paid_on_time', filter=in_source), 0),
+        agg_total_volume=Sum('loans__loan_amount', filter=in_source),
+        agg_total_monthly_installment=Sum('loans__monthly_installment', filter=in_source),
+        agg_current_year_volume=Sum('loans__loan_amount', filter=in_source & started_this_year('loans__')),
+        agg_active_volume=Sum('loans__loan_amount', filter=in_source & Q(loans__is_active=True)),
+        agg_active_monthly_installment=Sum('loans__monthly_installment', filter=in_source & Q(loans__is_active=True)),
+    ).values_list(
+        'customer_id', 'agg_num_loans', 'agg_total_emis', 'agg_paid_on_time',
+        'agg_total_volume', 'agg_total_monthly_installment', 'agg_current_year_volume',
+        'agg_active_volume', 'agg_active_monthly_installment',
+        *(f'archived_loans__{field}' for field in ARCHIVED_FIELDS),
+    )
+
+    for (customer_id, num_loans, total_emis, paid_on_time, total_volume, total_emi, year_volume,
+         active_volume, active_emi, *archived) in rows.iterator(chunk_size=chunk_size):
+        archived_loans, archived_emis, archived_paid, archived_volume, archived_emi = (value or 0 for value in archived)
+        yield CustomerCreditProfile(
+            customer_id=customer_id,
+            num_loans=num_loans + archived_loans,
+            total_emis=total_emis + archived_emis,
+            paid_on_time=paid_on_time + archived_paid,
+            total_volume=(total_volume or 0) + archived_volume,
+            total_monthly_installment=(total_emi or 0) + archived_emi,
+            current_year_volume=year_volume or 0,
+            volume_year=current_year,
+            active_volume=active_volume or 0,
+            active_monthly_installment=active_emi or 0,
+        )
+
+
+def rebuild_credit_profiles(customer_ids=None, batch_size=2000):
+    """Recompute and upsert credit profiles; returns the number of profiles written"""
+    written = 0
+    batch = []
+    for profile in compute_credit_profiles(customer_ids, chunk_size=batch_size):
+        batch.append(profile)
+        if len(batch) >= batch_size:
+            written += _upsert_profiles(batch)
+            batch = []
+    if batch:
+        written += _upsert_profiles(batch)
+    return written
+
+
+def _upsert_profiles(profiles):
+    CustomerCreditProfile.objects.bulk_create(
+        profiles,
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=PROFILE_FIELDS,
+    )
+    return len(profiles)
+
+
+def record_new_loan(loan):
+    """Add a newly created loan to its customer's profile with a single UPDATE.
+
+    Must be called inside the transaction that created the loan. Falls back to
+    a full rebuild for customers that do not have a profile yet.
+    """
+    year = loan.start_date.year
+    updated = CustomerCreditProfile.objects.filter(customer_id=loan.customer_id).update(
+        num_loans=F('num_loans') + 1,
+        total_emis=F('total_emis') + loan.tenure,
+        paid_on_time=F('paid_on_time') + loan.emis_paid_on_time,
+        total_volume=F('total_volume') + loan.loan_amount,
+        total_monthly_installment=F('total_monthly_installment') + loan.monthly_installment,
+        current_year_volume=Case(
+            When(volume_year=year, then=F('current_year_volume') + loan.loan_amount),
+            When(volume_year__lt=year, then=Value(loan.loan_amount)),
+            default=F('current_year_volume'),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        ),
+        volume_year=Greatest(F('volume_year'), Value(year)),
+        active_volume=F('active_volume') + (loan.loan_amount if loan.is_active else 0),
+        active_monthly_installment=F('active_monthly_installment') + (loan.monthly_installment if loan.is_active else 0),
+    )
+    if not updated:
+        rebuild_credit_profiles([loan.customer_id])
+
+
+def close_finished_loans(today=None, batch_size=5000):
+    """Deactivate loans that have ended or been fully repaid, and refresh their customers' profiles.
+
+    Reads only active loans, so its cost follows the active set rather than the
+    loan history. Each batch is committed on its own. Returns the number of
+    loans closed.
+    """
+    closed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Loan.objects.due_to_close(today).values_list('loan_id', 'customer_id')[:batch_size])
+            if not batch:
+                return closed
+            Loan.objects.filter(loan_id__in=[loan_id for loan_id, _ in batch]).update(is_active=False)
+            rebuild_credit_profiles({customer_id for _, customer_id in batch})
+        closed += len(batch)
@@ -0,0 +1,38 @@
+"""Database connection reuse metrics.
+
+Connections are pooled (DB_POOL_* settings) or kept open for DB_CONN_MAX_AGE
+seconds; pools live in each process, so their figures cover the process that
+serves the metrics request.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def pool_metrics(alias=DEFAULT_DB_ALIAS):
+    """How a database alias reuses connections, with the pool's wait time and utilization"""
+    connection = connections[alias]
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return {
+            'pooled': False,
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+        }
+
+    stats = pool.get_stats()
+    in_use = stats['pool_size'] - stats['pool_available']
+    requests = stats.get('requests_num', 0)
+    return {
+        'pooled': True,
+        'min_size': pool.min_size,
+        'max_size': pool.max_size,
+        'size': stats['pool_size'],
+        'in_use': in_use,
+        'utilization': round(in_use / pool.max_size, 4),
+        'requests': requests,
+        'requests_waiting': stats['requests_waiting'],
+        'requests_queued': stats.get('requests_queued', 0),
+        'requests_errors': stats.get('requests_errors', 0),
+        'avg_wait_ms': round(stats.get('requests_wait_ms', 0) / requests, 2) if requests else None,
+        'connections_opened': stats.get('connections_num', 0),
+        'connections_lost': stats.get('connections_lost', 0),
+    }
@@ -0,0 +1,256 @@
+"""Read replica routing.
+
+Views decorated with @replica_reads run their queries against a healthy
+replica from DATABASE_REPLICAS; every other query, including the reads made
+inside a write, goes to the primary. Rows written in the last
+REPLICA_PIN_SECONDS are pinned to the primary, so clients read their own
+writes, and a replica that fails its health check or a query is skipped until
+it is checked again after REPLICA_HEALTH_CHECK_SECONDS.
+"""
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from redis.exceptions import RedisError
+
+from .metrics import aincrement, increment, read_counters
+from .redis_store import get_async_redis, get_redis, mark_unavailable
+
+logger = logging.getLogger(__name__)
+
+METRICS_GROUP = 'replica_reads'
+# Seconds the replica is behind, or 0 when it has replayed everything it received
+LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+_read_alias = ContextVar('replica_read_alias', default=None)
+# alias -> (passed, monotonic time of the check)
+_health = {}
+# Pins recorded while Redis is unreachable only hold in this process
+_local_pins = {}
+_local_lock = threading.Lock()
+
+
+def read_alias():
+    """The database the current view reads from.
+
+    Querysets evaluated after the view returns, such as those of a streamed
+    response, are past @replica_reads and must be bound with .using(read_alias()).
+    """
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Reads inside @replica_reads views go to the chosen replica; everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def customer_pin(customer_id):
+    return f'replica-pin:customer:{customer_id}'
+
+
+def loan_pin(loan_id):
+    return f'replica-pin:loan:{loan_id}'
+
+
+def pin_to_primary(keys):
+    """Read the rows behind these pin keys from the primary for the next REPLICA_PIN_SECONDS"""
+    if not settings.DATABASE_REPLICAS or not keys:
+        return
+    client = get_redis()
+    if client is not None:
+        try:
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.set(key, 1, ex=settings.REPLICA_PIN_SECONDS)
+            pipeline.execute()
+            return
+        except RedisError as e:
+            mark_unavailable(e)
+    now = time.monotonic()
+    with _local_lock:
+        for key in [key for key, expires in _local_pins.items() if expires <= now]:
+            del _local_pins[key]
+        _local_pins.update(dict.fromkeys(keys, now + settings.REPLICA_PIN_SECONDS))
+
+
+def _pinned_locally(keys):
+    now = time.monotonic()
+    with _local_lock:
+        return any(_local_pins.get(key, 0) > now for key in keys)
+
+
+def is_pinned(keys):
+    if not keys:
+        return False
+    if _pinned_locally(keys):
+        return True
+    client = get_redis()
+    if client is not None:
+        try:
+            return any(client.mget(keys))
+        except RedisError as e:
+            mark_unavailable(e)
+    return False
+
+
+async def ais_pinned(keys):
+    if not keys:
+        return False
+    if _pinned_locally(keys):
+        return True
+    client = get_async_redis()
+    if client is not None:
+        try:
+            return any(await client.mget(keys))
+        except RedisError as e:
+            mark_unavailable(e)
+    return False
+
+
+def replica_lag(alias):
+    """Seconds the replica's data is behind the primary"""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute('SELECT 1')
+            return 0
+        cursor.execute(LAG_SQL)
+        return float(cursor.fetchone()[0] or 0)
+
+
+def _passes_health_check(alias):
+    try:
+        lag = replica_lag(alias)
+    except DatabaseError as e:
+        logger.warning('Replica %s unavailable, reading from the primary: %s', alias, e)
+        return False
+    if lag > settings.REPLICA_MAX_LAG_SECONDS:
+        logger.warning('Replica %s is %.1fs behind, reading from the primary', alias, lag)
+        return False
+    return True
+
+
+def _health_check_due(alias, now):
+    checked_at = _health.get(alias, (False, None))[1]
+    return checked_at is None or now - checked_at >= settings.REPLICA_HEALTH_CHECK_SECONDS
+
+
+def healthy_replica():
+    """A replica that passed its latest health check, or None to read from the primary"""
+    now = time.monotonic()
+    for alias in random.sample(settings.DATABASE_REPLICAS, len(settings.DATABASE_REPLICAS)):
+        if _health_check_due(alias, now):
+            _health[alias] = (_passes_health_check(alias), now)
+        if _health[alias][0]:
+            return alias
+    return None
+
+
+async def ahealthy_replica():
+    """healthy_replica() for async views; only a due health check leaves the event loop"""
+    now = time.monotonic()
+    if any(_health_check_due(alias, now) for alias in settings.DATABASE_REPLICAS):
+        return await sync_to_async(healthy_replica)()
+    passed = [alias for alias in settings.DATABASE_REPLICAS if _health[alias][0]]
+    return random.choice(passed) if passed else None
+
+
+def replica_reads(pin_keys):
+    """Run a read-only view against a replica, unless the rows it shows were written recently.
+
+    `pin_keys(request, *args, **kwargs)` names the pins (customer_pin,
+    loan_pin) of the rows the view reads. If the view fails with a database
+    error on the replica, the replica is marked unhealthy and the view runs
+    again on the primary. Async views are wrapped by an async wrapper; the
+    chosen alias reaches their ORM calls through the context variable.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            return _async_replica_reads(view, pin_keys)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.DATABASE_REPLICAS:
+                return view(request, *args, **kwargs)
+            if is_pinned(pin_keys(request, *args, **kwargs)):
+                increment(METRICS_GROUP, 'pinned')
+                return view(request, *args, **kwargs)
+            alias = healthy_replica()
+            if alias is None:
+                increment(METRICS_GROUP, 'primary')
+                return view(request, *args, **kwargs)
+
+            token = _read_alias.set(alias)
+            try:
+                response = view(request, *args, **kwargs)
+            except DatabaseError as e:
+                logger.warning('Read on replica %s failed, retrying on the primary: %s', alias, e)
+                _health[alias] = (False, time.monotonic())
+                increment(METRICS_GROUP, 'fallbacks')
+            else:
+                increment(METRICS_GROUP, 'replica')
+                return response
+            finally:
+                _read_alias.reset(token)
+            return view(request, *args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def _async_replica_reads(view, pin_keys):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not settings.DATABASE_REPLICAS:
+            return await view(request, *args, **kwargs)
+        if await ais_pinned(pin_keys(request, *args, **kwargs)):
+            await aincrement(METRICS_GROUP, 'pinned')
+            return await view(request, *args, **kwargs)
+        alias = await ahealthy_replica()
+        if alias is None:
+            await aincrement(METRICS_GROUP, 'primary')
+            return await view(request, *args, **kwargs)
+
+        token = _read_alias.set(alias)
+        try:
+            response = await view(request, *args, **kwargs)
+        except DatabaseError as e:
+            logger.warning('Read on replica %s failed, retrying on the primary: %s', alias, e)
+            _health[alias] = (False, time.monotonic())
+            await aincrement(METRICS_GROUP, 'fallbacks')
+        else:
+            await aincrement(METRICS_GROUP, 'replica')
+            return response
+        finally:
+            _read_alias.reset(token)
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def replica_metrics():
+    """Where replica-eligible reads were served from"""
+    counters = read_counters(METRICS_GROUP)
+    return {name: counters.get(name, 0) for name in ('replica', 'primary', 'pinned', 'fallbacks')}
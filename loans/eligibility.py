@@ -0,0 +1,227 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.sql import InsertQuery
+
+from .credit_profiles import record_new_loan, started_this_year
+from .db_router import loan_pin, pin_to_primary
+from .models import ArchivedLoanSummary, Customer, CustomerCreditProfile, Loan
+from .pricing import monthly_installment
+from .response_cache import invalidate
+
+
+def _loan_aggregates(customer):
+    def with_archived(aggregate, field):
+        archived = ArchivedLoanSummary.objects.filter(customer_id=customer.pk).values(field)
+        output_field = ArchivedLoanSummary._meta.get_field(field)
+        return (Coalesce(aggregate, 0, output_field=output_field)
+                + Coalesce(Subquery(archived), 0, output_field=output_field))
+
+    return dict(
+        num_loans=with_archived(Count('loan_id'), 'num_loans'),
+        total_emis=with_archived(Sum('tenure'), 'total_emis'),
+        paid_on_time=with_archived(Sum('emis_paid_on_time'), 'paid_on_time'),
+        total_volume=with_archived(Sum('loan_amount'), 'total_volume'),
+        current_year_volume=Sum('loan_amount', filter=started_this_year()),
+        total_monthly_installment=with_archived(Sum('monthly_installment'), 'total_monthly_installment'),
+        active_volume=Sum('loan_amount', filter=Q(is_active=True)),
+        active_monthly_installment=Sum('monthly_installment', filter=Q(is_active=True)),
+    )
+
+
+def get_loan_aggregates(customer):
+    """Fetch every loan aggregate used by the eligibility checks in one query, archived loans included.
+
+    Loans removed from the ingestion source are left out.
+    """
+    return Loan.objects.in_source().filter(customer=customer).aggregate(**_loan_aggregates(customer))
+
+
+async def aget_loan_aggregates(customer):
+    return await Loan.objects.in_source().filter(customer=customer).aaggregate(**_loan_aggregates(customer))
+
+
+def get_customer_aggregates(customer):
+    """Read loan aggregates from the customer's credit profile, falling back to the Loan table"""
+    try:
+        return customer.credit_profile.as_aggregates()
+    except CustomerCreditProfile.DoesNotExist:
+        return get_loan_aggregates(customer)
+
+
+async def aget_customer_aggregates(customer):
+    """get_customer_aggregates() for a customer loaded with select_related('credit_profile')"""
+    try:
+        return customer.credit_profile.as_aggregates()
+    except CustomerCreditProfile.DoesNotExist:
+        return await aget_loan_aggregates(customer)
+
+
+def score_from_aggregates(aggregates):
+    """Calculate credit score from the values returned by get_loan_aggregates"""
+    if not aggregates['num_loans']:
+        return 0
+
+    score = 0
+
+    # Component 1: Past Loans paid on time (0-20 points)
+    total_emis = aggregates['total_emis'] or 0
+    paid_on_time = aggregates['paid_on_time'] or 0
+    if total_emis > 0:
+        on_time_percentage = (paid_on_time / total_emis) * 100
+        score += min(20, on_time_percentage * 0.2)
+
+    # Component 2: Number of loans taken (0-20 points)
+    num_loans = aggregates['num_loans']
+    score += min(20, num_loans * 2)
+
+    # Component 3: Loan activity in current year (0-30 points)
+    current_year_volume = float(aggregates['current_year_volume'] or 0)
+    score += min(30, current_year_volume / 10000)  # 1 point per 10k
+
+    # Component 4: Loan approved volume (0-30 points)
+    total_volume = float(aggregates['total_volume'] or 0)
+    score += min(30, total_volume / 10000)  # 1 point per 10k
+
+    return min(100, score)
+
+
+def calculate_credit_score(customer, aggregates=None):
+    """Calculate credit score based on historical loan data"""
+    if aggregates is None:
+        aggregates = get_loan_aggregates(customer)
+    return score_from_aggregates(aggregates)
+
+
+def evaluate_eligibility(customer, loan_amount, interest_rate, tenure, aggregates=None):
+    """Decide a loan application; returns the check-eligibility response data"""
+    if aggregates is None:
+        aggregates = get_customer_aggregates(customer)
+
+    # Check if sum of current (active) loans > approved limit
+    current_debt = float(aggregates['active_volume'] or 0)
+    if current_debt + float(loan_amount) > float(customer.approved_limit):
+        return {
+            'customer_id': customer.customer_id,
+            'approval': False,
+            'interest_rate': interest_rate,
+            'tenure': tenure,
+            'monthly_installment': 0
+        }
+
+    # Check if sum of current (active) EMIs > 50% of monthly salary
+    current_emis = float(aggregates['active_monthly_installment'] or 0)
+    if current_emis > float(customer.monthly_salary) * 0.5:
+        return {
+            'customer_id': customer.customer_id,
+            'approval': False,
+            'interest_rate': interest_rate,
+            'tenure': tenure,
+            'monthly_installment': 0
+        }
+
+    # Calculate credit score
+    credit_score = calculate_credit_score(customer, aggregates)
+
+    # Determine approval and interest rate correction
+    approval = False
+    corrected_interest_rate = interest_rate
+
+    if credit_score > 50:
+        approval = True
+    elif 30 < credit_score <= 50:
+        approval = True
+        if interest_rate < 12:
+            corrected_interest_rate = Decimal('12.00')
+    elif 10 < credit_score <= 30:
+        approval = True
+        if interest_rate < 16:
+            corrected_interest_rate = Decimal('16.00')
+    else:
+        approval = False
+
+    return {
+        'customer_id': customer.customer_id,
+        'approval': approval,
+        'interest_rate': interest_rate,
+        'corrected_interest_rate': corrected_interest_rate,
+        'tenure': tenure,
+        'monthly_installment': monthly_installment(loan_amount, corrected_interest_rate, tenure)
+    }
+
+
+LOAN_WRITE_METHODS = ('auto', 'cte', 'orm')
+
+
+def insert_loan(loan, method=None):
+    """Save a new loan and add its amount to the customer's current_debt.
+
+    With the 'cte' method (the default on PostgreSQL) both writes are one
+    statement, a data-modifying CTE, so they cost a single round trip; its text
+    is the same for every loan, so the server prepares it once per connection.
+    """
+    method = method or settings.LOAN_WRITE_METHOD
+    if method not in LOAN_WRITE_METHODS:
+        raise ValueError(f"Unknown loan write method {method!r}, expected one of {', '.join(LOAN_WRITE_METHODS)}")
+    if method == 'auto':
+        method = 'cte' if connection.vendor == 'postgresql' else 'orm'
+    if method == 'orm':
+        loan.save(force_insert=True)
+        Customer.objects.filter(customer_id=loan.customer_id).update(current_debt=F('current_debt') + loan.loan_amount)
+        return
+
+    loan.is_active = loan.is_open()
+    query = InsertQuery(Loan)
+    query.insert_values([field for field in Loan._meta.concrete_fields if not field.primary_key], [loan])
+    compiler = query.get_compiler(connection=connection)
+    compiler.returning_fields = [Loan._meta.pk]
+    [(insert_sql, insert_params)] = compiler.as_sql()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH new_loan AS ({insert_sql}), '
+            f'debt AS (UPDATE {quote(Customer._meta.db_table)} SET current_debt = current_debt + %s '
+            f'WHERE customer_id = %s) '
+            f'SELECT {quote(Loan._meta.pk.column)} FROM new_loan',
+            [*insert_params, loan.loan_amount, loan.customer_id],
+        )
+        loan.pk = cursor.fetchone()[0]
+    loan._state.adding = False
+    loan._state.db = connection.alias
+
+
+def create_loan_if_eligible(customer_id, loan_amount, interest_rate, tenure):
+    """Decide a loan application and, if approved, create the loan in the same transaction.
+
+    The customer row is locked first, so concurrent applications for one
+    customer are decided one at a time, each seeing the loans created before
+    it. Debt is incremented in the database rather than by re-saving a
+    stale customer. Returns (loan or None, eligibility data); raises
+    Customer.DoesNotExist for unknown customers.
+    """
+    with transaction.atomic():
+        customer = Customer.objects.select_for_update().get(customer_id=customer_id)
+        eligibility = evaluate_eligibility(customer, loan_amount, interest_rate, tenure)
+        if not eligibility['approval']:
+            return None, eligibility
+
+        start_date = date.today()
+        loan = Loan(
+            customer=customer,
+            loan_amount=loan_amount,
+            tenure=tenure,
+            interest_rate=eligibility.get('corrected_interest_rate', interest_rate),
+            monthly_installment=eligibility['monthly_installment'],
+            start_date=start_date,
+            end_date=start_date + timedelta(days=30 * tenure)
+        )
+        insert_loan(loan)
+        record_new_loan(loan)
+        invalidate(owners=[customer_id])
+        # Clients read a new loan straight away, before the replicas have it
+        pin_to_primary([loan_pin(loan.loan_id)])
+    return loan, eligibility
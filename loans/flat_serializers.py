@@ -0,0 +1,88 @@
+"""Flat serializers for the hot endpoints, used when FAST_RESPONSES is set.
+
+Each builds exactly the data of its DRF serializer in loans.serializers, but
+from `.values_list()` rows or plain dicts: no model instances, and the field
+conversions are bound once at import instead of being looked up per field.
+"""
+from decimal import Decimal
+
+from rest_framework import serializers
+
+
+def _decimal(max_digits, decimal_places):
+    """DecimalField(max_digits, decimal_places).to_representation with a shortcut for column values"""
+    to_representation = serializers.DecimalField(max_digits=max_digits, decimal_places=decimal_places).to_representation
+    exponent = -decimal_places
+
+    def represent(value):
+        # A value read from the column already has its decimal places, which DRF keeps as they are
+        if type(value) is Decimal and value.as_tuple().exponent == exponent:
+            return format(value, 'f')
+        return to_representation(value)
+    return represent
+
+
+_amount = _decimal(15, 2)
+_rate = _decimal(5, 2)
+
+# Columns of a customer-loans row
+LOAN_ROW_FIELDS = ('loan_id', 'loan_amount', 'interest_rate', 'monthly_installment', 'tenure', 'emis_paid_on_time')
+# Columns of a loan-detail row
+LOAN_DETAIL_FIELDS = (
+    'loan_id', 'customer_id', 'customer__first_name', 'customer__last_name', 'customer__phone_number',
+    'customer__age', 'loan_amount', 'interest_rate', 'monthly_installment', 'tenure',
+)
+
+
+def loan_row(loan):
+    """The LOAN_ROW_FIELDS row of a Loan instance, such as an archived loan"""
+    return (loan.loan_id, loan.loan_amount, loan.interest_rate, loan.monthly_installment, loan.tenure,
+            loan.emis_paid_on_time)
+
+
+def customer_loans(rows):
+    """CustomerLoansSerializer(many=True).data for LOAN_ROW_FIELDS rows"""
+    return [
+        {
+            'loan_id': loan_id,
+            'loan_amount': _amount(loan_amount),
+            'interest_rate': _rate(interest_rate),
+            'monthly_installment': _amount(monthly_installment),
+            'repayments_left': max(0, tenure - emis_paid_on_time),
+        }
+        for loan_id, loan_amount, interest_rate, monthly_installment, tenure, emis_paid_on_time in rows
+    ]
+
+
+def loan_detail(row):
+    """LoanDetailSerializer data for a LOAN_DETAIL_FIELDS row"""
+    (loan_id, customer_id, first_name, last_name, phone_number, age,
+     loan_amount, interest_rate, monthly_installment, tenure) = row
+    return {
+        'loan_id': loan_id,
+        'customer': {
+            'id': customer_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'phone_number': phone_number,
+            'age': age,
+        },
+        'loan_amount': _amount(loan_amount),
+        'interest_rate': _rate(interest_rate),
+        'monthly_installment': _amount(monthly_installment),
+        'tenure': tenure,
+    }
+
+
+def eligibility(result):
+    """LoanEligibilityResponseSerializer data for an evaluate_eligibility result"""
+    data = {
+        'customer_id': int(result['customer_id']),
+        'approval': bool(result['approval']),
+        'interest_rate': _rate(result['interest_rate']),
+    }
+    if 'corrected_interest_rate' in result:
+        data['corrected_interest_rate'] = _rate(result['corrected_interest_rate'])
+    data['tenure'] = int(result['tenure'])
+    data['monthly_installment'] = _amount(result['monthly_installment'])
+    return data
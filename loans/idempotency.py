@@ -0,0 +1,188 @@
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import hit_rate, increment, read_counters
+from .models import IdempotencyRecord
+from .redis_store import get_redis, mark_unavailable
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+METRICS_GROUP = 'idempotency'
+POLL_SECONDS = 0.05
+
+
+class RedisIdempotencyStore:
+    """Records as JSON under idempotency:<key>, plus a sorted set of expiry times for sizing"""
+    prefix = 'idempotency:'
+    index = 'idempotency-index'
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value else None
+
+    def claim(self, key, fingerprint, ttl):
+        record = json.dumps({'fingerprint': fingerprint, 'status': None, 'body': None})
+        if not self.client.set(self.prefix + key, record, nx=True, ex=ttl):
+            return False
+        self.client.zadd(self.index, {key: time.time() + ttl})
+        return True
+
+    def save(self, key, record, ttl):
+        self.client.set(self.prefix + key, json.dumps(record), ex=ttl)
+        self.client.zadd(self.index, {key: time.time() + ttl})
+
+    def release(self, key):
+        self.client.delete(self.prefix + key)
+        self.client.zrem(self.index, key)
+
+    def size(self):
+        self.client.zremrangebyscore(self.index, '-inf', time.time())
+        return self.client.zcard(self.index)
+
+
+class DatabaseIdempotencyStore:
+    """IdempotencyRecord rows, used while Redis is unavailable"""
+
+    def get(self, key):
+        record = IdempotencyRecord.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+        if record is None:
+            return None
+        return {'fingerprint': record.request_fingerprint, 'status': record.status_code, 'body': record.response}
+
+    def claim(self, key, fingerprint, ttl):
+        now = timezone.now()
+        IdempotencyRecord.objects.filter(key=key, expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(
+                    key=key, request_fingerprint=fingerprint, expires_at=now + timedelta(seconds=ttl)
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    def save(self, key, record, ttl):
+        IdempotencyRecord.objects.update_or_create(key=key, defaults={
+            'request_fingerprint': record['fingerprint'],
+            'status_code': record['status'],
+            'response': record['body'],
+            'expires_at': timezone.now() + timedelta(seconds=ttl),
+        })
+
+    def release(self, key):
+        IdempotencyRecord.objects.filter(key=key).delete()
+
+    def size(self):
+        return IdempotencyRecord.objects.filter(expires_at__gt=timezone.now()).count()
+
+
+def _store_call(operation, *args):
+    """Run a store operation on Redis, falling back to the database when Redis is unavailable"""
+    client = get_redis()
+    if client is not None:
+        try:
+            return getattr(RedisIdempotencyStore(client), operation)(*args)
+        except RedisError as e:
+            mark_unavailable(e)
+            increment(METRICS_GROUP, 'fallbacks')
+    return getattr(DatabaseIdempotencyStore(), operation)(*args)
+
+
+def request_fingerprint(request):
+    """Hash of the endpoint and parsed payload, so formatting differences do not matter"""
+    data = request.data.dict() if hasattr(request.data, 'dict') else request.data
+    payload = json.dumps([request.path, data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def idempotent(view):
+    """Replay the first response to requests repeating the same Idempotency-Key header.
+
+    The first request claims the key and runs the view; its response (unless
+    it is a server error) is stored for IDEMPOTENCY_TTL_SECONDS. Repeats get
+    the stored response without running the view. A repeat arriving while the
+    first request is still running waits up to IDEMPOTENCY_WAIT_SECONDS for it,
+    then gets 409 Conflict. Reusing a key for a different payload is a 422.
+    Requests without the header are unaffected.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = _store_call('get', key)
+            if record is None:
+                if _store_call('claim', key, fingerprint, settings.IDEMPOTENCY_LOCK_SECONDS):
+                    break
+                # Otherwise another request claimed the key first; wait for its response
+            elif record['fingerprint'] != fingerprint:
+                increment(METRICS_GROUP, 'mismatches')
+                return Response(
+                    {'error': f'{HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            elif record['status'] is not None:
+                increment(METRICS_GROUP, 'hits')
+                return Response(record['body'], status=record['status'], headers={REPLAYED_HEADER: 'true'})
+            if time.monotonic() >= deadline:
+                increment(METRICS_GROUP, 'conflicts')
+                return Response(
+                    {'error': f'A request with this {HEADER} is still being processed'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            time.sleep(POLL_SECONDS)
+
+        increment(METRICS_GROUP, 'misses')
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            _store_call('release', key)
+            raise
+        if response.status_code >= 500:
+            _store_call('release', key)
+        else:
+            body = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+            record = {'fingerprint': fingerprint, 'status': response.status_code, 'body': body}
+            _store_call('save', key, record, settings.IDEMPOTENCY_TTL_SECONDS)
+        return response
+
+    return wrapper
+
+
+def idempotency_metrics():
+    """Hit rate and store size of the Idempotency-Key store"""
+    counters = read_counters(METRICS_GROUP)
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hit_rate(hits, misses),
+        'conflicts': counters.get('conflicts', 0),
+        'mismatches': counters.get('mismatches', 0),
+        'fallbacks': counters.get('fallbacks', 0),
+        'store_size': _store_call('size'),
+    }
@@ -0,0 +1,338 @@
+import io
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .archive import archived_rows
+from .credit_profiles import rebuild_credit_profiles
+from .models import Customer, CustomerCreditProfile, Loan
+from .partitions import partition_key
+from .response_cache import invalidate
+
+# Accepted source column names for each model field, in order of preference
+CUSTOMER_COLUMNS = {
+    'customer_id': ('customer_id', 'Customer ID'),
+    'first_name': ('first_name', 'First Name'),
+    'last_name': ('last_name', 'Last Name'),
+    'phone_number': ('phone_number', 'Phone Number'),
+    'monthly_salary': ('monthly_salary', 'Monthly Salary'),
+    'approved_limit': ('approved_limit', 'Approved Limit'),
+    'current_debt': ('current_debt', 'Current Debt'),
+    'age': ('age', 'Age'),
+}
+
+LOAN_COLUMNS = {
+    'customer_id': ('customer id', 'Customer ID'),
+    'loan_id': ('loan id', 'Loan ID'),
+    'loan_amount': ('loan amount', 'Loan Amount'),
+    'tenure': ('tenure', 'Tenure'),
+    'interest_rate': ('interest rate', 'Interest Rate'),
+    'monthly_installment': ('monthly repayment (emi)', 'Monthly payment'),
+    'emis_paid_on_time': ('EMIs paid on time', 'EMIs paid on Time'),
+    'start_date': ('start date', 'Date of Approval'),
+    'end_date': ('end date', 'End Date'),
+}
+
+INGEST_METHODS = ('auto', 'bulk', 'copy')
+
+# What to do with previously ingested rows that no longer appear in the source
+MISSING_ROW_ACTIONS = ('ignore', 'report', 'soft-delete')
+
+
+def normalize_columns(df, aliases):
+    """Rename source columns to model field names and keep only known fields"""
+    renames = {}
+    for field, names in aliases.items():
+        for name in names:
+            if name in df.columns:
+                renames[name] = field
+                break
+    return df.rename(columns=renames)[list(renames.values())].copy()
+
+
+def prepare_customers(df):
+    frame = normalize_columns(df, CUSTOMER_COLUMNS)
+    frame['age'] = frame['age'].fillna(25).astype(int) if 'age' in frame else 25
+    frame['current_debt'] = frame['current_debt'].fillna(0) if 'current_debt' in frame else 0
+    frame['phone_number'] = frame['phone_number'].astype(str)
+    # The last occurrence of a duplicated id wins, as with row-by-row upserts
+    return frame.drop_duplicates('customer_id', keep='last')
+
+
+def prepare_loans(df):
+    frame = normalize_columns(df, LOAN_COLUMNS)
+    frame['start_date'] = pd.to_datetime(frame['start_date']).dt.date
+    frame['end_date'] = pd.to_datetime(frame['end_date']).dt.date
+    return frame.drop_duplicates('loan_id', keep='last')
+
+
+def resolve_method(method):
+    if method not in INGEST_METHODS:
+        raise ValueError(f"Unknown ingestion method {method!r}, expected one of {', '.join(INGEST_METHODS)}")
+    if method == 'auto':
+        return 'copy' if connection.vendor == 'postgresql' else 'bulk'
+    return method
+
+
+def upsert_frame(model, frame, batch_size, method='auto'):
+    """Insert or update every row of `frame` (columns named by field attname) in batches"""
+    method = resolve_method(method)
+    if method == 'copy' and connection.vendor != 'postgresql':
+        raise ValueError('The copy ingestion method requires PostgreSQL')
+
+    # A partitioned table is only unique on its primary key together with its partition key
+    partition_fields = partition_key(model)
+    for start in range(0, len(frame), batch_size):
+        chunk = frame.iloc[start:start + batch_size]
+        if partition_fields:
+            _delete_moved_rows(model, chunk, partition_fields)
+        if method == 'copy':
+            _copy_upsert(model, chunk, partition_fields)
+        else:
+            _bulk_upsert(model, chunk, partition_fields)
+
+
+def _delete_moved_rows(model, frame, partition_fields):
+    """Delete stored rows whose partition key changed, so the upsert inserts them into their new partition"""
+    pk_name = model._meta.pk.attname
+    incoming = dict(zip(frame[pk_name].tolist(), zip(*(frame[field].tolist() for field in partition_fields))))
+    stored = model.objects.filter(pk__in=list(incoming)).values_list(pk_name, *partition_fields)
+    moved = [key for key, *values in stored if tuple(values) != incoming[key]]
+    if moved:
+        model.objects.filter(pk__in=moved).delete()
+
+
+def _bulk_upsert(model, frame, partition_fields=()):
+    pk_name = model._meta.pk.name
+    unique_fields = [pk_name, *partition_fields]
+    update_fields = [
+        model._meta.get_field(attname).name for attname in frame.columns
+        if model._meta.get_field(attname).name not in unique_fields
+    ]
+    model.objects.bulk_create(
+        [model(**record) for record in frame.to_dict('records')],
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=update_fields,
+    )
+
+
+def _copy_upsert(model, frame, partition_fields=()):
+    """COPY the rows into a temporary staging table, then merge with INSERT ... ON CONFLICT"""
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    staging = quote(f'{model._meta.db_table}_staging')
+    unique_columns = [model._meta.pk.column, *(model._meta.get_field(field).column for field in partition_fields)]
+    columns = [model._meta.get_field(attname).column for attname in frame.columns]
+    column_list = ', '.join(quote(column) for column in columns)
+    updates = ', '.join(
+        f'{quote(column)} = EXCLUDED.{quote(column)}' for column in columns if column not in unique_columns
+    )
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP')
+        cursor.execute(f'TRUNCATE {staging}')
+        _copy_from(cursor, f'COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+        cursor.execute(
+            f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} '
+            f"ON CONFLICT ({', '.join(quote(column) for column in unique_columns)}) DO UPDATE SET {updates}"
+        )
+
+
+def _copy_from(cursor, sql, buffer):
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, 'copy_expert'):  # psycopg2
+        raw_cursor.copy_expert(sql, buffer)
+    else:  # psycopg 3
+        with raw_cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def reset_sequences(*models):
+    """Move auto-increment sequences past explicitly inserted primary keys"""
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def load_customer_ids():
+    """All customer ids as a compact array, for resolving loan foreign keys without per-row queries"""
+    ids = Customer.objects.values_list('customer_id', flat=True).iterator(chunk_size=10000)
+    return np.fromiter(ids, dtype=np.int64)
+
+
+def row_fingerprints(frame):
+    """Stable 64-bit hash of every prepared row's content.
+
+    Numbers are hashed as floats and everything else as text, so the same
+    values read from .xlsx, .csv or .jsonl hash identically.
+    """
+    normalized = pd.DataFrame({
+        column: values.astype('float64') if pd.api.types.is_numeric_dtype(values) else values.astype(str)
+        for column, values in frame.items()
+    })
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy().view(np.int64)
+
+
+def active_loans(frame, today=None):
+    """Which prepared loan rows are active: not yet ended and not fully repaid"""
+    return ((frame['end_date'] >= (today or date.today())) & (frame['tenure'] > frame['emis_paid_on_time'])).to_numpy()
+
+
+def write_rows(model, frame, batch_size, method='auto', delta=False, owner_field=None, derived=None):
+    """Upsert prepared rows, stamping each with its source fingerprint.
+
+    Each batch first reads the stored fingerprints of its keys in one query.
+    With `delta`, rows whose fingerprint is unchanged (and that were not
+    marked removed from the source) are not written at all. Returns
+    (counts of inserted/updated/unchanged rows, keys of the rows written,
+    previous and new values of `owner_field` for the rows written).
+    `derived` maps extra columns to values that are written but, as they do
+    not come from the source, not fingerprinted.
+    """
+    pk_name = model._meta.pk.attname
+    frame = frame.assign(source_fingerprint=row_fingerprints(frame), removed_from_source_at=None, **(derived or {}))
+    fields = [pk_name, 'source_fingerprint', 'removed_from_source_at'] + ([owner_field] if owner_field else [])
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    written = []
+    owners = set()
+
+    for start in range(0, len(frame), batch_size):
+        chunk = frame.iloc[start:start + batch_size]
+        stored = {row[0]: row[1:] for row in model.objects.filter(pk__in=chunk[pk_name].tolist()).values_list(*fields)}
+        keys = chunk[pk_name].tolist()
+        exists = np.fromiter((key in stored for key in keys), dtype=bool, count=len(keys))
+        unchanged = np.fromiter(
+            (stored.get(key, (None, None))[:2] == (fingerprint, None)
+             for key, fingerprint in zip(keys, chunk['source_fingerprint'].tolist())),
+            dtype=bool, count=len(keys),
+        ) if delta else np.zeros(len(keys), dtype=bool)
+
+        write = chunk[~unchanged]
+        counts['inserted'] += int((~exists).sum())
+        counts['unchanged'] += int(unchanged.sum())
+        counts['updated'] += int((exists & ~unchanged).sum())
+        written.extend(write[pk_name].tolist())
+        if owner_field:
+            owners.update(stored[key][2] for key in write[pk_name].tolist() if key in stored)
+            owners.update(write[owner_field].tolist())
+        if len(write):
+            upsert_frame(model, write, batch_size, method)
+    return counts, written, owners
+
+
+def upsert_customers(df, batch_size, method='auto', delta=False):
+    """Upsert customers from a DataFrame; must run inside a transaction.
+
+    Returns counts of rows, skipped, inserted, updated and (in delta mode) unchanged rows.
+    """
+    frame = prepare_customers(df)
+    counts, written, _ = write_rows(Customer, frame, batch_size, method, delta)
+    reset_sequences(Customer)
+    invalidate(customers=written)
+    # New customers start with an empty credit profile; existing ones keep theirs
+    CustomerCreditProfile.objects.bulk_create(
+        [CustomerCreditProfile(customer_id=customer_id) for customer_id in frame['customer_id'].tolist()],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return {'rows': len(frame), 'skipped': 0, **counts}
+
+
+def upsert_loans(df, batch_size, method='auto', known_customers=None, refresh_profiles=True, delta=False):
+    """Upsert loans and refresh the affected credit profiles; must run inside a transaction.
+
+    Rows referencing customers missing from `known_customers` (loaded when not
+    given) are skipped. Loans already moved to the archive are not written
+    again, and count as unchanged. With refresh_profiles=False the caller is
+    responsible for rebuilding credit profiles. Returns counts of rows,
+    skipped, inserted, updated and unchanged rows.
+    """
+    frame = prepare_loans(df)
+    if known_customers is None:
+        known_customers = load_customer_ids()
+    known = frame['customer_id'].isin(known_customers)
+    skipped = int((~known).sum())
+    frame = frame[known]
+    rows = len(frame)
+    archived = archived_rows(frame, closed=~active_loans(frame))
+    frame = frame[~archived]
+
+    # Loans moving to another customer change the previous owner's profile and loan list too
+    counts, written, owners = write_rows(
+        Loan, frame, batch_size, method, delta, owner_field='customer_id', derived={'is_active': active_loans(frame)}
+    )
+    counts['unchanged'] += int(archived.sum())
+    reset_sequences(Loan)
+    invalidate(loans=written, owners=owners)
+    if refresh_profiles and (counts['inserted'] or counts['updated']):
+        # Lock the customers in id order, as create_loan locks its customer, so a concurrent
+        # partition or new loan never overwrites a profile with one computed before its commit
+        list(Customer.objects.filter(pk__in=sorted(owners)).order_by('pk').select_for_update().values_list('pk'))
+        rebuild_credit_profiles(owners)
+    return {'rows': rows, 'skipped': skipped, **counts}
+
+
+def find_missing_rows(model, source_keys):
+    """Primary keys of previously ingested rows that are absent from `source_keys`"""
+    ingested = model.objects.filter(
+        source_fingerprint__isnull=False, removed_from_source_at__isnull=True
+    ).values_list('pk', flat=True).iterator(chunk_size=10000)
+    return np.setdiff1d(np.fromiter(ingested, dtype=np.int64), np.asarray(source_keys, dtype=np.int64))
+
+
+def soft_delete_rows(model, keys, batch_size=5000):
+    """Mark rows as removed from the source without deleting them.
+
+    Removed loans no longer count towards credit scores or show in the API,
+    so their customers' profiles are rebuilt and cached responses expired.
+    """
+    now = timezone.now()
+    keys = np.asarray(keys).tolist()
+    owners = set()
+    for start in range(0, len(keys), batch_size):
+        rows = model.objects.filter(pk__in=keys[start:start + batch_size])
+        if model is Loan:
+            owners.update(rows.values_list('customer_id', flat=True))
+        rows.update(removed_from_source_at=now)
+    if model is Loan:
+        invalidate(loans=keys, owners=owners)
+        rebuild_credit_profiles(owners)
+    else:
+        invalidate(customers=keys)
+
+
+def ingest_customers(df, batch_size, method='auto', delta=False):
+    """Upsert customers from a DataFrame in one transaction; returns ingestion statistics"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        counts = upsert_customers(df, batch_size, method, delta)
+    return _stats(counts, started)
+
+
+def ingest_loans(df, batch_size, method='auto', delta=False):
+    """Upsert loans from a DataFrame in one transaction; returns ingestion statistics"""
+    started = time.perf_counter()
+    with transaction.atomic():
+        counts = upsert_loans(df, batch_size, method, delta=delta)
+    return _stats(counts, started)
+
+
+def _stats(counts, started):
+    seconds = time.perf_counter() - started
+    return {
+        **counts,
+        'seconds': seconds,
+        'rows_per_second': counts['rows'] / seconds if seconds else 0,
+    }
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from loans.archive import archivable_loans, archive_loans
+
+
+class Command(BaseCommand):
+    help = 'Move loans that closed long ago from the Loan table into Parquet files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--after-days',
+            type=int,
+            help='Archive loans that ended more than this many days ago (defaults to settings.LOAN_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Loans archived per transaction'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the loans that would be archived'
+        )
+
+    def handle(self, *args, **options):
+        after_days = options['after_days']
+        if options['dry_run']:
+            count = archivable_loans(after_days=after_days).count()
+            self.stdout.write(f'{count} loans would be archived')
+            return
+
+        archived = archive_loans(after_days=after_days, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} loans to {settings.LOAN_ARCHIVE_DIR}'))
@@ -0,0 +1,634 @@
+import asyncio
+import importlib.util
+import io
+import json
+import statistics
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q, Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import include, path
+from rest_framework.renderers import JSONRenderer
+
+from loans import flat_serializers, pricing, schedules
+from loans.batch_eligibility import score_batch
+from loans.db_pool import pool_metrics
+from loans.credit_profiles import compute_credit_profiles, rebuild_credit_profiles
+from loans.models import Customer, CustomerCreditProfile, Loan
+from loans.eligibility import (
+    calculate_credit_score, create_loan_if_eligible, evaluate_eligibility, get_loan_aggregates, score_from_aggregates,
+)
+from loans.renderers import ORJSONRenderer
+from loans.serializers import CustomerLoansSerializer, LoanDetailSerializer, LoanEligibilityResponseSerializer
+from loans.urls import api_urlpatterns
+
+# Synthetic rows of the loan-indexes suite use customer ids from here up, and are deleted afterwards
+INDEX_BENCH_FIRST_CUSTOMER = 50000000
+# Created by migration 0006 for admin search on PostgreSQL
+TRIGRAM_INDEXES = ('customer_first_name_trgm', 'customer_last_name_trgm', 'customer_phone_number_trgm')
+
+
+class Rollback(Exception):
+    """Raised at the end of a suite so its synthetic data is discarded"""
+
+
+def create_synthetic_customer(customer_id, num_loans):
+    """Create a customer with `num_loans` synthetic loans"""
+    customer = Customer.objects.create(
+        customer_id=customer_id,
+        first_name='Bench',
+        last_name=f'Customer{customer_id}',
+        age=30,
+        phone_number=f'8{customer_id:09d}',
+        monthly_salary=Decimal('100000.00'),
+        approved_limit=Decimal('3600000.00'),
+    )
+    today = date.today()
+    Loan.objects.bulk_create([
+        Loan(
+            customer=customer,
+            loan_amount=Decimal('50000.00') + i,
+            tenure=12 + i % 48,
+            interest_rate=Decimal('11.50'),
+            monthly_installment=Decimal('2500.00'),
+            emis_paid_on_time=i % 12,
+            start_date=today - timedelta(days=30 * (i % 120)),
+            end_date=today + timedelta(days=365),
+        )
+        for i in range(num_loans)
+    ], batch_size=1000)
+    return customer
+
+
+def insert_synthetic_loan_table(first_customer, customers, loans):
+    """Insert `customers` customers and `loans` loans spread over them, generated inside the database"""
+    last_customer = first_customer + customers - 1
+    if connection.vendor == 'postgresql':
+        numbers = 'SELECT n FROM generate_series(%s, %s) AS n'
+        days_ago = "CURRENT_DATE - (n % 3650)::int"
+        plus_year = "CURRENT_DATE - (n % 3650)::int + 365"
+        today = 'CURRENT_DATE'
+    else:
+        numbers = 'WITH RECURSIVE series(n) AS (SELECT %s UNION ALL SELECT n + 1 FROM series WHERE n < %s) SELECT n FROM series'
+        days_ago = "date('now', -(n % 3650) || ' days')"
+        plus_year = "date('now', (365 - n % 3650) || ' days')"
+        today = "date('now')"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO loans_customer (customer_id, first_name, last_name, age, phone_number, monthly_salary, '
+            'approved_limit, current_debt) '
+            f"SELECT n, 'Name' || (n * 7919 % 100003), 'Customer' || n, 30, '7' || n, 100000, 3600000, 0 FROM ({numbers}) AS ids",
+            [first_customer, last_customer],
+        )
+        cursor.execute(
+            'INSERT INTO loans_loan (customer_id, loan_amount, tenure, interest_rate, monthly_installment, '
+            'emis_paid_on_time, start_date, end_date, is_active) '
+            f'SELECT {first_customer} + n % {customers}, 10000 + n % 490000, 12 + n % 48, 10.5, 1500 + n % 900, '
+            f'n % 12, {days_ago}, {plus_year}, {plus_year} >= {today} AND n % 12 < 12 + n % 48 '
+            f'FROM ({numbers}) AS ids',
+            [0, loans - 1],
+        )
+
+
+def explain(sql):
+    """The database's plan for `sql`, executing it on PostgreSQL to report actual rows and buffers"""
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+def api_urlconf(async_reads):
+    """A URLconf serving the API under /api/, with the async read views if `async_reads`"""
+    urlconf = types.ModuleType('benchmark_async_urls' if async_reads else 'benchmark_sync_urls')
+    urlconf.urlpatterns = [path('api/', include(api_urlpatterns(async_reads)))]
+    return urlconf
+
+
+def wsgi_request(handler, method, path, body):
+    """Send one request through a WSGI application, returning its status code"""
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body), 'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+    }
+    status = []
+    result = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+    try:
+        b''.join(result)
+    finally:
+        # Fires request_finished, which returns or closes the thread's connection
+        result.close()
+    return status[0]
+
+
+async def asgi_request(application, method, path, body):
+    """Send one request through an ASGI application, returning its status code"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    # The client stays connected: after the body, receive() waits until the handler stops listening
+    connected = asyncio.Event()
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await connected.wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def time_call(func, iterations):
+    """Return the mean wall-clock time of `func` in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against synthetic data (rolled back afterwards)'
+
+    suites = ['scoring', 'batch-eligibility', 'create-loan', 'concurrent-loans', 'loan-indexes', 'connections', 'asgi',
+              'serialization', 'pricing', 'schedules']
+    # Suites whose requests run on other threads, need VACUUM or reconnect commit their data and delete it themselves
+    committed_suites = ['concurrent-loans', 'loan-indexes', 'connections', 'asgi']
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=self.suites, help='Benchmark suite to run')
+        parser.add_argument('--iterations', type=int, default=50, help='Iterations per measurement')
+        parser.add_argument('--applications', type=int, default=10000, help='Applications per batch benchmark')
+        parser.add_argument('--requests', type=int, default=50, help='Parallel requests per concurrency benchmark')
+        parser.add_argument('--loans', type=int, default=10000000, help='Synthetic loans for the index benchmark')
+        parser.add_argument('--customers', type=int, default=100000, help='Synthetic customers for the index benchmark')
+        parser.add_argument('--clients', type=int, default=500, help='Concurrent clients for the ASGI benchmark')
+        parser.add_argument('--rounds', type=int, default=4, help='Requests per client for the ASGI benchmark')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads for the ASGI benchmark')
+
+    def handle(self, *args, **options):
+        suite = getattr(self, f"bench_{options['suite'].replace('-', '_')}", None)
+        if suite is None:
+            raise CommandError(f"Unknown suite: {options['suite']}")
+        if options['suite'] in self.committed_suites:
+            suite(options)
+            return
+        try:
+            with transaction.atomic():
+                suite(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def bench_scoring(self, options):
+        """calculate_credit_score for customers with 10/100/1000 loans"""
+        iterations = options['iterations']
+        self.stdout.write(f"{'loans':>8} {'ms/score':>10}")
+        for offset, num_loans in enumerate((10, 100, 1000)):
+            customer = create_synthetic_customer(900000 + offset, num_loans)
+            elapsed = time_call(lambda: calculate_credit_score(customer), iterations)
+            self.stdout.write(f'{num_loans:>8} {elapsed:>10.3f}')
+
+    def bench_batch_eligibility(self, options):
+        """N applications through /api/check-eligibility one by one versus one batch request"""
+        count = options['applications']
+        customers = [create_synthetic_customer(900000 + i, 5) for i in range(min(count, 1000))]
+        rebuild_credit_profiles([customer.customer_id for customer in customers])
+        applications = [
+            {
+                'customer_id': customers[i % len(customers)].customer_id,
+                'loan_amount': 10000 + (i * 7919) % 500000,
+                'interest_rate': [8, 10.5, 12, 14.75, 18][i % 5],
+                'tenure': [12, 24, 36, 48, 60][i % 5],
+            }
+            for i in range(count)
+        ]
+        client = Client(HTTP_HOST='localhost')
+
+        start = time.perf_counter()
+        single_results = [
+            client.post('/api/check-eligibility', json.dumps(app), content_type='application/json').json()
+            for app in applications
+        ]
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch_results = client.post('/api/check-eligibility/batch', json.dumps(applications), content_type='application/json').json()
+        batch = time.perf_counter() - start
+
+        if batch_results != single_results:
+            raise CommandError('Batch results differ from single-request results')
+        self.stdout.write(f"{'mode':>8} {'seconds':>10} {'apps/sec':>12}")
+        self.stdout.write(f"{'single':>8} {single:>10.3f} {count / single:>12.0f}")
+        self.stdout.write(f"{'batch':>8} {batch:>10.3f} {count / batch:>12.0f}")
+
+    def bench_create_loan(self, options):
+        """Round trips and latency per create_loan_if_eligible: INSERT + UPDATE unprepared versus one prepared CTE"""
+        iterations = options['iterations']
+        customer = create_synthetic_customer(900000, 10)
+        rebuild_credit_profiles([customer.customer_id])
+        connection.ensure_connection()
+        raw = connection.connection
+        # Only psycopg 3 connections prepare statements
+        threshold = getattr(raw, 'prepare_threshold', None)
+
+        def create_loans(method, prepare_threshold):
+            if threshold is not None:
+                raw.prepare_threshold = prepare_threshold
+            with override_settings(LOAN_WRITE_METHOD=method), CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                loans = [create_loan_if_eligible(customer.customer_id, 1000, 12, 12)[0] for _ in range(iterations)]
+                elapsed = (time.perf_counter() - start) * 1000 / iterations
+            if not all(loans):
+                raise CommandError('A benchmark loan was rejected; lower --iterations')
+            return len(captured) / iterations, elapsed
+
+        modes = [('insert + update', 'orm', None)]
+        if connection.vendor == 'postgresql':
+            modes.append(('one CTE', 'cte', threshold))
+        self.stdout.write(f"{'writes':>16} {'prepared':>9} {'queries/loan':>13} {'ms/loan':>9}")
+        try:
+            for label, method, prepare_threshold in modes:
+                queries, elapsed = create_loans(method, prepare_threshold)
+                prepared = 'no' if prepare_threshold is None else 'yes'
+                self.stdout.write(f'{label:>16} {prepared:>9} {queries:>13.1f} {elapsed:>9.3f}')
+        finally:
+            if threshold is not None:
+                raw.prepare_threshold = threshold
+
+    def bench_concurrent_loans(self, options):
+        """N parallel /api/create-loan requests for one customer: debt consistency and throughput"""
+        count = options['requests']
+        customer = create_synthetic_customer(990000, 10)
+        rebuild_credit_profiles([customer.customer_id])
+        initial_loans = set(Loan.objects.filter(customer=customer).values_list('loan_id', flat=True))
+        payload = json.dumps({
+            'customer_id': customer.customer_id, 'loan_amount': 10000, 'interest_rate': 12, 'tenure': 12,
+        })
+
+        def create_loan(_):
+            try:
+                return Client(HTTP_HOST='localhost').post(
+                    '/api/create-loan', payload, content_type='application/json'
+                ).json()
+            finally:
+                connection.close()
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                results = list(pool.map(create_loan, range(count)))
+            elapsed = time.perf_counter() - start
+
+            customer.refresh_from_db()
+            created = Loan.objects.filter(customer=customer).exclude(loan_id__in=initial_loans).order_by('loan_id')
+            approved = sum(1 for result in results if result.get('loan_approved'))
+            created_volume = created.aggregate(total=Sum('loan_amount'))['total'] or 0
+            # Every approval must have been decided with all earlier loans counted
+            last = created.last()
+            emis_before_last = Loan.objects.active().filter(customer=customer).exclude(pk=getattr(last, 'pk', None)).aggregate(
+                total=Sum('monthly_installment')
+            )['total']
+
+            self.stdout.write(f"{'requests':>10} {'approved':>10} {'seconds':>10} {'req/sec':>10}")
+            self.stdout.write(f'{count:>10} {approved:>10} {elapsed:>10.3f} {count / elapsed:>10.0f}')
+            checks = {
+                'loans created match approvals': created.count() == approved,
+                'current_debt equals created volume': customer.current_debt == created_volume,
+                'credit profile matches loans':
+                    CustomerCreditProfile.objects.get(customer=customer).num_loans == len(initial_loans) + approved,
+                'no approval over the EMI cap': emis_before_last <= customer.monthly_salary / 2,
+            }
+            for check, passed in checks.items():
+                self.stdout.write(f"{check}: {'ok' if passed else 'FAILED'}")
+            if not all(checks.values()):
+                raise CommandError('Concurrent loan creation lost or over-approved loans')
+        finally:
+            customer.delete()
+
+    def bench_connections(self, options):
+        """/api/check-eligibility latency with a new connection per request, persistent connections and a pool"""
+        iterations = options['iterations']
+        customer = create_synthetic_customer(990100, 10)
+        rebuild_credit_profiles([customer.customer_id])
+        payload = json.dumps({
+            'customer_id': customer.customer_id, 'loan_amount': 10000, 'interest_rate': 12, 'tenure': 12,
+        })
+        client = Client(HTTP_HOST='localhost')
+        settings_dict = connection.settings_dict
+        configured = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        configured_options = dict(settings_dict['OPTIONS'])
+
+        def measure(conn_max_age, pool=None):
+            connection.close()
+            settings_dict['CONN_MAX_AGE'] = conn_max_age
+            settings_dict['OPTIONS'] = {**configured_options, 'pool': pool} if pool else {
+                key: value for key, value in configured_options.items() if key != 'pool'
+            }
+            timings = []
+            for _ in range(iterations + 1):
+                start = time.perf_counter()
+                client.post('/api/check-eligibility', payload, content_type='application/json')
+                # What the request_finished signal does outside the test client
+                close_old_connections()
+                timings.append((time.perf_counter() - start) * 1000)
+            # The first request includes opening the pool or the persistent connection
+            timings = sorted(timings[1:])
+            return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+        modes = [('per request', 0, None), ('persistent', 600, None)]
+        if connection.vendor == 'postgresql' and importlib.util.find_spec('psycopg_pool') is not None:
+            modes.append(('pool', 0, configured_options.get('pool') or True))
+        try:
+            self.stdout.write(f"{'connections':>12} {'p50 ms':>10} {'p95 ms':>10}")
+            for label, conn_max_age, pool in modes:
+                p50, p95 = measure(conn_max_age, pool)
+                self.stdout.write(f'{label:>12} {p50:>10.3f} {p95:>10.3f}')
+                if pool:
+                    stats = pool_metrics()
+                    self.stdout.write(f"{'':>12} pool wait {stats['avg_wait_ms']} ms avg, {stats['connections_opened']} opened")
+                    connection.close_pool()
+        finally:
+            connection.close()
+            settings_dict.update(configured)
+            settings_dict['OPTIONS'] = configured_options
+            customer.delete()
+
+    def bench_asgi(self, options):
+        """WSGI with the sync views on --threads threads versus ASGI with the async views, under --clients clients"""
+        clients, threads = options['clients'], options['threads']
+        count = clients * options['rounds']
+        customer = create_synthetic_customer(990200, 10)
+        rebuild_credit_profiles([customer.customer_id])
+        loan_id = Loan.objects.filter(customer=customer).values_list('loan_id', flat=True).first()
+        application = json.dumps({
+            'customer_id': customer.customer_id, 'loan_amount': 10000, 'interest_rate': 12, 'tenure': 12,
+        }).encode()
+        endpoints = {
+            'check-eligibility': ('POST', '/api/check-eligibility', application),
+            'view-loan': ('GET', f'/api/view-loan/{loan_id}', b''),
+        }
+
+        def run_wsgi(method, path, body):
+            handler = WSGIHandler()
+            in_flight = threading.Semaphore(clients)
+
+            def send(sent):
+                try:
+                    return wsgi_request(handler, method, path, body), time.perf_counter() - sent
+                finally:
+                    in_flight.release()
+
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                futures = []
+                for _ in range(count):
+                    # A client sends its next request once its previous one is answered
+                    in_flight.acquire()
+                    futures.append(pool.submit(send, time.perf_counter()))
+                return [future.result() for future in futures]
+
+        def run_asgi(method, path, body):
+            async def run():
+                application = ASGIHandler()
+                in_flight = asyncio.Semaphore(clients)
+
+                async def send():
+                    async with in_flight:
+                        sent = time.perf_counter()
+                        return await asgi_request(application, method, path, body), time.perf_counter() - sent
+                return await asyncio.gather(*(send() for _ in range(count)))
+            return asyncio.run(run())
+
+        self.stdout.write(f'{clients} clients, {count} requests per run, {threads} WSGI threads')
+        self.stdout.write(f"{'endpoint':>18} {'server':>6} {'req/sec':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        try:
+            for name, (method, path, body) in endpoints.items():
+                for server, run, async_reads in (('wsgi', run_wsgi, False), ('asgi', run_asgi, True)):
+                    with override_settings(ROOT_URLCONF=api_urlconf(async_reads)):
+                        start = time.perf_counter()
+                        results = run(method, path, body)
+                        elapsed = time.perf_counter() - start
+                    if any(status != 200 for status, _ in results):
+                        raise CommandError(f'{name} answered {sorted({status for status, _ in results})} under {server}')
+                    latencies = sorted(latency * 1000 for _, latency in results)
+                    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                    self.stdout.write(
+                        f'{name:>18} {server:>6} {count / elapsed:>9.0f} {statistics.median(latencies):>9.2f} {p99:>9.2f}'
+                    )
+        finally:
+            customer.delete()
+
+    def bench_serialization(self, options):
+        """Response building and rendering per hot endpoint: DRF serializers + JSONRenderer versus FAST_RESPONSES"""
+        iterations = options['iterations']
+        customers = {count: create_synthetic_customer(990200 + count, count) for count in (10, 1000)}
+        customer = customers[10]
+        rebuild_credit_profiles([customer.customer_id])
+        customer = Customer.objects.select_related('credit_profile').get(pk=customer.pk)
+        loan_id = Loan.objects.filter(customer=customer).values_list('loan_id', flat=True).first()
+        result = evaluate_eligibility(customer, Decimal('10000.00'), Decimal('8.00'), 12)
+        drf, fast = JSONRenderer(), ORJSONRenderer()
+
+        def customer_loans(customer):
+            return (
+                lambda: drf.render(CustomerLoansSerializer(Loan.objects.filter(customer=customer), many=True).data),
+                lambda: fast.render(flat_serializers.customer_loans(
+                    Loan.objects.filter(customer=customer).values_list(*flat_serializers.LOAN_ROW_FIELDS)
+                )),
+            )
+
+        endpoints = [
+            ('check-eligibility', (
+                lambda: drf.render(LoanEligibilityResponseSerializer(result).data),
+                lambda: fast.render(flat_serializers.eligibility(result)),
+            )),
+            ('view-loan', (
+                lambda: drf.render(LoanDetailSerializer(Loan.objects.select_related('customer').get(loan_id=loan_id)).data),
+                lambda: fast.render(flat_serializers.loan_detail(
+                    Loan.objects.values_list(*flat_serializers.LOAN_DETAIL_FIELDS).get(loan_id=loan_id)
+                )),
+            )),
+            *((f'view-loans ({count})', customer_loans(customers[count])) for count in customers),
+        ]
+        self.stdout.write(f"{'endpoint':>18} {'drf ms':>9} {'fast ms':>9} {'speedup':>8}")
+        for label, (drf_response, fast_response) in endpoints:
+            if fast_response() != drf_response():
+                raise CommandError(f'{label}: the fast response differs from the DRF response')
+            drf_ms = time_call(drf_response, iterations)
+            fast_ms = time_call(fast_response, iterations)
+            self.stdout.write(f'{label:>18} {drf_ms:>9.3f} {fast_ms:>9.3f} {drf_ms / fast_ms:>7.1f}x')
+
+    def bench_pricing(self, options):
+        """EMI and credit score math per quote: float and Decimal scalars, cold and memoized factors, NumPy"""
+        count = options['applications']
+        iterations = options['iterations']
+        amounts = [Decimal(10000 + (i * 7919) % 500000) + Decimal(i % 100) / 100 for i in range(count)]
+        rates = [Decimal(['8.00', '10.50', '12.00', '14.75', '18.00'][i % 5]) for i in range(count)]
+        tenures = [[12, 24, 36, 48, 60][i % 5] for i in range(count)]
+        quotes = list(zip(amounts, rates, tenures))
+        aggregates = [
+            {
+                'num_loans': i % 40, 'total_emis': 12 * (i % 40), 'paid_on_time': 11 * (i % 40),
+                'current_year_volume': Decimal(i % 90000), 'total_volume': Decimal(i * 31 % 900000),
+            }
+            for i in range(count)
+        ]
+
+        def float_installment(loan_amount, interest_rate, tenure):
+            # The float formula pricing.monthly_installment replaced
+            monthly_rate = float(interest_rate) / 100 / 12
+            installment = float(loan_amount) * (monthly_rate * (1 + monthly_rate) ** tenure) / ((1 + monthly_rate) ** tenure - 1)
+            return Decimal(str(round(installment, 2)))
+
+        def cold_installment(loan_amount, interest_rate, tenure):
+            pricing.annuity_factor.cache_clear()
+            return pricing.monthly_installment(loan_amount, interest_rate, tenure)
+
+        arrays = (np.array(amounts, dtype=float), np.array(rates, dtype=float), np.array(tenures))
+        score_arrays = [
+            np.array([float(agg[key]) for agg in aggregates])
+            for key in ('num_loans', 'total_emis', 'paid_on_time', 'current_year_volume', 'total_volume')
+        ]
+        if [pricing.from_cents(cents) for cents in pricing.monthly_installments(*arrays)] != [
+            pricing.monthly_installment(*quote) for quote in quotes
+        ]:
+            raise CommandError('Vectorized installments differ from the scalar ones')
+
+        kernels = [
+            ('emi float', lambda: [float_installment(*quote) for quote in quotes]),
+            ('emi decimal cold', lambda: [cold_installment(*quote) for quote in quotes]),
+            ('emi decimal', lambda: [pricing.monthly_installment(*quote) for quote in quotes]),
+            ('emi numpy', lambda: pricing.monthly_installments(*arrays)),
+            ('score scalar', lambda: [score_from_aggregates(agg) for agg in aggregates]),
+            ('score numpy', lambda: score_batch(*score_arrays)),
+        ]
+        self.stdout.write(f"{'kernel':>16} {'ms/batch':>10} {'us/quote':>9}")
+        for label, kernel in kernels:
+            elapsed = time_call(kernel, iterations)
+            self.stdout.write(f'{label:>16} {elapsed:>10.3f} {elapsed * 1000 / count:>9.3f}')
+        info = pricing.annuity_factor.cache_info()
+        self.stdout.write(f'annuity factor cache: {info.currsize}/{info.maxsize} entries, {info.hits} hits, {info.misses} misses')
+
+    def bench_schedules(self, options):
+        """Amortization schedules: a Python loop versus NumPy per loan, and a customer's schedules cold and cached"""
+        iterations = options['iterations']
+
+        def loop_schedule(loan_amount, interest_rate, tenure):
+            # One month at a time, as a schedule would be built without NumPy
+            installment = pricing.monthly_installment(loan_amount, interest_rate, tenure)
+            rate = interest_rate / 1200
+            balance = loan_amount
+            rows = []
+            for month in range(1, tenure + 1):
+                interest = (balance * rate).quantize(pricing.CENT)
+                principal = balance if month == tenure else installment - interest
+                balance -= principal
+                rows.append((month, principal + interest, principal, interest, balance))
+            return rows
+
+        self.stdout.write(f"{'tenure':>8} {'loop ms':>9} {'numpy ms':>9}")
+        for tenure in (12, 60, 360):
+            terms = (Decimal('250000.00'), Decimal('10.50'), tenure)
+            loop_ms = time_call(lambda: loop_schedule(*terms), iterations)
+            numpy_ms = time_call(lambda: schedules.amortization_schedule(*terms), iterations)
+            self.stdout.write(f'{tenure:>8} {loop_ms:>9.3f} {numpy_ms:>9.3f}')
+
+        customer = create_synthetic_customer(990300, 1000)
+        client = Client(HTTP_HOST='localhost')
+        path = f'/api/view-loans/{customer.customer_id}/schedules'
+
+        def fetch(format):
+            return b''.join(client.get(path, {'format': format}).streaming_content)
+
+        self.stdout.write(f"{'1000 loans':>10} {'cold ms':>9} {'cached ms':>10}")
+        for format in ('json', 'csv'):
+            def cold():
+                schedules.encoded_schedule.cache_clear()
+                fetch(format)
+            cold_ms = time_call(cold, max(1, iterations // 10))
+            cached_ms = time_call(lambda: fetch(format), max(1, iterations // 10))
+            self.stdout.write(f'{format:>10} {cold_ms:>9.3f} {cached_ms:>10.3f}')
+
+    def bench_loan_indexes(self, options):
+        """Plans and timings of the hot Loan/Customer queries with and without migration 0006's indexes"""
+        first, customers, loans = INDEX_BENCH_FIRST_CUSTOMER, options['customers'], options['loans']
+        customer = Customer(customer_id=first)
+        today = date.today()
+        queries = {
+            'credit score aggregates': lambda: get_loan_aggregates(customer),
+            'profile rebuild, 100 customers': lambda: list(compute_credit_profiles(range(first, first + 100))),
+            'admin: started in last 7 days': lambda: list(
+                Loan.objects.filter(start_date__gte=today - timedelta(days=7)).order_by('-pk')[:100]
+            ),
+            'admin: ending this month': lambda: list(
+                Loan.objects.filter(end_date__gte=today.replace(day=1), end_date__lt=today.replace(day=28) + timedelta(days=4))
+                .order_by('-pk')[:100]
+            ),
+            'admin: customer search': lambda: list(Customer.objects.filter(
+                Q(first_name__icontains='ame4242') | Q(last_name__icontains='ame4242') | Q(phone_number__icontains='ame4242')
+            ).order_by('-pk')[:100]),
+        }
+        statements = {}
+        for name, query in queries.items():
+            with CaptureQueriesContext(connection) as captured:
+                query()
+            statements[name] = captured.captured_queries[-1]['sql']
+
+        self.stdout.write(f'Inserting {customers} customers and {loans} loans...')
+        start = time.perf_counter()
+        try:
+            insert_synthetic_loan_table(first, customers, loans)
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM ANALYZE' if connection.vendor == 'postgresql' else 'ANALYZE')
+            self.stdout.write(f'Inserted in {time.perf_counter() - start:.1f}s')
+
+            self.report_plans('with indexes', statements, options['iterations'])
+            try:
+                with transaction.atomic():
+                    # The schema before migration 0006: only the foreign key index on customer_id
+                    with connection.cursor() as cursor:
+                        for index in [index.name for index in Loan._meta.indexes] + list(TRIGRAM_INDEXES):
+                            cursor.execute(f'DROP INDEX IF EXISTS {index}')
+                        cursor.execute('CREATE INDEX loan_customer_bench_idx ON loans_loan (customer_id)')
+                        cursor.execute('ANALYZE')
+                    self.report_plans('without indexes', statements, options['iterations'])
+                    raise Rollback
+            except Rollback:
+                pass
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM loans_loan WHERE customer_id >= %s', [first])
+                cursor.execute('DELETE FROM loans_customer WHERE customer_id >= %s', [first])
+
+    def report_plans(self, label, statements, iterations):
+        self.stdout.write(f'\n== {label}')
+        for name, sql in statements.items():
+            def run():
+                with connection.cursor() as cursor:
+                    cursor.execute(sql)
+                    cursor.fetchall()
+            elapsed = time_call(run, iterations)
+            self.stdout.write(f'{name}: {elapsed:.3f} ms')
+            for line in explain(sql):
+                self.stdout.write(f'    {line}')
@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from loans.tasks import ingest_customer_data, ingest_loan_data
+from loans.ingestion import INGEST_METHODS, MISSING_ROW_ACTIONS
+from loans.tasks import parallel_ingestion, run_parallel_ingestion_locally
+import argparse
 import os
 
 
@@ -22,19 +25,64 @@ class Command(BaseCommand):
         parser.add_argument(
             '--customer-file',
             type=str,
-            help='Path to customer data Excel file',
+            help='Path to customer data file (.xlsx, .csv or .jsonl)',
             default=default_customer
         )
         parser.add_argument(
             '--loan-file',
             type=str,
-            help='Path to loan data Excel file',
+            help='Path to loan data file (.xlsx, .csv or .jsonl)',
             default=default_loan
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows written per batch (defaults to settings.INGEST_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--method',
+            choices=INGEST_METHODS,
+            help='Write path: COPY on PostgreSQL, bulk upserts, or auto (defaults to settings.INGEST_METHOD)'
+        )
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            help='Partitions per file, ingested in parallel by Celery workers (defaults to settings.INGEST_PARTITIONS)'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore checkpoints from interrupted runs and ingest from the first row'
+        )
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            help='Only write rows whose content changed since they were last ingested'
+        )
+        parser.add_argument(
+            '--missing',
+            choices=MISSING_ROW_ACTIONS,
+            default='ignore',
+            help='What to do with previously ingested rows that are no longer in the source files'
+        )
+        parser.add_argument(
+            '--wait',
+            action=argparse.BooleanOptionalAction,
+            help='Wait for the Celery workflow to finish and print its counts report '
+                 '(the default with --delta or --missing report/soft-delete)'
+        )
 
     def handle(self, *args, **options):
         customer_file = options['customer_file']
         loan_file = options['loan_file']
+        partitions = options['partitions'] or settings.INGEST_PARTITIONS
+        ingest_options = {
+            'batch_size': options['batch_size'],
+            'method': options['method'],
+            'restart': options['restart'],
+            'delta': options['delta'],
+            'missing': options['missing'],
+        }
 
         self.stdout.write('Starting data ingestion...')
 
@@ -49,21 +97,34 @@ class Command(BaseCommand):
 
         # Try to use Celery if available, otherwise run synchronously
         try:
-            # Trigger background tasks
-            customer_task = ingest_customer_data.delay(customer_file)
-            loan_task = ingest_loan_data.delay(loan_file)
-            
+            # Customers are loaded by parallel partition tasks before any loan partition starts
+            workflow = parallel_ingestion(customer_file, loan_file, partitions, **ingest_options).apply_async()
+
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Data ingestion tasks started. Customer task ID: {customer_task.id}, '
-                    f'Loan task ID: {loan_task.id}'
+                    f'Data ingestion started across {partitions} partitions per file. '
+                    f'Workflow task ID: {workflow.id}'
                 )
             )
         except Exception as e:
             # Fallback to synchronous execution if Celery not available
             self.stdout.write(self.style.WARNING(f'Celery not available, running synchronously: {str(e)}'))
-            self.stdout.write('Ingesting customer data...')
-            ingest_customer_data(customer_file)
-            self.stdout.write('Ingesting loan data...')
-            ingest_loan_data(loan_file)
-            self.stdout.write(self.style.SUCCESS('Data ingestion completed synchronously!'))
\ No newline at end of file
+            self.stdout.write(run_parallel_ingestion_locally(customer_file, loan_file, partitions, **ingest_options))
+            self.stdout.write(self.style.SUCCESS('Data ingestion completed synchronously!'))
+            return
+
+        # The counts are what --delta and --missing runs are for, so those wait for them by default
+        wait = options['wait']
+        if wait is None:
+            wait = options['delta'] or options['missing'] != 'ignore'
+        if not wait:
+            self.stdout.write(
+                'The inserted, updated and unchanged counts are written to the Celery worker log and kept '
+                f'as the result of task {workflow.id}: '
+                f'celery -A credit_approval_system result {workflow.id}. Pass --wait to print them here.'
+            )
+            return
+
+        # Outside the fallback above: a failed workflow must not be re-run in this process
+        self.stdout.write(workflow.get())
+        self.stdout.write(self.style.SUCCESS('Data ingestion completed!'))
@@ -0,0 +1,53 @@
+import threading
+from collections import Counter, defaultdict
+
+from redis.exceptions import RedisError
+
+from .redis_store import get_async_redis, get_redis, mark_unavailable
+
+# Counts recorded while Redis is unreachable stay in this process
+_local_counts = defaultdict(Counter)
+_local_lock = threading.Lock()
+
+
+def increment(group, name, amount=1):
+    """Add to a counter shared by every process through Redis"""
+    client = get_redis()
+    if client is not None:
+        try:
+            client.hincrby(f'metrics:{group}', name, amount)
+            return
+        except RedisError as e:
+            mark_unavailable(e)
+    with _local_lock:
+        _local_counts[group][name] += amount
+
+
+async def aincrement(group, name, amount=1):
+    """increment() for async views, through the event loop's Redis client"""
+    client = get_async_redis()
+    if client is not None:
+        try:
+            await client.hincrby(f'metrics:{group}', name, amount)
+            return
+        except RedisError as e:
+            mark_unavailable(e)
+    with _local_lock:
+        _local_counts[group][name] += amount
+
+
+def read_counters(group):
+    """Current counters of a group, including any kept in this process while Redis was down"""
+    with _local_lock:
+        counts = Counter(_local_counts[group])
+    client = get_redis()
+    if client is not None:
+        try:
+            counts.update({name.decode(): int(value) for name, value in client.hgetall(f'metrics:{group}').items()})
+        except RedisError as e:
+            mark_unavailable(e)
+    return dict(counts)
+
+
+def hit_rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
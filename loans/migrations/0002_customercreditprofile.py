@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:54
+
+from datetime import date
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_credit_profiles(apps, schema_editor):
+    Customer = apps.get_model('loans', 'Customer')
+    CustomerCreditProfile = apps.get_model('loans', 'CustomerCreditProfile')
+    current_year = date.today().year
+
+    customers = Customer.objects.annotate(
+        agg_num_loans=Count('loans'),
+        agg_total_emis=Sum('loans__tenure'),
+        agg_paid_on_time=Sum('loans__emis_paid_on_time'),
+        agg_total_volume=Sum('loans__loan_amount'),
+        agg_total_monthly_installment=Sum('loans__monthly_installment'),
+        agg_current_year_volume=Sum('loans__loan_amount', filter=Q(loans__start_date__year=current_year)),
+    )
+    CustomerCreditProfile.objects.bulk_create([
+        CustomerCreditProfile(
+            customer_id=customer.customer_id,
+            num_loans=customer.agg_num_loans,
+            total_emis=customer.agg_total_emis or 0,
+            paid_on_time=customer.agg_paid_on_time or 0,
+            total_volume=customer.agg_total_volume or 0,
+            total_monthly_installment=customer.agg_total_monthly_installment or 0,
+            current_year_volume=customer.agg_current_year_volume or 0,
+            volume_year=current_year,
+        )
+        for customer in customers.iterator(chunk_size=2000)
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCreditProfile',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='credit_profile', serialize=False, to='loans.customer')),
+                ('num_loans', models.IntegerField(default=0)),
+                ('total_emis', models.IntegerField(default=0)),
+                ('paid_on_time', models.IntegerField(default=0)),
+                ('total_volume', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_monthly_installment', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('current_year_volume', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('volume_year', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_credit_profiles, migrations.RunPython.noop),
+    ]
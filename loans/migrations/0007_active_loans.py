@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:27
+
+from datetime import date
+
+from django.db import migrations, models
+from django.db.models import F, Q, Sum
+
+
+def backfill_active_loans(apps, schema_editor):
+    Loan = apps.get_model('loans', 'Loan')
+    Customer = apps.get_model('loans', 'Customer')
+    CustomerCreditProfile = apps.get_model('loans', 'CustomerCreditProfile')
+    Loan.objects.filter(Q(end_date__lt=date.today()) | Q(emis_paid_on_time__gte=F('tenure'))).update(is_active=False)
+
+    customers = Customer.objects.filter(credit_profile__isnull=False).annotate(
+        agg_active_volume=Sum('loans__loan_amount', filter=Q(loans__is_active=True)),
+        agg_active_monthly_installment=Sum('loans__monthly_installment', filter=Q(loans__is_active=True)),
+    ).values_list('customer_id', 'agg_active_volume', 'agg_active_monthly_installment')
+    batch = []
+    for customer_id, volume, emi in customers.iterator(chunk_size=2000):
+        if volume or emi:
+            batch.append(CustomerCreditProfile(customer_id=customer_id, active_volume=volume or 0,
+                                               active_monthly_installment=emi or 0))
+        if len(batch) >= 2000:
+            CustomerCreditProfile.objects.bulk_update(batch, ['active_volume', 'active_monthly_installment'])
+            batch = []
+    CustomerCreditProfile.objects.bulk_update(batch, ['active_volume', 'active_monthly_installment'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0006_loan_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='active_monthly_installment',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='customercreditprofile',
+            name='active_volume',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='is_active',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(backfill_active_loans, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['customer'], include=('loan_amount', 'monthly_installment'), name='loan_active_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['end_date'], name='loan_active_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:05
+
+from datetime import date
+
+from django.db import migrations, models
+
+
+# The DDL and the interval are kept here rather than taken from loans.partitions
+# and settings, so this migration does the same whatever the application code and
+# environment later become. loans.partitions.ensure_partitions creates partitions
+# of LOAN_PARTITION_INTERVAL next to these yearly ones.
+PARTITION_COLUMN = 'start_date'
+PARTITION_INTERVAL = 'year'
+
+
+def _partition_bounds(table, day, interval):
+    if interval == 'year':
+        return f'{table}_p{day.year}', date(day.year, 1, 1), date(day.year + 1, 1, 1)
+    if interval == 'month':
+        end = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        return f'{table}_p{day.year}_{day.month:02d}', date(day.year, day.month, 1), end
+    raise ValueError(f"Unknown partition interval {interval!r}, expected 'year' or 'month'")
+
+
+def _default_partition(table):
+    return f'{table}_default'
+
+
+def rebuild_table(schema_editor, model, interval=None):
+    """Recreate `model`'s table with its rows, as a partitioned table when `interval` is given.
+
+    The primary key of a partitioned table has to include the partition key,
+    so it becomes (loan_id, start_date), and the database no longer enforces
+    that loan ids are unique on their own. Only the shared identity sequence
+    keeps generated ids unique; a row inserted with an explicit loan_id and
+    another start date is a second row. Foreign keys and Meta indexes are
+    recreated (on a partitioned table, indexes cascade to every partition).
+    Holds an exclusive lock on the table while its rows are copied.
+    """
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    previous = f'{table}_previous'
+    pk = model._meta.pk.column
+    schema_editor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(previous)}')
+    partition_by = f' PARTITION BY RANGE ({PARTITION_COLUMN})' if interval else ''
+    schema_editor.execute(
+        f'CREATE TABLE {quote(table)} (LIKE {quote(previous)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+        f'INCLUDING IDENTITY){partition_by}'
+    )
+
+    if interval:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f'SELECT min({PARTITION_COLUMN}), max({PARTITION_COLUMN}) FROM {quote(previous)}')
+            first, last = cursor.fetchone()
+            last = max(last or date.today(), date.today())
+            day = first or date.today()
+            while day <= last:
+                name, start, end = _partition_bounds(table, day, interval)
+                cursor.execute(
+                    f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+                day = end
+        schema_editor.execute(f'CREATE TABLE {quote(_default_partition(table))} PARTITION OF {quote(table)} DEFAULT')
+
+    schema_editor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(previous)}')
+    schema_editor.execute(f'DROP TABLE {quote(previous)}')
+    # The new identity sequence got a suffixed name while the old one existed
+    sequence = _serial_sequence(schema_editor, table, pk)
+    if sequence.split('.')[-1].strip('"') != f'{table}_{pk}_seq':
+        schema_editor.execute(f"ALTER SEQUENCE {sequence} RENAME TO {quote(f'{table}_{pk}_seq')}")
+    schema_editor.execute(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{pk}'), coalesce(max({quote(pk)}), 1), "
+        f"max({quote(pk)}) IS NOT NULL) FROM {quote(table)}"
+    )
+    key = f'{quote(pk)}, {PARTITION_COLUMN}' if interval else quote(pk)
+    schema_editor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_pkey")} PRIMARY KEY ({key})')
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            schema_editor.execute(schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+
+def _serial_sequence(schema_editor, table, column):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, column])
+        return cursor.fetchone()[0]
+
+
+def partition_loan_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    rebuild_table(schema_editor, apps.get_model('loans', 'Loan'), interval=PARTITION_INTERVAL)
+
+
+def unpartition_loan_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    rebuild_table(schema_editor, apps.get_model('loans', 'Loan'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0007_active_loans'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loan',
+            name='loan_id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(partition_loan_table, unpartition_loan_table),
+    ]
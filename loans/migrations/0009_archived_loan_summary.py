@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0008_partition_loans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoanSummary',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archived_loans', serialize=False, to='loans.customer')),
+                ('num_loans', models.IntegerField(default=0)),
+                ('total_emis', models.IntegerField(default=0)),
+                ('paid_on_time', models.IntegerField(default=0)),
+                ('total_volume', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_monthly_installment', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+        ),
+    ]
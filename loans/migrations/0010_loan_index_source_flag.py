@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0009_archived_loan_summary'),
+    ]
+
+    operations = [
+        # Credit scoring leaves out loans removed from the ingestion source, so the index carries the flag
+        migrations.RemoveIndex(
+            model_name='loan',
+            name='loan_customer_start_idx',
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['customer', 'start_date'], include=('loan_amount', 'monthly_installment', 'tenure', 'emis_paid_on_time', 'removed_from_source_at'), name='loan_customer_start_idx'),
+        ),
+    ]
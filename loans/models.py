@@ -1,4 +1,7 @@
+from datetime import date
+
 from django.db import models
+from django.db.models import F, Q
 from django.core.validators import MinValueValidator
 
 
@@ -11,14 +14,34 @@ class Customer(models.Model):
     monthly_salary = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     approved_limit = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     current_debt = models.DecimalField(max_digits=15, decimal_places=2, default=0, validators=[MinValueValidator(0)])
+    # Set by data ingestion: hash of the source row last written, and when the row left the source
+    source_fingerprint = models.BigIntegerField(null=True, blank=True, editable=False)
+    removed_from_source_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.customer_id})"
 
 
+class LoanQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def in_source(self):
+        """Loans still in the ingestion source: not soft-deleted by `ingest_data --missing soft-delete`"""
+        return self.filter(removed_from_source_at__isnull=True)
+
+    def due_to_close(self, today=None):
+        """Active loans that have ended or been fully repaid, and should no longer be active"""
+        return self.active().filter(Q(end_date__lt=today or date.today()) | Q(emis_paid_on_time__gte=F('tenure')))
+
+
 class Loan(models.Model):
-    loan_id = models.AutoField(primary_key=True)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans')
+    # On PostgreSQL the table is range-partitioned on start_date (see loans.partitions),
+    # and the database's primary key is (loan_id, start_date): only the shared identity
+    # sequence, not a constraint, keeps loan ids unique on their own
+    loan_id = models.BigAutoField(primary_key=True)
+    # Indexed by loan_customer_start_idx below, which leads with customer
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='loans', db_index=False)
     loan_amount = models.DecimalField(max_digits=15, decimal_places=2, validators=[MinValueValidator(0)])
     tenure = models.IntegerField(validators=[MinValueValidator(1)])  # in months
     interest_rate = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0)])  # percentage
@@ -26,12 +49,125 @@ class Loan(models.Model):
     emis_paid_on_time = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     start_date = models.DateField()
     end_date = models.DateField()
+    # Set by data ingestion: hash of the source row last written, and when the row left the source
+    source_fingerprint = models.BigIntegerField(null=True, blank=True, editable=False)
+    removed_from_source_at = models.DateTimeField(null=True, blank=True)
+    # Whether the loan still counts towards debt and EMI checks: set on every write
+    # and cleared by the daily close_finished_loans sweep once the loan ends
+    is_active = models.BooleanField(default=True, editable=False)
+
+    objects = LoanQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # A customer's loans, with every column credit scoring reads, so PostgreSQL
+            # can score from the index alone (other databases ignore INCLUDE)
+            models.Index(
+                fields=['customer', 'start_date'],
+                include=['loan_amount', 'monthly_installment', 'tenure', 'emis_paid_on_time', 'removed_from_source_at'],
+                name='loan_customer_start_idx',
+            ),
+            # Admin date filters
+            models.Index(fields=['start_date'], name='loan_start_date_idx'),
+            models.Index(fields=['end_date'], name='loan_end_date_idx'),
+            # The active loans only: a customer's current debt and EMIs, and the closing sweep
+            models.Index(
+                fields=['customer'], include=['loan_amount', 'monthly_installment'],
+                condition=Q(is_active=True), name='loan_active_customer_idx',
+            ),
+            models.Index(fields=['end_date'], condition=Q(is_active=True), name='loan_active_end_date_idx'),
+        ]
 
     def __str__(self):
-        return f"Loan {self.loan_id} - Customer {self.customer.customer_id}"
+        return f"Loan {self.loan_id} - Customer {self.customer_id}"
+
+    def save(self, *args, **kwargs):
+        self.is_active = self.is_open()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'is_active'}
+        super().save(*args, **kwargs)
+
+    def is_open(self, today=None):
+        """Not yet ended and not fully repaid"""
+        return self.end_date >= (today or date.today()) and self.repayments_left > 0
 
     @property
     def repayments_left(self):
         """Calculate remaining EMIs"""
         total_emis = self.tenure
         return max(0, total_emis - self.emis_paid_on_time)
+
+
+class CustomerCreditProfile(models.Model):
+    """Denormalized loan aggregates per customer, kept in sync on every Loan write"""
+    customer = models.OneToOneField(Customer, primary_key=True, on_delete=models.CASCADE, related_name='credit_profile')
+    num_loans = models.IntegerField(default=0)
+    total_emis = models.IntegerField(default=0)
+    paid_on_time = models.IntegerField(default=0)
+    total_volume = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_monthly_installment = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    current_year_volume = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    volume_year = models.IntegerField(default=0)  # year that current_year_volume refers to
+    # Sums over active loans only, for the debt and EMI checks
+    active_volume = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    active_monthly_installment = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Credit profile - Customer {self.customer_id}"
+
+    def as_aggregates(self):
+        """Return the profile in the shape produced by eligibility.get_loan_aggregates"""
+        current_year_volume = self.current_year_volume if self.volume_year == date.today().year else 0
+        return {
+            'num_loans': self.num_loans,
+            'total_emis': self.total_emis,
+            'paid_on_time': self.paid_on_time,
+            'total_volume': self.total_volume,
+            'current_year_volume': current_year_volume,
+            'total_monthly_installment': self.total_monthly_installment,
+            'active_volume': self.active_volume,
+            'active_monthly_installment': self.active_monthly_installment,
+        }
+
+
+class ArchivedLoanSummary(models.Model):
+    """Totals of a customer's loans moved to cold storage by loans.archive, kept so scoring still counts them"""
+    customer = models.OneToOneField(Customer, primary_key=True, on_delete=models.CASCADE, related_name='archived_loans')
+    num_loans = models.IntegerField(default=0)
+    total_emis = models.IntegerField(default=0)
+    paid_on_time = models.IntegerField(default=0)
+    total_volume = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_monthly_installment = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Archived loans - Customer {self.customer_id}"
+
+
+class IngestionCheckpoint(models.Model):
+    """Progress of a streaming ingestion run, so an interrupted run can resume"""
+    kind = models.CharField(max_length=20)  # 'customers' or 'loans'
+    source = models.CharField(max_length=500)
+    fingerprint = models.CharField(max_length=64)
+    rows_committed = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'source'], name='unique_ingestion_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} from {self.source}: {self.rows_committed} rows"
+
+
+class IdempotencyRecord(models.Model):
+    """Response stored for an Idempotency-Key while Redis is unavailable"""
+    key = models.CharField(max_length=255, primary_key=True)
+    request_fingerprint = models.CharField(max_length=64)
+    status_code = models.IntegerField(null=True, blank=True)  # null while the first request is running
+    response = models.JSONField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Idempotency key {self.key}"
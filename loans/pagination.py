@@ -0,0 +1,108 @@
+import json
+from gzip import GzipFile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import StreamingBuffer, compress_sequence
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class LoanCursorPagination(CursorPagination):
+    """Keyset pages ordered on loan_id: each page is one `loan_id > cursor` range query.
+
+    Clients choose `?page_size=` up to LOANS_MAX_PAGE_SIZE (default
+    LOANS_PAGE_SIZE) and follow the opaque `next` link.
+    """
+    ordering = 'loan_id'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.LOANS_PAGE_SIZE
+        self.max_page_size = settings.LOANS_MAX_PAGE_SIZE
+
+
+def _encoder():
+    # Matches DRF's JSONRenderer output, so streamed and rendered bodies are identical
+    return JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+
+def _json_array(queryset, serializer_class, chunk_size):
+    """Encode the queryset as a JSON array one chunk of rows at a time"""
+    encoder = _encoder()
+    yield '['
+    chunk = []
+    first = True
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(encoder.encode(serializer_class(instance).data))
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']'
+
+
+async def _ajson_array(queryset, serializer_class, chunk_size):
+    """_json_array() reading the queryset with async iteration"""
+    encoder = _encoder()
+    yield '['
+    chunk = []
+    first = True
+    async for instance in queryset.aiterator(chunk_size=chunk_size):
+        chunk.append(encoder.encode(serializer_class(instance).data))
+        if len(chunk) >= chunk_size:
+            yield ('' if first else ',') + ','.join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+    yield ']'
+
+
+async def _acompress_sequence(chunks):
+    """compress_sequence() over an async iterator"""
+    buffer = StreamingBuffer()
+    with GzipFile(mode='wb', compresslevel=6, fileobj=buffer, mtime=0) as gzip_file:
+        yield buffer.read()
+        async for chunk in chunks:
+            gzip_file.write(chunk)
+            data = buffer.read()
+            if data:
+                yield data
+    yield buffer.read()
+
+
+def _streaming_response(request, chunks, compress, content_type='application/json'):
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = StreamingHttpResponse(compress(chunks), content_type=content_type)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def stream_json_array(request, queryset, serializer_class):
+    """A streamed JSON array of the serialized queryset, read through a server-side cursor.
+
+    Only LOANS_STREAM_CHUNK_SIZE rows are held in memory at a time, however
+    large the queryset. The body is gzipped when the client accepts it.
+    """
+    chunks = (chunk.encode() for chunk in _json_array(queryset, serializer_class, settings.LOANS_STREAM_CHUNK_SIZE))
+    return _streaming_response(request, chunks, compress_sequence)
+
+
+def stream_text(request, chunks, content_type):
+    """A streamed response of text chunks, gzipped when the client accepts it"""
+    return _streaming_response(request, (chunk.encode() for chunk in chunks), compress_sequence, content_type)
+
+
+def astream_json_array(request, queryset, serializer_class):
+    """stream_json_array() for async views: the body is an async iterator, so ASGI servers stream it"""
+    async def chunks():
+        async for chunk in _ajson_array(queryset, serializer_class, settings.LOANS_STREAM_CHUNK_SIZE):
+            yield chunk.encode()
+    return _streaming_response(request, chunks(), _acompress_sequence)
@@ -0,0 +1,141 @@
+"""Range partitioning of the loans_loan table by start_date (PostgreSQL only).
+
+Migration 0008 converts the table into a partitioned one with a partition per
+year plus a default partition for start dates no partition covers. The daily
+create_loan_partitions task keeps LOAN_PARTITIONS_AHEAD future partitions of
+LOAN_PARTITION_INTERVAL ('year' or 'month') ready and gives rows that landed in
+the default partition one of their own. Ranges that existing partitions already
+cover are left alone, so the interval can be changed at any time.
+"""
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+
+INTERVALS = ('year', 'month')
+PARTITION_COLUMN = 'start_date'
+
+
+def partition_bounds(table, day, interval):
+    """The partition of `table` holding loans that start on `day`: (name, first day, first day after it)"""
+    if interval == 'year':
+        start, end = date(day.year, 1, 1), date(day.year + 1, 1, 1)
+        suffix = f'{day.year}'
+    elif interval == 'month':
+        start = date(day.year, day.month, 1)
+        end = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+        suffix = f'{day.year}_{day.month:02d}'
+    else:
+        raise ValueError(f"Unknown partition interval {interval!r}, expected one of {', '.join(INTERVALS)}")
+    return f'{table}_p{suffix}', start, end
+
+
+def default_partition(table):
+    return f'{table}_default'
+
+
+def partition_key(model):
+    """Field names of the model table's partition key; empty unless it is partitioned"""
+    if connection.vendor != 'postgresql':
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT a.attname FROM pg_partitioned_table p '
+            'CROSS JOIN LATERAL unnest(p.partattrs) WITH ORDINALITY AS k(attnum, position) '
+            'JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = k.attnum '
+            'WHERE p.partrelid = to_regclass(%s) ORDER BY k.position',
+            [model._meta.db_table],
+        )
+        columns = [row[0] for row in cursor.fetchall()]
+    fields = {field.column: field.name for field in model._meta.concrete_fields}
+    return [fields[column] for column in columns]
+
+
+def partition_ranges(table):
+    """[first day, first day after) of each partition attached to `table`, by name; the default has none"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)',
+            [table],
+        )
+        rows = cursor.fetchall()
+    ranges = {}
+    for name, bound in rows:
+        match = re.fullmatch(r"FOR VALUES FROM \('([\d-]+)'\) TO \('([\d-]+)'\)", bound)
+        if match:
+            ranges[name] = (date.fromisoformat(match[1]), date.fromisoformat(match[2]))
+    return ranges
+
+
+def _uncovered(start, end, covered):
+    """The parts of [start, end) outside every range in `covered`"""
+    gaps = []
+    for covered_start, covered_end in sorted(covered):
+        if covered_end <= start or covered_start >= end:
+            continue
+        if covered_start > start:
+            gaps.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        gaps.append((start, end))
+    return gaps
+
+
+def create_partition(cursor, table, name, start, end):
+    """Attach a partition for [start, end), moving in the rows the default partition holds for that range"""
+    quote = connection.ops.quote_name
+    default = quote(default_partition(table))
+    cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {default} WHERE {PARTITION_COLUMN} >= %s AND {PARTITION_COLUMN} < %s RETURNING *) '
+        f'INSERT INTO {quote(name)} SELECT * FROM moved',
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def ensure_partitions(model, interval=None, ahead=None, today=None):
+    """Create the partitions of `model`'s table that are due, returning their names.
+
+    These are the partitions from the current one to `ahead` intervals past it,
+    and those covering any start date currently in the default partition.
+    Where partitions of another interval already cover part of a range, only
+    the rest of it gets a partition, named after its first day. Does nothing
+    unless the table is partitioned.
+    """
+    if not partition_key(model):
+        return []
+    table = model._meta.db_table
+    interval = interval or settings.LOAN_PARTITION_INTERVAL
+    ahead = settings.LOAN_PARTITIONS_AHEAD if ahead is None else ahead
+
+    day = today or date.today()
+    due = {}
+    for _ in range(ahead + 1):
+        name, start, end = partition_bounds(table, day, interval)
+        due[name] = (start, end)
+        day = end
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT DISTINCT date_trunc(%s, {PARTITION_COLUMN})::date FROM {connection.ops.quote_name(default_partition(table))}',
+            [interval],
+        )
+        for (day,) in cursor.fetchall():
+            name, start, end = partition_bounds(table, day, interval)
+            due[name] = (start, end)
+
+    created = []
+    covered = list(partition_ranges(table).values())
+    for name, (start, end) in sorted(due.items(), key=lambda item: item[1]):
+        for gap in _uncovered(start, end, covered):
+            gap_name = name if gap == (start, end) else f'{table}_p{gap[0]:%Y_%m_%d}'
+            with transaction.atomic(), connection.cursor() as cursor:
+                create_partition(cursor, table, gap_name, *gap)
+            covered.append(gap)
+            created.append(gap_name)
+    return created
@@ -0,0 +1,72 @@
+"""Loan pricing: the monthly installment (EMI) of an annuity loan.
+
+EMI = P * r(1 + r)^n / ((1 + r)^n - 1), for the monthly rate r = annual % / 1200,
+computed in Decimal and rounded half up to the cent. The annuity factor only
+depends on (rate, tenure), which few quotes differ in, so it is memoized.
+"""
+import functools
+from decimal import ROUND_HALF_UP, Context, Decimal
+
+import numpy as np
+
+CENT = Decimal('0.01')
+# Distinct (rate, tenure) pairs whose annuity factor is kept
+ANNUITY_FACTOR_CACHE_SIZE = 4096
+# Enough digits that the factor's error stays far below a cent on any DecimalField(15, 2) amount
+_CONTEXT = Context(prec=34)
+
+
+def as_decimal(value):
+    """The Decimal of a number as written; floats go through their shortest repr"""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+@functools.lru_cache(maxsize=ANNUITY_FACTOR_CACHE_SIZE)
+def annuity_factor(interest_rate, tenure):
+    """The monthly installment per unit of principal at an annual percentage rate over `tenure` months"""
+    monthly_rate = _CONTEXT.divide(as_decimal(interest_rate), 1200)
+    if not monthly_rate:
+        return _CONTEXT.divide(1, tenure)
+    growth = _CONTEXT.power(_CONTEXT.add(1, monthly_rate), tenure)
+    return _CONTEXT.divide(_CONTEXT.multiply(monthly_rate, growth), _CONTEXT.subtract(growth, 1))
+
+
+def monthly_installment(loan_amount, interest_rate, tenure):
+    """The monthly installment of a loan, as a Decimal rounded half up to the cent"""
+    installment = _CONTEXT.multiply(as_decimal(loan_amount), annuity_factor(interest_rate, tenure))
+    return installment.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def from_cents(cents):
+    """The Decimal amount of an integer number of cents"""
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def monthly_installments(loan_amounts, interest_rates, tenures):
+    """monthly_installment() over arrays of quotes, as an int64 array of cents.
+
+    Each distinct (rate, tenure) pair takes its factor from the cache, and the
+    products are taken in float64. Those within float error of a half cent
+    are priced again in Decimal, so every result equals the scalar one.
+    """
+    loan_amounts = np.asarray(loan_amounts, dtype=float)
+    interest_rates = np.asarray(interest_rates, dtype=float)
+    tenures = np.asarray(tenures, dtype=np.int64)
+    if not len(loan_amounts):
+        return np.zeros(0, dtype=np.int64)
+
+    pairs, inverse = np.unique(np.stack([interest_rates, tenures]), axis=1, return_inverse=True)
+    factors = np.array([float(annuity_factor(rate, int(tenure))) for rate, tenure in pairs.T.tolist()])
+    cents = loan_amounts * factors[inverse.reshape(-1)] * 100
+    result = np.floor(cents + 0.5).astype(np.int64)
+
+    # The float products are good to about 1e-15 relative, so only these may round the other way
+    unsure = np.abs(cents - np.floor(cents) - 0.5) < 1e-6 + np.abs(cents) * 1e-12
+    for i in np.flatnonzero(unsure).tolist():
+        exact = monthly_installment(loan_amounts[i].item(), interest_rates[i].item(), int(tenures[i]))
+        result[i] = int(exact.scaleb(2))
+    return result
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import time
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+# Async clients belong to the event loop they were created in
+_async_clients = weakref.WeakKeyDictionary()
+_unavailable_until = 0.0
+
+
+def get_redis():
+    """The shared Redis client, or None when Redis is disabled or recently unreachable"""
+    global _client
+    if not settings.REDIS_URL or time.monotonic() < _unavailable_until:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
+
+
+def get_async_redis():
+    """The running event loop's asyncio Redis client, or None like get_redis()"""
+    if not settings.REDIS_URL or time.monotonic() < _unavailable_until:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _async_clients[loop]
+
+
+def mark_unavailable(error):
+    """Skip Redis for REDIS_RETRY_SECONDS after a failed call, so requests do not each wait on it"""
+    global _unavailable_until
+    logger.warning('Redis unavailable, using database fallbacks for %ss: %s', settings.REDIS_RETRY_SECONDS, error)
+    _unavailable_until = time.monotonic() + settings.REDIS_RETRY_SECONDS
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .db_router import customer_pin, loan_pin, pin_to_primary
+from .metrics import aincrement, hit_rate, increment, read_counters
+from .redis_store import get_async_redis, get_redis, mark_unavailable
+from .renderers import ORJSONRenderer
+
+METRICS_GROUP = 'response_cache'
+ENTRY_PREFIX = 'response:'
+# Bumped when invalidations could not reach Redis, expiring every cached response
+GLOBAL_VERSION = 'response-version:all'
+
+# Set when this process committed a write while Redis was unreachable
+_flush_pending = threading.Event()
+
+
+def loan_version(loan_id):
+    return f'response-version:loan:{loan_id}'
+
+
+def customer_version(customer_id):
+    return f'response-version:customer:{customer_id}'
+
+
+def loan_list_version(customer_id):
+    return f'response-version:customer-loans:{customer_id}'
+
+
+def _versions(client, keys):
+    return [int(value or 0) for value in client.mget(keys)]
+
+
+async def _aversions(client, keys):
+    return [int(value or 0) for value in await client.mget(keys)]
+
+
+def _entry_if_current(raw, current):
+    """The cached entry `raw` unless one of the versions it was built from changed.
+
+    `current` maps version keys to their values; returns (entry or None,
+    version keys of the entry missing from `current`) so the caller can read
+    those and check again.
+    """
+    if raw is None:
+        return None, []
+    entry = json.loads(raw)
+    extra = [version_key for version_key in entry['versions'] if version_key not in current]
+    if extra:
+        return entry, extra
+    if any(current[version_key] != value for version_key, value in entry['versions'].items()):
+        return None, []
+    return entry, []
+
+
+def _lookup(client, key, version_keys):
+    """The cached entry under `key` if none of the versions it was built from changed since.
+
+    Returns (entry or None, current values of `version_keys`).
+    """
+    raw, *values = client.mget([key, *version_keys])
+    current = {version_key: int(value or 0) for version_key, value in zip(version_keys, values)}
+    entry, extra = _entry_if_current(raw, current)
+    if extra:
+        current.update(zip(extra, _versions(client, extra)))
+        entry, _ = _entry_if_current(raw, current)
+    return entry, current
+
+
+async def _alookup(client, key, version_keys):
+    raw, *values = await client.mget([key, *version_keys])
+    current = {version_key: int(value or 0) for version_key, value in zip(version_keys, values)}
+    entry, extra = _entry_if_current(raw, current)
+    if extra:
+        current.update(zip(extra, await _aversions(client, extra)))
+        entry, _ = _entry_if_current(raw, current)
+    return entry, current
+
+
+def _entry(data, versions):
+    body = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    etag = hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:32]
+    return {'versions': versions, 'etag': quote_etag(etag), 'body': body}
+
+
+def _apply_pending_flush(client):
+    if _flush_pending.is_set():
+        client.incr(GLOBAL_VERSION)
+        _flush_pending.clear()
+
+
+def _conditional_response(request, entry, make_response):
+    """`make_response(body, headers)` for the entry, or 304 Not Modified if the client has it.
+
+    Only the ETag is offered: a Last-Modified time has one-second resolution,
+    so a write in the second an entry was built would leave If-Modified-Since
+    matching stale data.
+    """
+    headers = {'ETag': entry['etag'], 'Cache-Control': 'no-cache'}
+    return get_conditional_response(request, etag=entry['etag'], response=make_response(entry['body'], headers))
+
+
+def cached_response(request, key, version_keys, build, resolve_version_keys=None):
+    """Serve `build()`'s data through the response cache, with an ETag header.
+
+    An entry is stored under `key` together with the current values of the
+    version counters it depends on: `version_keys`, plus on a miss those
+    returned by `resolve_version_keys()`, for keys that take a database lookup
+    to name. Every version is read before the build, so a response built while
+    a write commits is never served.
+    Conditional requests matching a cached entry get 304 Not Modified without
+    a database query. While Redis is unreachable every request is built, and
+    validated against its ETag.
+    """
+    key = ENTRY_PREFIX + key
+    version_keys = [GLOBAL_VERSION, *version_keys]
+    client = get_redis()
+    entry = None
+    if client is not None:
+        try:
+            _apply_pending_flush(client)
+            entry, current = _lookup(client, key, version_keys)
+            if entry is None:
+                increment(METRICS_GROUP, 'misses')
+                versions = {version_key: current[version_key] for version_key in version_keys}
+                extra = resolve_version_keys() if resolve_version_keys else []
+                if extra:
+                    versions.update(zip(extra, _versions(client, extra)))
+                entry = _entry(build(), versions)
+                client.set(key, json.dumps(entry), ex=settings.RESPONSE_CACHE_TTL_SECONDS)
+            else:
+                increment(METRICS_GROUP, 'hits')
+        except RedisError as e:
+            mark_unavailable(e)
+            increment(METRICS_GROUP, 'fallbacks')
+            entry = None
+    if entry is None:
+        if client is None:
+            increment(METRICS_GROUP, 'misses')
+        entry = _entry(build(), {})
+
+    response = _conditional_response(request, entry, lambda body, headers: Response(body, headers=headers))
+    if response.status_code == 304:
+        increment(METRICS_GROUP, 'not_modified')
+    return response
+
+
+def render_json(data, status=200, headers=None):
+    """A JSON response with the bytes DRF's JSONRenderer produces, for views outside DRF"""
+    renderer = ORJSONRenderer() if settings.FAST_RESPONSES else JSONRenderer()
+    return HttpResponse(renderer.render(data), status=status, headers=headers, content_type='application/json')
+
+
+async def acached_response(request, key, version_keys, build, resolve_version_keys=None):
+    """cached_response() for async views: `build` and `resolve_version_keys` are coroutine functions,
+    Redis is read without blocking.
+
+    Returns a plain Django response holding the JSON DRF would render.
+    """
+    key = ENTRY_PREFIX + key
+    version_keys = [GLOBAL_VERSION, *version_keys]
+    client = get_async_redis()
+    entry = None
+    if client is not None:
+        try:
+            if _flush_pending.is_set():
+                await client.incr(GLOBAL_VERSION)
+                _flush_pending.clear()
+            entry, current = await _alookup(client, key, version_keys)
+            if entry is None:
+                await aincrement(METRICS_GROUP, 'misses')
+                versions = {version_key: current[version_key] for version_key in version_keys}
+                extra = await resolve_version_keys() if resolve_version_keys else []
+                if extra:
+                    versions.update(zip(extra, await _aversions(client, extra)))
+                entry = _entry(await build(), versions)
+                await client.set(key, json.dumps(entry), ex=settings.RESPONSE_CACHE_TTL_SECONDS)
+            else:
+                await aincrement(METRICS_GROUP, 'hits')
+        except RedisError as e:
+            mark_unavailable(e)
+            await aincrement(METRICS_GROUP, 'fallbacks')
+            entry = None
+    if entry is None:
+        if client is None:
+            await aincrement(METRICS_GROUP, 'misses')
+        entry = _entry(await build(), {})
+
+    response = _conditional_response(request, entry, lambda body, headers: render_json(body, headers=headers))
+    if response.status_code == 304:
+        await aincrement(METRICS_GROUP, 'not_modified')
+    return response
+
+
+def _bump(version_keys):
+    client = get_redis()
+    if client is None:
+        if settings.REDIS_URL:
+            _flush_pending.set()
+        return
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for version_key in version_keys:
+            pipeline.incr(version_key)
+            # Outlives every entry that could have read the previous value
+            pipeline.expire(version_key, 2 * settings.RESPONSE_CACHE_TTL_SECONDS)
+        pipeline.execute()
+        _apply_pending_flush(client)
+    except RedisError as e:
+        mark_unavailable(e)
+        _flush_pending.set()
+        return
+    increment(METRICS_GROUP, 'invalidations', len(version_keys))
+
+
+def invalidate(loans=(), customers=(), owners=()):
+    """Expire cached responses showing these rows once the current transaction commits.
+
+    `loans` expires those loans' details, `customers` the details of every loan
+    of those customers along with their loan lists, and `owners` only the loan
+    lists of customers who gained or lost a loan (including the previous owner
+    of a reassigned loan). Until the replicas have caught up, these rows are
+    also read from the primary, so responses are not rebuilt from stale data.
+    """
+    version_keys = [loan_version(loan_id) for loan_id in loans]
+    version_keys += [customer_version(customer_id) for customer_id in customers]
+    version_keys += [loan_list_version(customer_id) for customer_id in owners]
+    if version_keys:
+        pin_to_primary([loan_pin(loan_id) for loan_id in loans]
+                       + [customer_pin(customer_id) for customer_id in {*customers, *owners}])
+        transaction.on_commit(lambda: _bump(version_keys))
+
+
+def response_cache_metrics():
+    """Hit rate of the view-loan and view-loans response cache"""
+    counters = read_counters(METRICS_GROUP)
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hit_rate(hits, misses),
+        'not_modified': counters.get('not_modified', 0),
+        'invalidations': counters.get('invalidations', 0),
+        'fallbacks': counters.get('fallbacks', 0),
+    }
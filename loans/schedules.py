@@ -0,0 +1,127 @@
+"""Amortization schedules: the installment, principal, interest and balance of every month of a loan.
+
+A schedule only depends on the loan's terms (amount, rate, tenure), so its
+encoded JSON and CSV are cached per terms in each process, up to
+SCHEDULE_CACHE_SIZE of them, and shared by every loan with the same terms.
+"""
+import functools
+
+import numpy as np
+from django.conf import settings
+
+from .pricing import CENT, as_decimal, monthly_installment
+
+SCHEDULE_COLUMNS = ('month', 'installment', 'principal', 'interest', 'balance')
+# Loan columns a schedule is built from
+SCHEDULE_LOAN_FIELDS = ('loan_id', 'loan_amount', 'interest_rate', 'tenure')
+CSV_HEADER = ','.join(('loan_id', *SCHEDULE_COLUMNS)) + '\r\n'
+
+
+def amortization_schedule(loan_amount, interest_rate, tenure):
+    """The monthly installment of a loan, and its schedule as int64 arrays of cents, one entry per month.
+
+    The balance after month k is P(1 + r)^k - EMI((1 + r)^k - 1) / r, with the
+    growth factors (1 + r)^k taken as one cumulative product, rounded to the
+    cent. A month's principal is the drop in the balance and its interest
+    the rest of the installment. The last installment, and any that would
+    overpay, are the remaining balance plus its interest.
+
+    Returns (installment, {column: array}) with the columns of SCHEDULE_COLUMNS.
+    """
+    installment = monthly_installment(loan_amount, interest_rate, tenure)
+    months = np.arange(1, max(tenure, 0) + 1)
+    if not len(months):
+        return installment, {column: np.zeros(0, dtype=np.int64) for column in SCHEDULE_COLUMNS}
+
+    emi = int(installment.scaleb(2))
+    rate = float(as_decimal(interest_rate)) / 1200
+    principal = int(as_decimal(loan_amount).quantize(CENT).scaleb(2))
+    if rate:
+        growth = np.cumprod(np.full(len(months), 1 + rate))
+        balances = principal * growth - emi * (growth - 1) / rate
+    else:
+        balances = principal - emi * months.astype(float)
+    balance = np.maximum(np.floor(balances + 0.5), 0).astype(np.int64)
+    balance[-1] = 0
+
+    opening = np.concatenate(([principal], balance[:-1]))
+    interest_due = np.floor(opening * rate + 0.5).astype(np.int64)
+    payment = np.minimum(emi, opening + interest_due)
+    payment[-1] = opening[-1] + interest_due[-1]
+    principal_paid = opening - balance
+    # Rounding can leave a cent of negative interest on a balance whose interest is under a cent
+    interest = np.maximum(payment - principal_paid, 0)
+    return installment, {
+        'month': months,
+        'installment': principal_paid + interest,
+        'principal': principal_paid,
+        'interest': interest,
+        'balance': balance,
+    }
+
+
+def _money(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def _rows(schedule):
+    columns = [schedule['month'].tolist()] + [
+        [_money(cents) for cents in schedule[column].tolist()] for column in SCHEDULE_COLUMNS[1:]
+    ]
+    return zip(*columns)
+
+
+@functools.lru_cache(maxsize=settings.SCHEDULE_CACHE_SIZE)
+def encoded_schedule(loan_amount, interest_rate, tenure, format):
+    """The schedule of these terms encoded for a loan's JSON object or CSV lines.
+
+    'json' gives the members after "loan_id", with the DRF representation of
+    the terms; 'csv' gives one line per month without its loan_id column.
+    """
+    installment, schedule = amortization_schedule(loan_amount, interest_rate, tenure)
+    if format == 'csv':
+        return tuple(','.join((str(month), *values)) + '\r\n' for month, *values in _rows(schedule))
+    months = ','.join(
+        f'{{"month":{month},"installment":"{paid}","principal":"{principal}",'
+        f'"interest":"{interest}","balance":"{balance}"}}'
+        for month, paid, principal, interest, balance in _rows(schedule)
+    )
+    return (
+        f'"loan_amount":"{as_decimal(loan_amount).quantize(CENT):f}",'
+        f'"interest_rate":"{as_decimal(interest_rate).quantize(CENT):f}",'
+        f'"tenure":{tenure},"monthly_installment":"{installment:f}","schedule":[{months}]'
+    )
+
+
+def schedule_json(loan):
+    """The JSON object of a loan's schedule, for a SCHEDULE_LOAN_FIELDS row"""
+    loan_id, *terms = loan
+    return f'{{"loan_id":{loan_id},{encoded_schedule(*terms, "json")}}}'
+
+
+def schedule_csv(loan):
+    """The CSV lines of a loan's schedule, for a SCHEDULE_LOAN_FIELDS row"""
+    loan_id, *terms = loan
+    return ''.join(f'{loan_id},{line}' for line in encoded_schedule(*terms, 'csv'))
+
+
+def schedule_chunks(loans, format, many=True):
+    """Text chunks of the schedules of SCHEDULE_LOAN_FIELDS rows: a JSON array (or one object), or CSV"""
+    if format == 'csv':
+        yield CSV_HEADER
+        for loan in loans:
+            yield schedule_csv(loan)
+        return
+    if not many:
+        for loan in loans:
+            yield schedule_json(loan)
+        return
+    yield '['
+    for position, loan in enumerate(loans):
+        yield (',' if position else '') + schedule_json(loan)
+    yield ']'
+
+
+def schedule_cache_metrics():
+    info = encoded_schedule.cache_info()
+    return {'size': info.currsize, 'max_size': info.maxsize, 'hits': info.hits, 'misses': info.misses}
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from .columnar_cache import build_cache, bundle_path, is_built, read_bundle
+from .ingestion import (
+    CUSTOMER_COLUMNS, LOAN_COLUMNS, MISSING_ROW_ACTIONS, find_missing_rows, load_customer_ids, soft_delete_rows,
+    upsert_customers, upsert_loans,
+)
+from .models import Customer, IngestionCheckpoint, Loan
+
+INGEST_KINDS = ('customers', 'loans')
+
+# Primary key column of each kind of source row
+KEY_COLUMNS = {
+    'customers': CUSTOMER_COLUMNS['customer_id'],
+    'loans': LOAN_COLUMNS['loan_id'],
+}
+
+INGEST_MODELS = {
+    'customers': Customer,
+    'loans': Loan,
+}
+
+# Per-chunk counts summed into a file's ingestion statistics
+COUNT_KEYS = ('rows', 'skipped', 'inserted', 'updated', 'unchanged')
+
+
+class MemoryLimitExceeded(Exception):
+    """The ingesting process grew past its memory ceiling; committed chunks are checkpointed"""
+
+
+def current_rss_bytes():
+    """Resident set size of this process, or None where it cannot be read cheaply"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ChunkReader:
+    """Yield a tabular file as DataFrames of at most `chunk_size` rows.
+
+    Supports .xlsx (openpyxl read-only mode), .csv and .jsonl/.ndjson. The first
+    `skip_rows` data rows are skipped without being materialized. `chunk_size`
+    may be lowered between chunks to shrink the memory used by later ones.
+    With a `cache_dir`, a workbook is parsed once into a columnar cache keyed
+    on its content hash, and later reads memory-map the cache instead.
+    """
+
+    def __init__(self, file_path, chunk_size, skip_rows=0, cache_dir=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.skip_rows = skip_rows
+        self.cache_dir = cache_dir
+
+    def __iter__(self):
+        extension = os.path.splitext(self.file_path)[1].lower()
+        if extension in ('.xlsx', '.xlsm'):
+            return self._cached_chunks() if self.cache_dir else self._excel_chunks()
+        if extension == '.csv':
+            return self._csv_chunks()
+        if extension in ('.jsonl', '.ndjson'):
+            return self._jsonl_chunks()
+        raise ValueError(f'Unsupported ingestion file type: {extension}')
+
+    def _chunk_rows(self, rows, columns):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    def _excel_chunks(self):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            # Empty rows (common at the end of exported workbooks) are not data rows
+            rows = (
+                row for row in workbook.active.iter_rows(values_only=True)
+                if any(value is not None for value in row)
+            )
+            header = next(rows, None)
+            if header is None:
+                return
+            for _ in range(self.skip_rows):
+                if next(rows, None) is None:
+                    return
+            yield from self._chunk_rows(rows, list(header))
+        finally:
+            workbook.close()
+
+    def _cached_chunks(self):
+        bundle_dir = bundle_path(self.file_path, self.cache_dir)
+        if not is_built(bundle_dir):
+            build_cache(self.file_path, bundle_dir, ChunkReader(self.file_path, self.chunk_size))
+        for segment in read_bundle(bundle_dir, self.skip_rows):
+            start = 0
+            while start < len(segment):
+                stop = start + self.chunk_size
+                yield segment.iloc[start:stop]
+                start = stop
+
+    def _csv_chunks(self):
+        with pd.read_csv(self.file_path, iterator=True, skiprows=range(1, self.skip_rows + 1)) as reader:
+            while True:
+                try:
+                    yield reader.get_chunk(self.chunk_size)
+                except StopIteration:
+                    return
+
+    def _jsonl_chunks(self):
+        with open(self.file_path) as source:
+            records = (json.loads(line) for line in source if line.strip())
+            for _ in range(self.skip_rows):
+                if next(records, None) is None:
+                    return
+            yield from self._chunk_rows(records, None)
+
+
+def _column(chunk, names, file_path):
+    column = next((name for name in names if name in chunk.columns), None)
+    if column is None:
+        raise ValueError(f'{file_path} has no {" or ".join(names)} column')
+    return column
+
+
+def _key_column(kind, chunk, file_path):
+    return _column(chunk, KEY_COLUMNS[kind], file_path)
+
+
+def _last_owners(file_path, chunk_size, cache_dir=None):
+    """The customer of each loan id's last occurrence in a loan file, as (sorted loan ids, customer ids)"""
+    loan_ids, customer_ids = [], []
+    for chunk in ChunkReader(file_path, chunk_size, cache_dir=cache_dir):
+        loan_ids.append(chunk[_key_column('loans', chunk, file_path)].to_numpy(dtype=np.int64))
+        customer_ids.append(chunk[_column(chunk, LOAN_COLUMNS['customer_id'], file_path)].to_numpy(dtype=np.int64))
+    if not loan_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # np.unique gives each id's first index, which in the reversed rows is its last occurrence
+    ids, last = np.unique(np.concatenate(loan_ids)[::-1], return_index=True)
+    return ids, np.concatenate(customer_ids)[::-1][last]
+
+
+def file_fingerprint(file_path):
+    """Cheap identity of a source file, so a checkpoint is only resumed against the same file"""
+    stat = os.stat(file_path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def split_source(kind, file_path, partitions, work_dir, chunk_size, force=False, cache_dir=None):
+    """Stream a source file once into `partitions` CSV files, hashed on the customer id.
+
+    Loans go to the partition of the customer their loan id's last occurrence
+    belongs to, found in a first pass over the loan ids. Every row of a loan
+    id, and every loan of a customer, is then in one partition: parallel
+    partitions never write the same row or the same customer's profile, and
+    later duplicates still win. The partition directory is derived from the source file's identity, so
+    splitting the same unchanged file again reuses the finished split (and the
+    partitions' ingestion checkpoints) unless `force` is set. Returns
+    (run directory, partition paths); empty partitions are omitted. Workbooks
+    are read through the columnar cache in `cache_dir` when one is given.
+    """
+    if kind not in INGEST_KINDS:
+        raise ValueError(f"Unknown ingestion kind {kind!r}, expected one of {', '.join(INGEST_KINDS)}")
+
+    source = os.path.abspath(file_path)
+    run_key = hashlib.sha1(f'{source}:{file_fingerprint(source)}:{partitions}'.encode()).hexdigest()[:16]
+    run_dir = os.path.join(work_dir, f'{kind}-{run_key}')
+    done_marker = os.path.join(run_dir, 'SPLIT_COMPLETE')
+    if os.path.exists(done_marker) and not force:
+        return run_dir, sorted(
+            os.path.join(run_dir, name) for name in os.listdir(run_dir) if name.endswith('.csv')
+        )
+
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    paths = [os.path.join(run_dir, f'part-{index:03d}.csv') for index in range(partitions)]
+    written = set()
+    owners = _last_owners(source, chunk_size, cache_dir) if kind == 'loans' else None
+
+    for chunk in ChunkReader(source, chunk_size, cache_dir=cache_dir):
+        keys = chunk[_key_column(kind, chunk, file_path)].to_numpy(dtype=np.int64)
+        if owners is not None:
+            loan_ids, customer_ids = owners
+            keys = customer_ids[np.searchsorted(loan_ids, keys)]
+        for index, part in chunk.groupby(keys % partitions, sort=False):
+            part.to_csv(paths[index], mode='a', header=index not in written, index=False)
+            written.add(index)
+
+    open(done_marker, 'w').close()
+    return run_dir, [paths[index] for index in sorted(written)]
+
+
+def ingest_file(kind, file_path, chunk_size, batch_size, method='auto', memory_limit_mb=None, resume=True,
+                refresh_profiles=True, cache_dir=None, delta=False):
+    """Stream a customer or loan file into the database one committed chunk at a time.
+
+    Every chunk is written in its own transaction together with the checkpoint
+    recording how many source rows are committed, so an interrupted run resumes
+    after the last committed chunk. Chunks shrink when one would use more than a
+    quarter of `memory_limit_mb`, and the run stops with MemoryLimitExceeded if
+    the process still grows past the limit. Pass refresh_profiles=False when
+    several files are ingested concurrently and profiles are rebuilt afterwards.
+    Workbooks are read through the columnar cache in `cache_dir` when one is
+    given. With `delta`, rows whose content is unchanged since they were last
+    ingested are not rewritten. Returns ingestion statistics.
+    """
+    if kind not in INGEST_KINDS:
+        raise ValueError(f"Unknown ingestion kind {kind!r}, expected one of {', '.join(INGEST_KINDS)}")
+
+    started = time.perf_counter()
+    source = os.path.abspath(file_path)
+    fingerprint = file_fingerprint(source)
+    checkpoint, _ = IngestionCheckpoint.objects.get_or_create(
+        kind=kind, source=source, defaults={'fingerprint': fingerprint}
+    )
+    if not resume or checkpoint.completed or checkpoint.fingerprint != fingerprint:
+        checkpoint.fingerprint = fingerprint
+        checkpoint.rows_committed = 0
+        checkpoint.completed = False
+        checkpoint.save()
+    resumed_from = checkpoint.rows_committed
+
+    memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+    known_customers = load_customer_ids() if kind == 'loans' else None
+    reader = ChunkReader(source, chunk_size, skip_rows=resumed_from, cache_dir=cache_dir)
+    totals = dict.fromkeys(COUNT_KEYS, 0)
+
+    for chunk in reader:
+        with transaction.atomic():
+            if kind == 'customers':
+                counts = upsert_customers(chunk, batch_size, method, delta=delta)
+            else:
+                counts = upsert_loans(
+                    chunk, batch_size, method, known_customers, refresh_profiles=refresh_profiles, delta=delta
+                )
+            checkpoint.rows_committed += len(chunk)
+            checkpoint.save(update_fields=['rows_committed', 'updated_at'])
+        for key in COUNT_KEYS:
+            totals[key] += counts[key]
+
+        if memory_limit:
+            chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+            if chunk_bytes > memory_limit // 4:
+                reader.chunk_size = max(1, reader.chunk_size * (memory_limit // 4) // chunk_bytes)
+            del chunk
+            rss = current_rss_bytes()
+            if rss is not None and rss > memory_limit:
+                raise MemoryLimitExceeded(
+                    f'Process memory {rss // (1024 * 1024)} MB exceeds the {memory_limit_mb} MB limit '
+                    f'after {checkpoint.rows_committed} committed rows; re-run to resume'
+                )
+
+    checkpoint.completed = True
+    checkpoint.save(update_fields=['completed', 'updated_at'])
+
+    seconds = time.perf_counter() - started
+    return {
+        **totals,
+        'resumed_from': resumed_from,
+        'seconds': seconds,
+        'rows_per_second': totals['rows'] / seconds if seconds else 0,
+    }
+
+
+def source_keys(kind, file_path, chunk_size, cache_dir=None):
+    """Every distinct primary key in a source file, read chunk by chunk"""
+    keys = [
+        chunk[_key_column(kind, chunk, file_path)].to_numpy(dtype=np.int64)
+        for chunk in ChunkReader(file_path, chunk_size, cache_dir=cache_dir)
+    ]
+    return np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+
+
+def reconcile_missing_rows(kind, keys, action):
+    """Find ingested rows of `kind` absent from the source `keys`, soft-deleting them if asked.
+
+    Returns the missing primary keys; with action 'ignore' nothing is looked up.
+    """
+    if action not in MISSING_ROW_ACTIONS:
+        raise ValueError(f"Unknown missing-row action {action!r}, expected one of {', '.join(MISSING_ROW_ACTIONS)}")
+    if action == 'ignore':
+        return np.empty(0, dtype=np.int64)
+    missing = find_missing_rows(INGEST_MODELS[kind], keys)
+    if action == 'soft-delete' and len(missing):
+        with transaction.atomic():
+            soft_delete_rows(INGEST_MODELS[kind], missing)
+    return missing
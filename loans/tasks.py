@@ -1,79 +1,211 @@
-import pandas as pd
-from datetime import datetime
+import os
+import shutil
 from django.conf import settings
-from celery import shared_task
-from .models import Customer, Loan
+from celery import chain, chord, group, shared_task
+from .archive import archive_loans
+from .credit_profiles import close_finished_loans
+from .models import IngestionCheckpoint, Loan
+from .partitions import ensure_partitions
+from .streaming import (
+    COUNT_KEYS, file_fingerprint, ingest_file, reconcile_missing_rows, source_keys, split_source,
+)
+
+
+def _ingest(kind, file_path, batch_size, method, restart, delta, missing):
+    stats = ingest_file(
+        kind,
+        file_path,
+        chunk_size=settings.INGEST_CHUNK_SIZE,
+        batch_size=batch_size or settings.INGEST_BATCH_SIZE,
+        method=method or settings.INGEST_METHOD,
+        memory_limit_mb=settings.INGEST_MEMORY_LIMIT_MB,
+        resume=not restart,
+        cache_dir=settings.INGEST_CACHE_DIR or None,
+        delta=delta,
+    )
+    stats['missing'] = _reconcile(kind, file_path, missing)
+    return stats
+
+
+def _reconcile(kind, file_path, missing):
+    if missing == 'ignore':
+        return []
+    keys = source_keys(kind, file_path, settings.INGEST_CHUNK_SIZE, settings.INGEST_CACHE_DIR or None)
+    return reconcile_missing_rows(kind, keys, missing).tolist()
+
+
+def _counts(stats):
+    counts = f"inserted {stats['inserted']}, updated {stats['updated']}, unchanged {stats['unchanged']}"
+    if stats['skipped']:
+        counts += f", skipped {stats['skipped']} rows with unknown customers"
+    return counts
+
+
+def _missing(keys, action):
+    if not keys:
+        return ''
+    shown = ', '.join(str(key) for key in keys[:10]) + (', ...' if len(keys) > 10 else '')
+    verb = 'soft-deleted' if action == 'soft-delete' else 'left in place'
+    return f"; {len(keys)} rows no longer in the source ({verb}): ids {shown}"
+
+
+def _summary(kind, stats, missing='ignore'):
+    message = (
+        f"Successfully ingested {stats['rows']} {kind} records "
+        f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/sec): {_counts(stats)}"
+    )
+    if stats['resumed_from']:
+        message += f", resumed after row {stats['resumed_from']}"
+    return message + _missing(stats['missing'], missing)
 
 
 @shared_task
-def ingest_customer_data(file_path):
-    """Background task to ingest customer data from Excel file"""
+def ingest_customer_data(file_path, batch_size=None, method=None, restart=False, delta=False, missing='ignore'):
+    """Background task to ingest customer data from an Excel, CSV or JSONL file"""
     try:
-        df = pd.read_excel(file_path)
-
-        for _, row in df.iterrows():
-            # Handle different possible column name formats
-            customer_id = row.get('customer_id') or row.get('Customer ID')
-            first_name = row.get('first_name') or row.get('First Name')
-            last_name = row.get('last_name') or row.get('Last Name')
-            phone_number = row.get('phone_number') or row.get('Phone Number')
-            monthly_salary = row.get('monthly_salary') or row.get('Monthly Salary')
-            approved_limit = row.get('approved_limit') or row.get('Approved Limit')
-            age = row.get('age') or row.get('Age', 25)
-            current_debt = row.get('current_debt', 0)
-            
-            Customer.objects.update_or_create(
-                customer_id=customer_id,
-                defaults={
-                    'first_name': first_name,
-                    'last_name': last_name,
-                    'phone_number': str(phone_number),
-                    'monthly_salary': monthly_salary,
-                    'approved_limit': approved_limit,
-                    'current_debt': current_debt,
-                    'age': age
-                }
-            )
-        return f"Successfully ingested {len(df)} customer records"
+        stats = _ingest('customers', file_path, batch_size, method, restart, delta, missing)
+        return _summary('customer', stats, missing)
     except Exception as e:
         return f"Error ingesting customer data: {str(e)}"
 
 
 @shared_task
-def ingest_loan_data(file_path):
-    """Background task to ingest loan data from Excel file"""
+def ingest_loan_data(file_path, batch_size=None, method=None, restart=False, delta=False, missing='ignore'):
+    """Background task to ingest loan data from an Excel, CSV or JSONL file"""
     try:
-        df = pd.read_excel(file_path)
-
-        for _, row in df.iterrows():
-            # Handle different possible column name formats
-            customer_id = row.get('customer id') or row.get('Customer ID')
-            loan_id = row.get('loan id') or row.get('Loan ID')
-            loan_amount = row.get('loan amount') or row.get('Loan Amount')
-            tenure = row.get('tenure') or row.get('Tenure')
-            interest_rate = row.get('interest rate') or row.get('Interest Rate')
-            monthly_payment = row.get('monthly repayment (emi)') or row.get('Monthly payment')
-            emis_paid = row.get('EMIs paid on time') or row.get('EMIs paid on Time')
-            start_date_col = row.get('start date') or row.get('Date of Approval')
-            end_date_col = row.get('end date') or row.get('End Date')
-            
-            customer = Customer.objects.get(customer_id=customer_id)
-            start_date = pd.to_datetime(start_date_col).date()
-            end_date = pd.to_datetime(end_date_col).date()
-
-            Loan.objects.update_or_create(
-                loan_id=loan_id,
-                defaults={
-                    'customer': customer,
-                    'loan_amount': loan_amount,
-                    'tenure': tenure,
-                    'interest_rate': interest_rate,
-                    'monthly_installment': monthly_payment,
-                    'emis_paid_on_time': emis_paid,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                }
-            )
-        return f"Successfully ingested {len(df)} loan records"
+        return _summary('loan', _ingest('loans', file_path, batch_size, method, restart, delta, missing), missing)
     except Exception as e:
-        return f"Error ingesting loan data: {str(e)}"
\ No newline at end of file
+        return f"Error ingesting loan data: {str(e)}"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=5)
+def ingest_partition(self, kind, partition_path, batch_size=None, method=None, delta=False):
+    """Ingest one partition file; a retried or redelivered task resumes from its checkpoint"""
+    source = os.path.abspath(partition_path)
+    already_done = IngestionCheckpoint.objects.filter(
+        kind=kind, source=source, fingerprint=file_fingerprint(source), completed=True
+    ).exists()
+    if already_done:
+        # Finished by an earlier run of the same split
+        return {'partition': partition_path, **dict.fromkeys(COUNT_KEYS, 0), 'seconds': 0, 'error': None}
+
+    try:
+        stats = ingest_file(
+            kind,
+            partition_path,
+            chunk_size=settings.INGEST_CHUNK_SIZE,
+            batch_size=batch_size or settings.INGEST_BATCH_SIZE,
+            method=method or settings.INGEST_METHOD,
+            memory_limit_mb=settings.INGEST_MEMORY_LIMIT_MB,
+            delta=delta,
+        )
+    except Exception as e:
+        if not self.request.called_directly and self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        return {'partition': partition_path, **dict.fromkeys(COUNT_KEYS, 0), 'seconds': 0, 'error': str(e)}
+    return {
+        'partition': partition_path,
+        **{key: stats[key] for key in COUNT_KEYS},
+        'seconds': stats['seconds'],
+        'error': None,
+    }
+
+
+@shared_task
+def summarize_partitions(results, kind, run_dir, previous=None, source=None):
+    """Combine per-partition results into one summary, appended to those of earlier steps"""
+    summary = {
+        'kind': kind,
+        'source': source,
+        'run_dir': run_dir,
+        'partitions': len(results),
+        **{key: sum(result[key] for result in results) for key in COUNT_KEYS},
+        'seconds': max((result['seconds'] for result in results), default=0),
+        'errors': [
+            {'partition': result['partition'], 'error': result['error']}
+            for result in results if result['error']
+        ],
+    }
+    return (previous or []) + [summary]
+
+
+@shared_task(bind=True)
+def fan_out_ingestion(self, previous, kind, file_path, partitions, batch_size=None, method=None, restart=False,
+                      delta=False):
+    """Split a source file into partitions and replace this task with a chord ingesting them in parallel"""
+    run_dir, paths = split_source(
+        kind, file_path, partitions, settings.INGEST_WORK_DIR, settings.INGEST_CHUNK_SIZE, force=restart,
+        cache_dir=settings.INGEST_CACHE_DIR or None,
+    )
+    if not paths:
+        return summarize_partitions([], kind, run_dir, previous, file_path)
+    header = group(ingest_partition.s(kind, path, batch_size, method, delta) for path in paths)
+    return self.replace(chord(header, summarize_partitions.s(kind, run_dir, previous, file_path)))
+
+
+@shared_task
+def finalize_ingestion(summaries, missing='ignore'):
+    """Handle rows gone from the sources once all partitions are loaded, clean up finished splits
+    and report the counts.
+
+    Credit profiles need no rebuild here: each loan chunk refreshed its own
+    customers' profiles in the transaction that wrote it.
+    """
+    lines = []
+    for summary in summaries:
+        if not summary['errors']:
+            IngestionCheckpoint.objects.filter(source__startswith=summary['run_dir'] + os.sep).delete()
+            shutil.rmtree(summary['run_dir'], ignore_errors=True)
+        rate = summary['rows'] / summary['seconds'] if summary['seconds'] else 0
+        line = (
+            f"{summary['kind']}: {summary['rows']} rows in {summary['partitions']} partitions "
+            f"({rate:.0f} rows/sec): {_counts(summary)}"
+        )
+        line += _missing(_reconcile(summary['kind'], summary['source'], missing), missing)
+        for error in summary['errors']:
+            line += f"\n  {error['partition']}: {error['error']}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def parallel_ingestion(customer_file, loan_file, partitions, batch_size=None, method=None, restart=False,
+                       delta=False, missing='ignore'):
+    """Celery workflow: all customer partitions in parallel, then all loan partitions, then the report"""
+    return chain(
+        fan_out_ingestion.s([], 'customers', customer_file, partitions, batch_size, method, restart, delta),
+        fan_out_ingestion.s('loans', loan_file, partitions, batch_size, method, restart, delta),
+        finalize_ingestion.s(missing),
+    )
+
+
+def run_parallel_ingestion_locally(customer_file, loan_file, partitions, batch_size=None, method=None,
+                                   restart=False, delta=False, missing='ignore'):
+    """The parallel_ingestion workflow executed in this process, for when no Celery broker is reachable"""
+    summaries = []
+    for kind, file_path in (('customers', customer_file), ('loans', loan_file)):
+        run_dir, paths = split_source(
+            kind, file_path, partitions, settings.INGEST_WORK_DIR, settings.INGEST_CHUNK_SIZE, force=restart,
+            cache_dir=settings.INGEST_CACHE_DIR or None,
+        )
+        results = [ingest_partition(kind, path, batch_size, method, delta) for path in paths]
+        summaries = summarize_partitions(results, kind, run_dir, summaries, file_path)
+    return finalize_ingestion(summaries, missing)
+
+
+@shared_task
+def sweep_finished_loans():
+    """Daily beat task: deactivate loans that have ended or been repaid, refreshing their credit profiles"""
+    return f'Closed {close_finished_loans()} finished loans'
+
+
+@shared_task
+def create_loan_partitions():
+    """Create the loan table partitions that are due, on PostgreSQL"""
+    created = ensure_partitions(Loan)
+    return f"Created {len(created)} loan partitions" + (f": {', '.join(created)}" if created else '')
+
+
+@shared_task
+def archive_old_loans():
+    """Weekly beat task: move loans closed more than LOAN_ARCHIVE_AFTER_DAYS ago to cold storage"""
+    return f'Archived {archive_loans()} loans'
@@ -1,3 +1,1623 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from io import StringIO
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import F, Max, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from redis.exceptions import RedisError
+from rest_framework.renderers import JSONRenderer
+
+from celery.backends.cache import CacheBackend
+from credit_approval_system.celery import app as celery_app
+
+from .archive import archive_loans, read_archived_loans
+from .credit_profiles import close_finished_loans, rebuild_credit_profiles
+from .ingestion import ingest_loans, soft_delete_rows, upsert_customers
+from .columnar_cache import bundle_path
+from .db_pool import pool_metrics
+from .models import ArchivedLoanSummary, Customer, CustomerCreditProfile, IdempotencyRecord, IngestionCheckpoint, Loan
+from .partitions import ensure_partitions, partition_bounds, partition_key
+from .renderers import ORJSONRenderer
+from .serializers import CustomerLoansSerializer, LoanDetailSerializer
+from .streaming import ChunkReader, MemoryLimitExceeded, ingest_file, split_source
+from .urls import api_urlpatterns
+from .tasks import (
+    create_loan_partitions, ingest_customer_data, ingest_loan_data, ingest_partition, parallel_ingestion,
+    run_parallel_ingestion_locally, sweep_finished_loans,
+)
+from . import db_router, eligibility, metrics, partitions, pricing, response_cache, schedules
+from .eligibility import calculate_credit_score, get_loan_aggregates
+
+# Keep the columnar ingestion cache and the loan archive out of the project directory,
+# and keep the API on its database fallbacks unless a test provides a Redis client
+CACHE_DIR = tempfile.TemporaryDirectory()
+cache_override = override_settings(
+    INGEST_CACHE_DIR=CACHE_DIR.name, LOAN_ARCHIVE_DIR=os.path.join(CACHE_DIR.name, 'archive'), REDIS_URL='',
+    DATABASE_REPLICAS=[],
+)
+# On PostgreSQL the new loan and the debt increment are written by one statement
+CREATE_LOAN_QUERIES = 6 if connection.vendor == 'postgresql' else 7
+# The API with its read endpoints served by loans.async_views (ROOT_URLCONF='loans.tests')
+urlpatterns = [path('api/', include(api_urlpatterns(async_reads=True)))]
+
+
+def setUpModule():
+    cache_override.enable()
+
+
+def tearDownModule():
+    cache_override.disable()
+    CACHE_DIR.cleanup()
+
+
+def make_customer(customer_id=1, **overrides):
+    data = {
+        'customer_id': customer_id,
+        'first_name': 'Test',
+        'last_name': f'Customer{customer_id}',
+        'age': 30,
+        'phone_number': f'90000{customer_id:05d}',
+        'monthly_salary': Decimal('50000.00'),
+        'approved_limit': Decimal('1800000.00'),
+    }
+    data.update(overrides)
+    return Customer.objects.create(**data)
+
+
+def make_loans(customer, count, start_date=None):
+    """Create `count` loans with varied amounts, tenures and start dates"""
+    today = date.today()
+    loans = []
+    for i in range(count):
+        start = start_date or today - timedelta(days=200 * (i % 7))
+        loans.append(Loan(
+            customer=customer,
+            loan_amount=Decimal('10000.00') + Decimal(i * 1237) + Decimal('0.35'),
+            tenure=12 + (i % 4) * 12,
+            interest_rate=Decimal('10.50'),
+            monthly_installment=Decimal('1500.00') + Decimal(i % 9),
+            emis_paid_on_time=(i * 5) % 12,
+            start_date=start,
+            end_date=start + timedelta(days=365),
+        ))
+        loans[-1].is_active = loans[-1].is_open()
+    return Loan.objects.bulk_create(loans)
+
+
+def legacy_credit_score(customer):
+    """Reference implementation: the original per-loan Python passes"""
+    loans = Loan.objects.filter(customer=customer)
+    if not loans.exists():
+        return 0
+    score = 0
+    total_emis = sum(loan.tenure for loan in loans)
+    paid_on_time = sum(loan.emis_paid_on_time for loan in loans)
+    if total_emis > 0:
+        score += min(20, (paid_on_time / total_emis) * 100 * 0.2)
+    score += min(20, loans.count() * 2)
+    current_year_loans = loans.filter(start_date__year=date.today().year)
+    score += min(30, sum(float(loan.loan_amount) for loan in current_year_loans) / 10000)
+    score += min(30, sum(float(loan.loan_amount) for loan in loans) / 10000)
+    return min(100, score)
+
+
+class CreditScoreTests(TestCase):
+    def test_no_loans_scores_zero(self):
+        customer = make_customer()
+        self.assertEqual(calculate_credit_score(customer), 0)
+
+    def test_matches_legacy_score(self):
+        for customer_id, count in enumerate((1, 3, 10, 40), start=1):
+            customer = make_customer(customer_id)
+            make_loans(customer, count)
+            self.assertEqual(calculate_credit_score(customer), legacy_credit_score(customer))
+
+    def test_scoring_is_a_single_query(self):
+        customer = make_customer()
+        make_loans(customer, 100)
+        with self.assertNumQueries(1):
+            calculate_credit_score(customer)
+
+    def test_current_year_volume_is_bounded_by_calendar_year(self):
+        customer = make_customer()
+        year = date.today().year
+        for start in (date(year - 1, 12, 31), date(year, 1, 1), date(year, 12, 31), date(year + 1, 1, 1)):
+            make_loans(customer, 1, start_date=start)
+        aggregates = get_loan_aggregates(customer)
+        this_year = Loan.objects.filter(customer=customer, start_date__year=year).aggregate(total=Sum('loan_amount'))
+        self.assertEqual(aggregates['current_year_volume'], this_year['total'])
+        rebuild_credit_profiles([customer.customer_id])
+        self.assertEqual(CustomerCreditProfile.objects.get(customer=customer).current_year_volume, this_year['total'])
+
+
+class CheckEligibilityTests(TestCase):
+    def check(self, customer, loan_amount=10000):
+        payload = {'customer_id': customer.customer_id, 'loan_amount': loan_amount, 'interest_rate': 10, 'tenure': 12}
+        return self.client.post('/api/check-eligibility', payload, content_type='application/json')
+
+    def test_query_count_is_constant_with_credit_profile(self):
+        for customer_id, count in ((1, 10), (2, 1000)):
+            customer = make_customer(customer_id)
+            make_loans(customer, count)
+            rebuild_credit_profiles([customer_id])
+            # A single customer + credit profile lookup, whatever the loan history
+            with self.assertNumQueries(1):
+                response = self.check(customer)
+            self.assertEqual(response.status_code, 200)
+
+    def test_falls_back_to_loan_aggregates_without_profile(self):
+        customer = make_customer()
+        make_loans(customer, 20)
+        with self.assertNumQueries(2):
+            response = self.check(customer)
+        self.assertEqual(response.status_code, 200)
+
+
+class CreditProfileTests(TestCase):
+    def assertProfileMatchesLoans(self, customer):
+        profile = CustomerCreditProfile.objects.get(customer=customer)
+        self.assertEqual(profile.as_aggregates(), get_loan_aggregates(customer))
+
+    def test_rebuild_matches_loan_aggregates(self):
+        customer = make_customer()
+        make_loans(customer, 15)
+        rebuild_credit_profiles()
+        self.assertProfileMatchesLoans(customer)
+
+    def test_create_loan_updates_profile(self):
+        customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        make_loans(customer, 12, start_date=date.today())
+        rebuild_credit_profiles()
+        payload = {'customer_id': customer.customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        response = self.client.post('/api/create-loan', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertProfileMatchesLoans(customer)
+
+    def test_create_loan_builds_missing_profile(self):
+        customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        make_loans(customer, 12, start_date=date.today())
+        payload = {'customer_id': customer.customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        self.client.post('/api/create-loan', payload, content_type='application/json')
+        self.assertProfileMatchesLoans(customer)
+
+    def test_stale_current_year_volume_reads_as_zero(self):
+        customer = make_customer()
+        profile = CustomerCreditProfile.objects.create(
+            customer=customer, num_loans=1, current_year_volume=Decimal('5000.00'), volume_year=date.today().year - 1
+        )
+        self.assertEqual(profile.as_aggregates()['current_year_volume'], 0)
+
+    def test_ingest_loan_data_updates_profiles(self):
+        first = make_customer(1)
+        second = make_customer(2)
+        make_loans(first, 3)
+        rebuild_credit_profiles()
+        moved = Loan.objects.filter(customer=first).first()
+        rows = [{
+            'Customer ID': 2, 'Loan ID': moved.loan_id, 'Loan Amount': 90000, 'Tenure': 12,
+            'Interest Rate': 9.5, 'Monthly payment': 7900, 'EMIs paid on Time': 6,
+            'Date of Approval': date.today(), 'End Date': date.today() + timedelta(days=365),
+        }]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'loans.xlsx')
+            pd.DataFrame(rows).to_excel(path, index=False)
+            result = ingest_loan_data(path)
+        self.assertTrue(result.startswith('Successfully'), result)
+        self.assertEqual(CustomerCreditProfile.objects.get(customer=second).num_loans, 1)
+        self.assertProfileMatchesLoans(first)
+        self.assertProfileMatchesLoans(second)
+
+    def test_verify_command_reports_drift(self):
+        customer = make_customer()
+        make_loans(customer, 4)
+        call_command('rebuild_credit_profiles', stdout=StringIO())
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+        CustomerCreditProfile.objects.filter(customer=customer).update(num_loans=99)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+
+
+class LoanCreationTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(
+            approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'), current_debt=Decimal('1000.00')
+        )
+        make_loans(self.customer, 12, start_date=date.today())
+        rebuild_credit_profiles()
+        self.payload = {'customer_id': self.customer.customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+
+    def create(self):
+        return self.client.post('/api/create-loan', self.payload, content_type='application/json')
+
+    def test_debt_increment_does_not_lose_concurrent_updates(self):
+        real_evaluate = eligibility.evaluate_eligibility
+
+        def evaluate_during_concurrent_update(customer, *args):
+            # Another request's debt increment commits after this one loaded the customer
+            Customer.objects.filter(pk=customer.pk).update(current_debt=F('current_debt') + 500)
+            return real_evaluate(customer, *args)
+
+        with mock.patch('loans.eligibility.evaluate_eligibility', side_effect=evaluate_during_concurrent_update):
+            self.assertEqual(self.create().status_code, 201)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('26500.00'))
+
+    def test_loan_write_methods(self):
+        methods = ['orm', 'cte'] if connection.vendor == 'postgresql' else ['orm']
+        for number, method in enumerate(methods, start=1):
+            with override_settings(LOAN_WRITE_METHOD=method):
+                loan_id = self.create().json()['loan_id']
+            loan = Loan.objects.get(pk=loan_id)
+            self.assertEqual((loan.loan_amount, loan.is_active), (Decimal('25000.00'), True))
+            self.customer.refresh_from_db()
+            self.assertEqual(self.customer.current_debt, Decimal('1000.00') + 25000 * number)
+        with override_settings(LOAN_WRITE_METHOD='pipeline'), self.assertRaises(ValueError):
+            self.create()
+
+    def test_failed_creation_rolls_back_loan_and_debt(self):
+        with mock.patch('loans.eligibility.record_new_loan', side_effect=RuntimeError('profile write failed')):
+            with self.assertRaises(RuntimeError):
+                self.create()
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_debt, Decimal('1000.00'))
+        self.assertEqual(Loan.objects.count(), 12)
+
+    def test_query_count_does_not_grow_with_history(self):
+        make_loans(self.customer, 200)
+        rebuild_credit_profiles()
+        # Savepoint, locked customer, profile, loan insert and debt update, profile update, release
+        with self.assertNumQueries(CREATE_LOAN_QUERIES):
+            response = self.create()
+        self.assertEqual(response.json()['loan_approved'], True)
+
+
+class FakeRedis:
+    """The subset of redis.Redis used by the API's stores, kept in memory"""
+
+    def __init__(self):
+        self.values = {}
+        self.sorted_sets = defaultdict(dict)
+        self.hashes = defaultdict(Counter)
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def zadd(self, key, mapping):
+        self.sorted_sets[key].update(mapping)
+
+    def zrem(self, key, member):
+        self.sorted_sets[key].pop(member, None)
+
+    def zremrangebyscore(self, key, low, high):
+        members = self.sorted_sets[key]
+        for member in [member for member, score in members.items() if score <= high]:
+            del members[member]
+
+    def zcard(self, key):
+        return len(self.sorted_sets[key])
+
+    def hincrby(self, key, field, amount):
+        self.hashes[key][field] += amount
+
+    def hgetall(self, key):
+        return {field.encode(): str(value).encode() for field, value in self.hashes[key].items()}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def incr(self, key):
+        value = int(self.values.get(key, 0)) + 1
+        self.values[key] = str(value).encode()
+        return value
+
+    def expire(self, key, seconds):
+        return key in self.values
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        make_loans(self.customer, 12, start_date=date.today())
+        rebuild_credit_profiles()
+        self.payload = {'customer_id': self.customer.customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        metrics._local_counts.clear()
+        self.addCleanup(metrics._local_counts.clear)
+
+    def create(self, key='retry-1', payload=None):
+        return self.client.post(
+            '/api/create-loan', payload or self.payload, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retries_replay_first_response_without_touching_loans(self):
+        first = self.create()
+        self.assertEqual(first.status_code, 201)
+        # Only the stored-response lookup runs
+        with self.assertNumQueries(1):
+            retry = self.create()
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Loan.objects.count(), 13)
+        self.assertEqual(self.create(key='retry-2').json()['loan_id'], first.json()['loan_id'] + 1)
+
+    def test_key_reused_for_another_payload_is_rejected(self):
+        self.create()
+        response = self.create(payload={**self.payload, 'loan_amount': 30000})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Loan.objects.count(), 13)
+
+    def test_request_still_in_progress_gets_conflict(self):
+        self.create()
+        # As if the first request were still running
+        IdempotencyRecord.objects.filter(key='retry-1').update(status_code=None, response=None)
+        with self.settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.create().status_code, 409)
+        self.assertEqual(Loan.objects.count(), 13)
+
+    def test_failed_request_releases_key(self):
+        with mock.patch('loans.views.create_loan_if_eligible', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                self.create()
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self.create().status_code, 201)
+
+    def test_redis_store_and_metrics(self):
+        redis_client = FakeRedis()
+        with mock.patch('loans.idempotency.get_redis', return_value=redis_client):
+            with mock.patch('loans.metrics.get_redis', return_value=redis_client):
+                first = self.create()
+                self.assertEqual(self.create().json(), first.json())
+                self.create(key='retry-2')
+                stats = self.client.get('/api/metrics').json()['idempotency']
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual((stats['hits'], stats['misses'], stats['store_size']), (1, 2, 2))
+        self.assertEqual(stats['hit_rate'], 0.3333)
+
+    def test_falls_back_to_database_when_redis_fails(self):
+        broken = mock.Mock(**{
+            f'{method}.side_effect': RedisError('connection refused')
+            for method in ('get', 'set', 'delete', 'zadd', 'zrem', 'zremrangebyscore', 'zcard')
+        })
+        with mock.patch('loans.idempotency.get_redis', return_value=broken), \
+                mock.patch('loans.idempotency.mark_unavailable') as mark_unavailable:
+            first = self.create()
+            self.assertEqual(self.create().json(), first.json())
+        mark_unavailable.assert_called()
+        self.assertTrue(IdempotencyRecord.objects.filter(key='retry-1', status_code=201).exists())
+        stats = self.client.get('/api/metrics').json()['idempotency']
+        self.assertEqual((stats['hits'], stats['misses'], stats['store_size']), (1, 1, 1))
+        self.assertGreater(stats['fallbacks'], 0)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        self.other = make_customer(2)
+        make_loans(self.customer, 3, start_date=date.today())
+        make_loans(self.other, 1)
+        rebuild_credit_profiles()
+        self.loan_id = Loan.objects.filter(customer=self.customer).values_list('loan_id', flat=True).first()
+        self.other_loan_id = Loan.objects.get(customer=self.other).loan_id
+        metrics._local_counts.clear()
+        self.addCleanup(metrics._local_counts.clear)
+        self.redis = FakeRedis()
+        for module in ('response_cache', 'metrics'):
+            patcher = mock.patch(f'loans.{module}.get_redis', return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_and_conditional_requests_skip_the_database(self):
+        first = self.client.get(f'/api/view-loan/{self.loan_id}')
+        self.assertEqual(first.json()['customer']['id'], self.customer.customer_id)
+        with self.assertNumQueries(0):
+            cached = self.client.get(f'/api/view-loan/{self.loan_id}')
+            not_modified = self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=first['ETag'])
+            # Only the ETag validates: a write in the second the entry was built would
+            # leave a Last-Modified time matching stale data
+            modified_since = self.client.get(
+                f'/api/view-loan/{self.loan_id}', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+            )
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(cached['ETag'], first['ETag'])
+        self.assertNotIn('Last-Modified', first)
+        self.assertEqual((not_modified.status_code, modified_since.status_code), (304, 200))
+        self.assertEqual(self.client.get('/api/view-loan/999999').status_code, 404)
+
+        stats = self.client.get('/api/metrics').json()['response_cache']
+        self.assertEqual((stats['hits'], stats['misses'], stats['not_modified']), (3, 2, 1))
+
+    def test_writes_expire_only_affected_responses(self):
+        loans_url = f'/api/view-loans/{self.customer.customer_id}'
+        before = self.client.get(loans_url)
+        detail = self.client.get(f'/api/view-loan/{self.loan_id}')
+        other_detail = self.client.get(f'/api/view-loan/{self.other_loan_id}')
+
+        payload = {'customer_id': self.customer.customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        with self.captureOnCommitCallbacks(execute=True):
+            loan_id = self.client.post('/api/create-loan', payload, content_type='application/json').json()['loan_id']
+        after = self.client.get(loans_url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(len(after.json()), 4)
+        self.assertIn(loan_id, [loan['loan_id'] for loan in after.json()])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304)
+
+        # Re-ingesting a customer expires the details of its loans, not other customers' loans
+        frame = pd.DataFrame([{
+            'customer_id': self.customer.customer_id, 'first_name': 'Renamed', 'last_name': 'Customer',
+            'phone_number': '9000000001', 'monthly_salary': 10000000, 'approved_limit': 100000000, 'age': 30,
+        }])
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_customers(frame, batch_size=100)
+        renamed = self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual((renamed.status_code, renamed.json()['customer']['first_name']), (200, 'Renamed'))
+        with self.assertNumQueries(0):
+            unchanged = self.client.get(f'/api/view-loan/{self.other_loan_id}', HTTP_IF_NONE_MATCH=other_detail['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_soft_deleted_loans_leave_responses_and_scores(self):
+        loans_url = f'/api/view-loans/{self.customer.customer_id}'
+        before = self.client.get(loans_url)
+        self.assertEqual(self.client.get(f'/api/view-loan/{self.loan_id}').status_code, 200)
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual(profile.num_loans, 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            soft_delete_rows(Loan, [self.loan_id])
+        self.assertEqual(self.client.get(f'/api/view-loan/{self.loan_id}').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/view-loan/{self.loan_id}/schedule').status_code, 404)
+        after = self.client.get(loans_url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotIn(self.loan_id, [loan['loan_id'] for loan in after.json()])
+        self.assertEqual(len(after.json()), 2)
+
+        # The profile is rebuilt, and the Loan table fallback agrees with it
+        profile.refresh_from_db()
+        aggregates = get_loan_aggregates(self.customer)
+        self.assertEqual((profile.num_loans, aggregates['num_loans']), (2, 2))
+        self.assertEqual(profile.total_volume, aggregates['total_volume'])
+        self.assertEqual(profile.total_volume, Loan.objects.in_source().filter(customer=self.customer).aggregate(
+            total=Sum('loan_amount'))['total'])
+
+    def test_response_built_during_a_write_is_not_served(self):
+        url = f'/api/view-loans/{self.customer.customer_id}'
+        serialize = CustomerLoansSerializer.to_representation
+
+        def commit_write_during_build(serializer, instance):
+            response_cache._bump([response_cache.loan_list_version(self.customer.customer_id)])
+            return serialize(serializer, instance)
+
+        with mock.patch.object(CustomerLoansSerializer, 'to_representation', commit_write_during_build):
+            self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_customer_write_between_build_and_store_is_not_served(self):
+        url = f'/api/view-loan/{self.loan_id}'
+        serialize = LoanDetailSerializer.to_representation
+
+        def commit_customer_write_after_build(serializer, instance):
+            data = serialize(serializer, instance)
+            Customer.objects.filter(pk=self.customer.pk).update(first_name='Renamed')
+            response_cache._bump([response_cache.customer_version(self.customer.customer_id)])
+            return data
+
+        with mock.patch.object(LoanDetailSerializer, 'to_representation', commit_customer_write_after_build):
+            self.assertNotEqual(self.client.get(url).json()['customer']['first_name'], 'Renamed')
+        self.assertEqual(self.client.get(url).json()['customer']['first_name'], 'Renamed')
+
+    def test_unreachable_redis_falls_back_to_database(self):
+        self.redis.mget = mock.Mock(side_effect=RedisError('connection refused'))
+        with mock.patch('loans.response_cache.mark_unavailable') as mark_unavailable:
+            first = self.client.get(f'/api/view-loan/{self.loan_id}')
+        mark_unavailable.assert_called()
+        self.assertNotIn('Last-Modified', first)
+
+        with mock.patch('loans.response_cache.get_redis', return_value=None):
+            with self.settings(REDIS_URL=''):
+                response = self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/api/metrics').json()['response_cache']['fallbacks'], 1)
+
+
+def content(response):
+    """The body of a response, reading async streams too"""
+    if response.streaming and response.is_async:
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read)()
+    return response.getvalue()
+
+
+class FakeAsyncRedis:
+    """A FakeRedis behind the awaitable methods of redis.asyncio"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        make_loans(self.customer, 5, start_date=date.today())
+        rebuild_credit_profiles()
+        self.loan_id = Loan.objects.filter(customer=self.customer).values_list('loan_id', flat=True).first()
+        metrics._local_counts.clear()
+        self.addCleanup(metrics._local_counts.clear)
+
+    def test_async_views_match_sync_views(self):
+        customer_id = self.customer.customer_id
+        application = {'customer_id': customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        post = lambda data: self.client.post('/api/check-eligibility', data, content_type='application/json')
+        requests = [
+            lambda: post(application),
+            lambda: post({**application, 'customer_id': 999}),
+            lambda: post({**application, 'tenure': 'long'}),
+            lambda: self.client.get(f'/api/view-loan/{self.loan_id}'),
+            lambda: self.client.get('/api/view-loan/999999'),
+            lambda: self.client.get(f'/api/view-loans/{customer_id}'),
+            lambda: self.client.get(f'/api/view-loans/{customer_id}?page_size=2'),
+            lambda: self.client.get(f'/api/view-loans/{customer_id}?stream=true'),
+            lambda: self.client.get(f'/api/view-loans/{customer_id}?stream=true', HTTP_ACCEPT_ENCODING='gzip'),
+        ]
+        sync_responses = [request() for request in requests]
+        with override_settings(ROOT_URLCONF='loans.tests'):
+            with self.assertNumQueries(1):
+                post(application)
+            async_responses = [request() for request in requests]
+        for number, (expected, response) in enumerate(zip(sync_responses, async_responses)):
+            with self.subTest(number):
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(content(response), expected.getvalue())
+
+    @override_settings(ROOT_URLCONF='loans.tests')
+    def test_async_response_cache(self):
+        redis = FakeRedis()
+        for patcher in (
+            mock.patch('loans.response_cache.get_redis', return_value=redis),
+            mock.patch('loans.response_cache.get_async_redis', return_value=FakeAsyncRedis(redis)),
+            mock.patch('loans.metrics.get_redis', return_value=redis),
+            mock.patch('loans.metrics.get_async_redis', return_value=FakeAsyncRedis(redis)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        first = self.client.get(f'/api/view-loan/{self.loan_id}')
+        with self.assertNumQueries(0):
+            cached = self.client.get(f'/api/view-loan/{self.loan_id}')
+            not_modified = self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((cached.getvalue(), not_modified.status_code), (first.getvalue(), 304))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.filter(pk=self.customer.pk).update(first_name='Renamed')
+            response_cache.invalidate(customers=[self.customer.customer_id])
+        renamed = self.client.get(f'/api/view-loan/{self.loan_id}', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(renamed.json()['customer']['first_name'], 'Renamed')
+        stats = self.client.get('/api/metrics').json()['response_cache']
+        self.assertEqual((stats['hits'], stats['misses'], stats['not_modified']), (2, 2, 1))
+
+
+class FastResponseTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        make_loans(self.customer, 5, start_date=date.today())
+        rebuild_credit_profiles()
+        self.loan_id = Loan.objects.filter(customer=self.customer).values_list('loan_id', flat=True).first()
+
+    def test_flat_serializers_match_drf_serializers(self):
+        customer_id = self.customer.customer_id
+        application = {'customer_id': customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        post = lambda path, data: self.client.post(path, data, content_type='application/json')
+        requests = [
+            lambda: post('/api/check-eligibility', application),
+            lambda: post('/api/check-eligibility', {**application, 'interest_rate': '8.5', 'loan_amount': 1}),
+            lambda: post('/api/check-eligibility', {**application, 'customer_id': 999}),
+            lambda: post('/api/check-eligibility/batch', [application, {**application, 'customer_id': 999}]),
+            lambda: self.client.get(f'/api/view-loan/{self.loan_id}'),
+            lambda: self.client.get('/api/view-loan/999999'),
+            lambda: self.client.get(f'/api/view-loans/{customer_id}'),
+            lambda: self.client.get('/api/view-loans/999'),
+        ]
+        expected = [request() for request in requests]
+        with override_settings(FAST_RESPONSES=True):
+            fast = [request() for request in requests]
+            with override_settings(ROOT_URLCONF='loans.tests'):
+                fast_async = [request() for request in requests]
+        for number, response in enumerate(expected):
+            with self.subTest(number):
+                self.assertEqual(fast[number].status_code, response.status_code)
+                self.assertEqual(fast[number].getvalue(), response.getvalue())
+                self.assertEqual(fast_async[number].status_code, response.status_code)
+                self.assertEqual(content(fast_async[number]), response.getvalue())
+                self.assertEqual(ORJSONRenderer().render(fast[number].data), response.getvalue())
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        payloads = [
+            {'amount': Decimal('1250.50'), 'start': date(2024, 2, 29), 'at': datetime(2024, 2, 29, 13, 5, 7, 250)},
+            {'name': 'Zoë \u2028 \u2029 "quoted" \\', 1: [None, True, 1.5, -7]},
+            [{'nested': {'rate': Decimal('8.50')}}, []],
+            {'big': 2 ** 70},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertEqual(ORJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        indented = ORJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render({'a': 1}, 'application/json; indent=2'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        for patcher in (mock.patch.dict(db_router._health, clear=True), mock.patch.dict(db_router._local_pins, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.lag = mock.patch('loans.db_router.replica_lag', return_value=0).start()
+        self.addCleanup(mock.patch.stopall)
+        self.reads = []
+
+        @db_router.replica_reads(lambda request, customer_id, **options: [db_router.customer_pin(customer_id)])
+        def view(request, customer_id, fail_on_replica=False):
+            alias = db_router.ReplicaRouter().db_for_read(Loan)
+            self.reads.append(alias)
+            if fail_on_replica and alias == 'replica':
+                raise OperationalError('connection refused')
+        self.view = view
+
+    def test_reads_go_to_the_replica_unless_recently_written(self):
+        router = db_router.ReplicaRouter()
+        self.view(None, 1)
+        response_cache.invalidate(customers=[1])
+        self.view(None, 1)
+        self.view(None, 2)
+        self.assertEqual(self.reads, ['replica', 'default', 'replica'])
+        self.assertEqual((router.db_for_read(Loan), router.db_for_write(Loan)), ('default', 'default'))
+        self.assertFalse(router.allow_migrate('replica', 'loans'))
+
+    def test_async_views_read_from_the_replica(self):
+        @db_router.replica_reads(lambda request, customer_id: [db_router.customer_pin(customer_id)])
+        async def view(request, customer_id):
+            self.reads.append(db_router.ReplicaRouter().db_for_read(Loan))
+
+        async_to_sync(view)(None, 1)
+        response_cache.invalidate(customers=[1])
+        async_to_sync(view)(None, 1)
+        self.assertEqual(self.reads, ['replica', 'default'])
+
+    def test_unhealthy_replicas_fall_back_to_the_primary(self):
+        self.lag.return_value = 60
+        with self.assertLogs('loans.db_router', 'WARNING'):
+            self.view(None, 1)
+        self.lag.return_value = 0
+        self.view(None, 1)
+        with override_settings(REPLICA_HEALTH_CHECK_SECONDS=0):
+            self.view(None, 1)
+            with self.assertLogs('loans.db_router', 'WARNING'):
+                self.view(None, 1, fail_on_replica=True)
+        self.assertEqual(self.reads, ['default', 'default', 'replica', 'replica', 'default'])
+        self.assertEqual(db_router._health['replica'][0], False)
+
+
+SEPARATE_REPLICA = 'replica' in settings.DATABASES and not settings.DATABASES['replica'].get('TEST', {}).get('MIRROR')
+
+
+@skipUnless(SEPARATE_REPLICA, 'needs a replica database that does not mirror the primary (see test_settings)')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaDatabaseTests(TestCase):
+    # The test runner sets up every alias named here, even for a skipped class
+    databases = {'default', 'replica'} if SEPARATE_REPLICA else {'default'}
+
+    def setUp(self):
+        for patcher in (mock.patch.dict(db_router._health, clear=True), mock.patch.dict(db_router._local_pins, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # The same customer on both databases with different loans, to tell which one answered
+        self.customer = make_customer()
+        make_loans(self.customer, 2)
+        self.customer.save(using='replica')
+        replica_loan = Loan.objects.filter(customer=self.customer).first()
+        replica_loan.loan_id = 900
+        replica_loan.save(using='replica')
+
+    def loan_ids(self, suffix=''):
+        body = content(self.client.get(f'/api/view-loans/{self.customer.customer_id}{suffix}')).decode()
+        if suffix.endswith('format=csv'):
+            return sorted({int(line.split(',')[0]) for line in body.splitlines()[1:]})
+        return sorted(loan['loan_id'] for loan in json.loads(body))
+
+    def test_unpinned_reads_reach_the_replica_and_pinned_reads_the_primary(self):
+        # Streamed responses read their rows after the view has returned
+        suffixes = ('', '?stream=true', '/schedules?format=csv')
+        primary = sorted(Loan.objects.using('default').values_list('loan_id', flat=True))
+        for urlconf in (settings.ROOT_URLCONF, 'loans.tests'):
+            with override_settings(ROOT_URLCONF=urlconf):
+                for suffix in suffixes:
+                    with self.subTest(urlconf=urlconf, suffix=suffix):
+                        self.assertEqual(self.loan_ids(suffix), [900])
+
+        response_cache.invalidate(customers=[self.customer.customer_id])
+        for urlconf in (settings.ROOT_URLCONF, 'loans.tests'):
+            with override_settings(ROOT_URLCONF=urlconf):
+                for suffix in suffixes:
+                    with self.subTest(urlconf=urlconf, suffix=suffix, pinned=True):
+                        self.assertEqual(self.loan_ids(suffix), primary)
+
+
+class ConnectionPoolTests(TestCase):
+    def test_pool_metrics(self):
+        self.assertEqual(pool_metrics()['pooled'], False)
+        self.assertIn('database', self.client.get('/api/metrics').json())
+
+        pool = mock.Mock(min_size=2, max_size=10)
+        pool.get_stats.return_value = {
+            'pool_size': 4, 'pool_available': 1, 'requests_waiting': 0, 'requests_num': 8, 'requests_wait_ms': 20,
+        }
+        with mock.patch.object(type(connections['default']), 'pool', pool, create=True):
+            stats = pool_metrics()
+        self.assertEqual((stats['in_use'], stats['utilization'], stats['avg_wait_ms']), (3, 0.3, 2.5))
+
+
+class CustomerLoansPaginationTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        make_loans(self.customer, 25)
+        make_loans(make_customer(2), 3)
+        self.url = f'/api/view-loans/{self.customer.customer_id}'
+
+    def test_pages_follow_loan_id_cursor(self):
+        full = self.client.get(self.url).json()
+        pages, url = [], f'{self.url}?page_size=10'
+        while url:
+            with self.assertNumQueries(2):
+                page = self.client.get(url).json()
+            pages.append(page['results'])
+            url = page['next']
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([loan for page in pages for loan in page], sorted(full, key=lambda loan: loan['loan_id']))
+        with self.settings(LOANS_MAX_PAGE_SIZE=20):
+            self.assertEqual(len(self.client.get(f'{self.url}?page_size=100').json()['results']), 20)
+        self.assertEqual(self.client.get('/api/view-loans/999?page_size=10').status_code, 404)
+
+    def test_stream_matches_rendered_list(self):
+        rendered = self.client.get(self.url).content
+        with self.settings(LOANS_STREAM_CHUNK_SIZE=4):
+            streamed = self.client.get(f'{self.url}?stream=true')
+            self.assertEqual(b''.join(streamed.streaming_content), rendered)
+            compressed = self.client.get(f'{self.url}?stream=true', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(compressed['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(b''.join(compressed.streaming_content)), rendered)
+        empty = make_customer(3)
+        self.assertEqual(b''.join(self.client.get(f'/api/view-loans/{empty.customer_id}?stream=1').streaming_content), b'[]')
+
+
+class QueryCountTests(TestCase):
+    """Exact queries per endpoint and admin page, which must not grow with the number of rows"""
+
+    def setUp(self):
+        self.customer = make_customer(approved_limit=Decimal('100000000.00'), monthly_salary=Decimal('10000000.00'))
+        for customer_id in range(2, 6):
+            make_customer(customer_id)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def grow(self, loans):
+        """Bring the customer's history to `loans` loans, with a profile and a stored idempotency key"""
+        make_loans(self.customer, loans - Loan.objects.filter(customer=self.customer).count())
+        rebuild_credit_profiles()
+        loan_id = Loan.objects.filter(customer=self.customer).values_list('loan_id', flat=True).first()
+        IngestionCheckpoint.objects.get_or_create(kind='loans', source=f'/data/loans-{loans}.csv', defaults={'fingerprint': 'f'})
+        return loan_id
+
+    def assertQueries(self, cases):
+        # Warm per-process caches such as ContentType lookups first
+        for _, _, request in cases:
+            request(self.grow(1))
+        for loans in (5, 40):
+            loan_id = self.grow(loans)
+            for name, expected, request in cases:
+                with self.subTest(name, loans=loans), self.assertNumQueries(expected):
+                    response = request(loan_id)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertLess(response.status_code, 400, name)
+
+    def test_api_endpoints(self):
+        customer_id = self.customer.customer_id
+        application = {'customer_id': customer_id, 'loan_amount': 25000, 'interest_rate': 14, 'tenure': 24}
+        post = lambda path, data: self.client.post(path, data, content_type='application/json')
+        self.assertQueries([
+            ('register', 6, lambda loan_id: post('/api/register', {
+                'first_name': 'New', 'last_name': 'Customer', 'age': 30, 'monthly_income': 50000,
+                'phone_number': f'8{Customer.objects.count():09d}',
+            })),
+            ('check-eligibility', 1, lambda loan_id: post('/api/check-eligibility', application)),
+            ('check-eligibility-batch', 1, lambda loan_id: post('/api/check-eligibility/batch', [application] * 20)),
+            ('create-loan', CREATE_LOAN_QUERIES, lambda loan_id: post('/api/create-loan', application)),
+            ('view-loan', 1, lambda loan_id: self.client.get(f'/api/view-loan/{loan_id}')),
+            ('view-loans', 2, lambda loan_id: self.client.get(f'/api/view-loans/{customer_id}')),
+            ('view-loans page', 2, lambda loan_id: self.client.get(f'/api/view-loans/{customer_id}?page_size=10')),
+            ('view-loans stream', 2, lambda loan_id: self.client.get(f'/api/view-loans/{customer_id}?stream=true')),
+            ('metrics', 1, lambda loan_id: self.client.get('/api/metrics')),
+        ])
+
+    def test_admin_pages(self):
+        self.client.force_login(self.admin)
+        page = lambda path: lambda loan_id: self.client.get(f'/admin/loans/{path}')
+        self.assertQueries([
+            ('customer changelist', 4, page('customer/')),
+            ('customer search', 4, page('customer/?q=Test')),
+            ('customer change', 3, page(f'customer/{self.customer.customer_id}/change/')),
+            ('loan changelist', 4, page('loan/')),
+            ('loan search', 4, page('loan/?q=Test')),
+            ('loan change', 4, lambda loan_id: self.client.get(f'/admin/loans/loan/{loan_id}/change/')),
+            ('profile changelist', 4, page('customercreditprofile/')),
+            ('checkpoint changelist', 6, page('ingestioncheckpoint/')),
+            ('idempotency changelist', 4, page('idempotencyrecord/')),
+        ])
+
+        loan_id = Loan.objects.filter(customer=self.customer).aggregate(Max('loan_id'))['loan_id__max']
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(f'/admin/loans/loan/?q={loan_id}')
+        self.assertEqual([loan.loan_id for loan in response.context['cl'].result_list], [loan_id])
+        for query in captured:
+            self.assertNotRegex(query['sql'], r'(UPPER|CAST)\("loans_loan"\."loan_id"|"loans_loan"\."loan_id" LIKE')
+
+        # Profiles are derived data: the eligibility limits' inputs cannot be edited by hand
+        response = self.client.get(f'/admin/loans/customercreditprofile/{self.customer.customer_id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse({'active_volume', 'active_monthly_installment'} & set(response.context['adminform'].form.fields))
+
+
+class ActiveLoanTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer(monthly_salary=Decimal('10000.00'), approved_limit=Decimal('200000.00'))
+        self.application = {'customer_id': self.customer.customer_id, 'loan_amount': 50000, 'interest_rate': 16, 'tenure': 12}
+
+    def add_loan(self, end_date, emis_paid_on_time=0, loan_amount=Decimal('150000.00'), emi=Decimal('6000.00')):
+        start = end_date - timedelta(days=365)
+        return Loan.objects.create(
+            customer=self.customer, loan_amount=loan_amount, tenure=12, interest_rate=Decimal('10.00'),
+            monthly_installment=emi, emis_paid_on_time=emis_paid_on_time,
+            start_date=start, end_date=end_date,
+        )
+
+    def check(self):
+        return self.client.post('/api/check-eligibility', self.application, content_type='application/json').json()
+
+    def test_closed_loans_do_not_count_towards_debt_or_emis(self):
+        today = date.today()
+        ended = self.add_loan(today - timedelta(days=1))
+        repaid = self.add_loan(today + timedelta(days=100), emis_paid_on_time=12)
+        self.assertEqual((ended.is_active, repaid.is_active), (False, False))
+        rebuild_credit_profiles()
+        self.assertTrue(self.check()['approval'])
+
+        self.add_loan(today)
+        rebuild_credit_profiles()
+        # One active loan puts the customer over both the debt limit and the EMI cap
+        self.assertFalse(self.check()['approval'])
+        aggregates = get_loan_aggregates(self.customer)
+        self.assertEqual((aggregates['active_volume'], aggregates['num_loans']), (Decimal('150000.00'), 3))
+
+    def test_sweep_closes_loans_as_they_end(self):
+        today = date.today()
+        self.add_loan(today)
+        self.add_loan(today + timedelta(days=30), loan_amount=Decimal('1000.00'), emi=Decimal('100.00'))
+        rebuild_credit_profiles()
+        self.assertFalse(self.check()['approval'])
+
+        self.assertEqual(close_finished_loans(today), 0)
+        self.assertEqual(close_finished_loans(today + timedelta(days=1)), 1)
+        profile = CustomerCreditProfile.objects.get(customer=self.customer)
+        self.assertEqual((profile.active_volume, profile.num_loans), (Decimal('1000.00'), 2))
+        self.assertTrue(self.check()['approval'])
+        with mock.patch('loans.models.date') as fake_date:
+            fake_date.today.return_value = today + timedelta(days=31)
+            self.assertEqual(sweep_finished_loans(), 'Closed 1 finished loans')
+        self.assertFalse(Loan.objects.active().exists())
+
+    def test_ingested_loans_are_active_until_they_end(self):
+        today = date.today()
+        rows = pd.DataFrame([{
+            'Customer ID': self.customer.customer_id, 'Loan ID': loan_id, 'Loan Amount': 1000, 'Tenure': 12,
+            'Interest Rate': 10, 'Monthly payment': 90, 'EMIs paid on Time': paid,
+            'Date of Approval': today - timedelta(days=200), 'End Date': end,
+        } for loan_id, paid, end in ((1, 0, today), (2, 0, today - timedelta(days=1)), (3, 12, today))])
+        ingest_loans(rows, batch_size=10, method='bulk', delta=True)
+        self.assertEqual(dict(Loan.objects.values_list('loan_id', 'is_active')), {1: True, 2: False, 3: False})
+        self.assertEqual(CustomerCreditProfile.objects.get(customer=self.customer).active_volume, Decimal('1000.00'))
+
+
+class LoanPartitionTests(TestCase):
+    def test_partition_bounds(self):
+        self.assertEqual(
+            partition_bounds('loans_loan', date(2025, 6, 15), 'year'),
+            ('loans_loan_p2025', date(2025, 1, 1), date(2026, 1, 1)),
+        )
+        self.assertEqual(
+            partition_bounds('loans_loan', date(2025, 12, 31), 'month'),
+            ('loans_loan_p2025_12', date(2025, 12, 1), date(2026, 1, 1)),
+        )
+        with self.assertRaises(ValueError):
+            partition_bounds('loans_loan', date(2025, 1, 1), 'week')
+
+    def test_uncovered_ranges(self):
+        year = (date(2025, 1, 1), date(2026, 1, 1))
+        months = [(date(2025, 1, 1), date(2025, 3, 1)), (date(2025, 6, 1), date(2025, 7, 1))]
+        self.assertEqual(partitions._uncovered(*year, []), [year])
+        self.assertEqual(partitions._uncovered(*year, [year]), [])
+        self.assertEqual(partitions._uncovered(date(2025, 4, 1), date(2025, 5, 1), [year]), [])
+        self.assertEqual(partitions._uncovered(*year, months), [
+            (date(2025, 3, 1), date(2025, 6, 1)), (date(2025, 7, 1), date(2026, 1, 1)),
+        ])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Loan partitions exist on PostgreSQL only')
+    def test_changing_the_interval_only_partitions_uncovered_ranges(self):
+        year = date.today().year + 20
+        today = date(year, 1, 1)
+        self.assertEqual(ensure_partitions(Loan, interval='year', ahead=0, today=today), [f'loans_loan_p{year}'])
+        # The months of the yearly partition are skipped; the next year's get their own
+        self.assertEqual(
+            ensure_partitions(Loan, interval='month', ahead=13, today=today),
+            [f'loans_loan_p{year + 1}_01', f'loans_loan_p{year + 1}_02'],
+        )
+        # Back to yearly, the rest of the next year gets one partition
+        self.assertEqual(
+            ensure_partitions(Loan, interval='year', ahead=1, today=today), [f'loans_loan_p{year + 1}_03_01'],
+        )
+        self.assertEqual(partitions.partition_ranges('loans_loan')[f'loans_loan_p{year + 1}_03_01'],
+                         (date(year + 1, 3, 1), date(year + 2, 1, 1)))
+
+    @skipIf(connection.vendor == 'postgresql', 'Migration 0008 partitions the loan table on PostgreSQL')
+    def test_unpartitioned_tables_are_left_alone(self):
+        self.assertEqual(ensure_partitions(Loan), [])
+        self.assertEqual(create_loan_partitions(), 'Created 0 loan partitions')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Loans are only partitioned on PostgreSQL')
+    def test_partitions_are_created_and_rows_moved_out_of_the_default(self):
+        customer = make_customer()
+        start = date(date.today().year + 10, 3, 1)
+        name, _, _ = partition_bounds('loans_loan', start, 'year')
+
+        def ingest(loan_amount, method):
+            return ingest_loans(pd.DataFrame([{
+                'Customer ID': customer.customer_id, 'Loan ID': 500, 'Loan Amount': loan_amount, 'Tenure': 12,
+                'Interest Rate': 10, 'Monthly payment': 90, 'EMIs paid on Time': 0,
+                'Date of Approval': start, 'End Date': start + timedelta(days=365),
+            }]), batch_size=10, method=method)
+
+        def partition_of(loan_id):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT tableoid::regclass::text FROM loans_loan WHERE loan_id = %s', [loan_id])
+                return cursor.fetchone()[0]
+
+        self.assertEqual(partition_key(Loan), ['start_date'])
+        ingest(1000, 'bulk')
+        self.assertEqual(partition_of(500), 'loans_loan_default')
+
+        # Migration 0008 made yearly partitions up to the current year
+        created = ensure_partitions(Loan, interval='year')
+        self.assertIn(name, created)
+        self.assertEqual(len(created), settings.LOAN_PARTITIONS_AHEAD + 1)
+        self.assertEqual(partition_of(500), name)
+        self.assertEqual(ensure_partitions(Loan, interval='year'), [])
+
+        # Re-ingested rows conflict on (loan_id, start_date) and are updated in place
+        for method, loan_amount in (('bulk', 2000), ('copy', 3000)):
+            ingest(loan_amount, method)
+            self.assertEqual(Loan.objects.get(loan_id=500).loan_amount, loan_amount)
+        self.assertEqual(Loan.objects.filter(loan_id=500).count(), 1)
+        self.assertEqual(partition_of(500), name)
+
+    def test_loan_ids_are_64_bit(self):
+        customer = make_customer()
+        rows = pd.DataFrame([{
+            'Customer ID': customer.customer_id, 'Loan ID': 2 ** 40, 'Loan Amount': 1000, 'Tenure': 12,
+            'Interest Rate': 10, 'Monthly payment': 90, 'EMIs paid on Time': 0,
+            'Date of Approval': date(2025, 1, 1), 'End Date': date(2026, 1, 1),
+        }])
+        ingest_loans(rows, batch_size=10, method='bulk')
+        loan = Loan.objects.create(
+            customer=customer, loan_amount=Decimal('1000.00'), tenure=12, interest_rate=Decimal('10.00'),
+            monthly_installment=Decimal('90.00'), start_date=date(2025, 1, 1), end_date=date(2026, 1, 1),
+        )
+        self.assertEqual(loan.loan_id, 2 ** 40 + 1)
+        self.assertEqual(self.client.get(f'/api/view-loan/{2 ** 40}').json()['loan_id'], 2 ** 40)
+
+
+class LoanArchiveTests(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+        override = override_settings(LOAN_ARCHIVE_DIR=self.archive_dir.name, LOAN_ARCHIVE_AFTER_DAYS=365)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.customer = make_customer()
+        make_loans(self.customer, 20)
+        rebuild_credit_profiles()
+
+    def test_archived_loans_still_count_towards_the_score(self):
+        before = get_loan_aggregates(self.customer)
+        score = calculate_credit_score(self.customer)
+        archivable = Loan.objects.filter(end_date__lt=date.today() - timedelta(days=365)).count()
+        out = StringIO()
+        call_command('archive_loans', '--dry-run', stdout=out)
+        self.assertIn(f'{archivable} loans would be archived', out.getvalue())
+
+        self.assertEqual(archive_loans(batch_size=4), archivable)
+        self.assertEqual(Loan.objects.count(), 20 - archivable)
+        self.assertEqual(ArchivedLoanSummary.objects.get(customer=self.customer).num_loans, archivable)
+        self.assertEqual(len(os.listdir(os.path.join(self.archive_dir.name, 'customers-0-9999'))), -(-archivable // 4))
+        self.assertEqual(get_loan_aggregates(self.customer), before)
+        self.assertEqual(calculate_credit_score(self.customer), score)
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+        self.assertEqual(archive_loans(), 0)
+
+    def test_view_loans_reads_archived_loans_on_request(self):
+        url = f'/api/view-loans/{self.customer.customer_id}'
+        everything = sorted(self.client.get(url).json(), key=lambda loan: loan['loan_id'])
+        with self.captureOnCommitCallbacks(execute=True):
+            archived = archive_loans()
+
+        self.assertEqual(len(self.client.get(url).json()), 20 - archived)
+        with_archive = self.client.get(url, {'archived': 'true'}).json()
+        self.assertEqual(sorted(with_archive, key=lambda loan: loan['loan_id']), everything)
+        self.assertEqual(len(read_archived_loans(self.customer.customer_id)), archived)
+
+    def test_reingested_archived_loans_are_not_written_again(self):
+        loans = list(Loan.objects.all())
+        archived = archive_loans()
+        rows = pd.DataFrame([{
+            'Customer ID': loan.customer_id, 'Loan ID': loan.loan_id, 'Loan Amount': loan.loan_amount,
+            'Tenure': loan.tenure, 'Interest Rate': loan.interest_rate, 'Monthly payment': loan.monthly_installment,
+            'EMIs paid on Time': loan.emis_paid_on_time, 'Date of Approval': loan.start_date, 'End Date': loan.end_date,
+        } for loan in loans])
+        counts = ingest_loans(rows, batch_size=10, method='bulk')
+        self.assertEqual((counts['unchanged'], counts['updated']), (archived, 20 - archived))
+        self.assertEqual(Loan.objects.count(), 20 - archived)
+        self.assertEqual(CustomerCreditProfile.objects.get(customer=self.customer).num_loans, 20)
+
+
+class BatchEligibilityTests(TestCase):
+    def setUp(self):
+        # Customers spanning every score band, with and without credit profiles
+        self.customers = []
+        for customer_id, count in enumerate((0, 1, 2, 4, 8, 15, 30), start=1):
+            customer = make_customer(customer_id, approved_limit=Decimal('5000000.00'), monthly_salary=Decimal('90000.00'))
+            make_loans(customer, count)
+            self.customers.append(customer)
+        rebuild_credit_profiles([1, 2, 3, 4])
+
+    def applications(self):
+        applications = []
+        for i in range(120):
+            applications.append({
+                'customer_id': self.customers[i % len(self.customers)].customer_id,
+                'loan_amount': str(Decimal(5000 + i * 7919 % 400000) + Decimal('0.45')),
+                'interest_rate': ['0', '8.5', '11.99', '13.25', '15.5', '18'][i % 6],
+                'tenure': [6, 12, 24, 36, 60][i % 5],
+            })
+        applications.append({'customer_id': 999, 'loan_amount': '1000', 'interest_rate': '10', 'tenure': 12})
+        return applications
+
+    def test_matches_single_endpoint_in_input_order(self):
+        applications = self.applications()
+        response = self.client.post('/api/check-eligibility/batch', applications, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), len(applications))
+        for application, result in zip(applications, results):
+            single = self.client.post('/api/check-eligibility', application, content_type='application/json')
+            if single.status_code == 404:
+                self.assertEqual(result, {'customer_id': application['customer_id'], 'error': 'Customer not found'})
+            else:
+                self.assertEqual(result, single.json())
+
+    def test_query_count_is_constant(self):
+        applications = self.applications()
+        # Customer + profile lookup, plus one aggregate for customers without a profile
+        with self.assertNumQueries(2):
+            self.client.post('/api/check-eligibility/batch', applications, content_type='application/json')
+        with self.assertNumQueries(2):
+            self.client.post('/api/check-eligibility/batch', applications * 5, content_type='application/json')
+
+    def test_invalid_application_is_rejected(self):
+        response = self.client.post(
+            '/api/check-eligibility/batch', [{'customer_id': 1, 'loan_amount': 'abc'}], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class PricingTests(TestCase):
+    def exact_installment(self, loan_amount, interest_rate, tenure):
+        with localcontext(prec=80):
+            rate = Decimal(interest_rate) / 1200
+            if not rate:
+                installment = Decimal(loan_amount) / tenure
+            else:
+                installment = Decimal(loan_amount) * rate / (1 - (1 + rate) ** -tenure)
+        return installment.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    def quotes(self):
+        quotes = [
+            (str(Decimal(1000 + i * 7919 % 900000) + Decimal(i % 100) / 100), str(rate), tenure)
+            for i, (rate, tenure) in enumerate(
+                (rate, tenure) for rate in ('0', '0.01', '8.5', '11.99', '12', '16.00', '24.75', '99.99')
+                for tenure in (1, 6, 12, 37, 60, 360)
+            )
+        ]
+        # Exactly half a cent, which binary floating point lands on either side of
+        return quotes + [('0.04', '0', 8), ('1000.04', '0', 8), ('1000000000.04', '0', 8), ('9999999999999.99', '18', 12)]
+
+    def test_monthly_installment_is_exact(self):
+        self.assertEqual(pricing.monthly_installment(Decimal('100000'), Decimal('12'), 12), Decimal('8884.88'))
+        self.assertEqual(pricing.monthly_installment(1000, 0, 7), Decimal('142.86'))
+        self.assertEqual(pricing.monthly_installment(Decimal('1000.04'), Decimal('0'), 8), Decimal('125.01'))
+        for loan_amount, interest_rate, tenure in self.quotes():
+            with self.subTest(loan_amount=loan_amount, interest_rate=interest_rate, tenure=tenure):
+                installment = pricing.monthly_installment(Decimal(loan_amount), Decimal(interest_rate), tenure)
+                self.assertEqual(installment, self.exact_installment(loan_amount, interest_rate, tenure))
+                self.assertEqual(installment.as_tuple().exponent, -2)
+
+    def test_vectorized_installments_match_scalar(self):
+        quotes = self.quotes()
+        cents = pricing.monthly_installments(
+            [float(amount) for amount, _, _ in quotes], [float(rate) for _, rate, _ in quotes],
+            [tenure for _, _, tenure in quotes],
+        )
+        self.assertEqual(
+            [pricing.from_cents(value) for value in cents],
+            [pricing.monthly_installment(Decimal(amount), Decimal(rate), tenure) for amount, rate, tenure in quotes],
+        )
+        self.assertEqual(len(pricing.monthly_installments([], [], [])), 0)
+
+    def test_annuity_factors_are_memoized(self):
+        pricing.annuity_factor.cache_clear()
+        for _ in range(3):
+            pricing.monthly_installment(Decimal('5000'), Decimal('14.50'), 24)
+        pricing.monthly_installment(Decimal('5000'), 14.5, 24)
+        info = pricing.annuity_factor.cache_info()
+        self.assertEqual((info.misses, info.hits, info.maxsize), (1, 3, pricing.ANNUITY_FACTOR_CACHE_SIZE))
+
+
+class AmortizationScheduleTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.loans = make_loans(self.customer, 4)
+        schedules.encoded_schedule.cache_clear()
+
+    def test_loan_schedule(self):
+        loan = Loan.objects.create(
+            customer=self.customer, loan_amount=Decimal('100000.00'), tenure=12, interest_rate=Decimal('12.00'),
+            monthly_installment=Decimal('8884.88'), emis_paid_on_time=0, start_date=date.today(),
+            end_date=date.today() + timedelta(days=365),
+        )
+        response = self.client.get(f'/api/view-loan/{loan.loan_id}/schedule')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.getvalue())
+        self.assertEqual(
+            {key: data[key] for key in ('loan_id', 'loan_amount', 'interest_rate', 'tenure', 'monthly_installment')},
+            {'loan_id': loan.loan_id, 'loan_amount': '100000.00', 'interest_rate': '12.00', 'tenure': 12,
+             'monthly_installment': '8884.88'},
+        )
+        schedule = data['schedule']
+        self.assertEqual(schedule[0], {
+            'month': 1, 'installment': '8884.88', 'principal': '7884.88', 'interest': '1000.00', 'balance': '92115.12',
+        })
+        self.assertEqual(schedule[-1], {
+            'month': 12, 'installment': '8884.87', 'principal': '8796.90', 'interest': '87.97', 'balance': '0.00',
+        })
+        self.assertEqual(sum(Decimal(month['principal']) for month in schedule), Decimal('100000.00'))
+        for opening, month in zip([Decimal('100000.00')] + [Decimal(month['balance']) for month in schedule], schedule):
+            self.assertEqual(Decimal(month['principal']), opening - Decimal(month['balance']))
+            self.assertEqual(Decimal(month['installment']), Decimal(month['principal']) + Decimal(month['interest']))
+
+        csv_response = self.client.get(f'/api/view-loan/{loan.loan_id}/schedule?format=csv')
+        self.assertEqual(csv_response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = csv_response.getvalue().decode().splitlines()
+        self.assertEqual(lines[0], 'loan_id,month,installment,principal,interest,balance')
+        self.assertEqual(lines[1], f'{loan.loan_id},1,8884.88,7884.88,1000.00,92115.12')
+        self.assertEqual(len(lines), 13)
+
+        self.assertEqual(self.client.get('/api/view-loan/999999/schedule').status_code, 404)
+        missing = self.client.get('/api/view-loan/999999/schedule', HTTP_ACCEPT='text/csv')
+        self.assertEqual(missing.content.decode().splitlines(), ['detail', 'No Loan matches the given query.'])
+
+    def test_edge_terms(self):
+        installment, schedule = schedules.amortization_schedule(Decimal('0.04'), Decimal('0'), 8)
+        self.assertEqual(installment, Decimal('0.01'))
+        self.assertEqual(schedule['principal'].sum(), 4)
+        self.assertEqual(schedule['installment'].tolist(), [1, 1, 1, 1, 0, 0, 0, 0])
+        self.assertEqual(schedule['balance'].tolist(), [3, 2, 1, 0, 0, 0, 0, 0])
+        for loan_amount, interest_rate, tenure in (('1000.00', '0.01', 360), ('9999999.99', '99.99', 1), ('5.00', '3', 600)):
+            with self.subTest(loan_amount=loan_amount, interest_rate=interest_rate, tenure=tenure):
+                _, schedule = schedules.amortization_schedule(Decimal(loan_amount), Decimal(interest_rate), tenure)
+                self.assertEqual(schedule['principal'].sum(), int(Decimal(loan_amount) * 100))
+                self.assertTrue((schedule['interest'] >= 0).all())
+                self.assertEqual(schedule['balance'][-1], 0)
+
+    def test_customer_schedules_are_streamed_and_cached(self):
+        Loan.objects.bulk_create([
+            Loan(
+                customer=self.customer, loan_amount=self.loans[0].loan_amount, tenure=self.loans[0].tenure,
+                interest_rate=self.loans[0].interest_rate, monthly_installment=Decimal('1.00'), emis_paid_on_time=0,
+                start_date=date.today(), end_date=date.today() + timedelta(days=365),
+            ),
+        ])
+        loans = list(Loan.objects.filter(customer=self.customer).order_by('loan_id'))
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/view-loans/{self.customer.customer_id}/schedules')
+            data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([schedule['loan_id'] for schedule in data], [loan.loan_id for loan in loans])
+        self.assertEqual([len(schedule['schedule']) for schedule in data], [loan.tenure for loan in loans])
+        self.assertEqual(data[-1]['schedule'], data[0]['schedule'])
+        single = self.client.get(f'/api/view-loan/{loans[1].loan_id}/schedule')
+        self.assertEqual(json.loads(single.getvalue()), data[1])
+        self.assertEqual(self.client.get('/api/metrics').json()['schedule_cache']['hits'], 2)
+
+        response = self.client.get(f'/api/view-loans/{self.customer.customer_id}/schedules?format=csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + sum(loan.tenure for loan in loans))
+        self.assertEqual(Counter(line.split(',')[0] for line in lines[1:]), {
+            str(loan.loan_id): loan.tenure for loan in loans
+        })
+        self.assertEqual(self.client.get('/api/view-loans/999/schedules').status_code, 404)
+
+
+class BulkIngestionTests(TestCase):
+    customer_file = os.path.join(settings.BASE_DIR, 'customer_data.xlsx')
+    loan_file = os.path.join(settings.BASE_DIR, 'loan_data.xlsx')
+
+    def test_ingests_source_spreadsheets(self):
+        self.assertTrue(ingest_customer_data(self.customer_file).startswith('Successfully ingested 300 customer'))
+        result = ingest_loan_data(self.loan_file)
+        self.assertTrue(result.startswith('Successfully'), result)
+        self.assertIn('rows/sec', result)
+
+        source = pd.read_excel(self.loan_file).drop_duplicates('Loan ID', keep='last').set_index('Loan ID')
+        self.assertEqual(Loan.objects.count(), len(source))
+        loan = Loan.objects.get(loan_id=source.index[0])
+        row = source.iloc[0]
+        self.assertEqual(loan.customer_id, row['Customer ID'])
+        self.assertEqual(loan.emis_paid_on_time, row['EMIs paid on Time'])
+        self.assertEqual(loan.start_date, row['Date of Approval'].date())
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+
+    def test_reingestion_updates_rows_in_place(self):
+        ingest_customer_data(self.customer_file)
+        Customer.objects.filter(customer_id=1).update(first_name='Changed')
+        ingest_customer_data(self.customer_file)
+        self.assertEqual(Customer.objects.count(), 300)
+        self.assertNotEqual(Customer.objects.get(customer_id=1).first_name, 'Changed')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        make_customer(1)
+        rows = pd.DataFrame([{
+            'Customer ID': 1, 'Loan ID': loan_id, 'Loan Amount': 1000, 'Tenure': 12, 'Interest Rate': 10,
+            'Monthly payment': 90, 'EMIs paid on Time': 0, 'Date of Approval': date.today(),
+            'End Date': date.today() + timedelta(days=365),
+        } for loan_id in range(1, 81)])
+        # Customer ids, savepoint, stored fingerprints, one upsert, owner lock, profile aggregate + upsert, release
+        with self.assertNumQueries(8):
+            stats = ingest_loans(rows, batch_size=500, method='bulk')
+        self.assertEqual(stats['rows'], 80)
+        self.assertEqual(Loan.objects.filter(emis_paid_on_time=0).count(), 80)
+
+    def test_unknown_customers_are_skipped(self):
+        make_customer(1)
+        rows = pd.DataFrame([{
+            'Customer ID': customer_id, 'Loan ID': customer_id, 'Loan Amount': 1000, 'Tenure': 12,
+            'Interest Rate': 10, 'Monthly payment': 90, 'EMIs paid on Time': 3,
+            'Date of Approval': date.today(), 'End Date': date.today(),
+        } for customer_id in (1, 2)])
+        stats = ingest_loans(rows, batch_size=10, method='bulk')
+        self.assertEqual((stats['rows'], stats['skipped']), (1, 1))
+        self.assertEqual(list(Loan.objects.values_list('loan_id', flat=True)), [1])
+
+
+class StreamingIngestionTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.customers = pd.read_excel(BulkIngestionTests.customer_file)
+
+    def write(self, df, name):
+        path = os.path.join(self.tmp.name, name)
+        if name.endswith('.csv'):
+            df.to_csv(path, index=False)
+        elif name.endswith('.jsonl'):
+            df.to_json(path, orient='records', lines=True, date_format='iso')
+        else:
+            df.to_excel(path, index=False)
+        return path
+
+    def test_readers_yield_bounded_chunks_for_every_format(self):
+        for name in ('customers.xlsx', 'customers.csv', 'customers.jsonl'):
+            chunks = list(ChunkReader(self.write(self.customers, name), chunk_size=70))
+            self.assertEqual([len(chunk) for chunk in chunks], [70, 70, 70, 70, 20], name)
+            combined = pd.concat(chunks, ignore_index=True)
+            self.assertEqual(combined['Customer ID'].tolist(), self.customers['Customer ID'].tolist(), name)
+
+    def test_reader_skips_committed_rows(self):
+        path = self.write(self.customers, 'customers.csv')
+        chunks = list(ChunkReader(path, chunk_size=1000, skip_rows=250))
+        self.assertEqual(chunks[0]['Customer ID'].tolist(), self.customers['Customer ID'].tolist()[250:])
+
+    def test_interrupted_run_resumes_after_last_committed_chunk(self):
+        path = self.write(self.customers, 'customers.jsonl')
+        calls = []
+
+        def fail_on_third_chunk(df, *args, **kwargs):
+            calls.append(len(df))
+            if len(calls) == 3:
+                raise RuntimeError('worker crashed')
+            return upsert_customers(df, *args, **kwargs)
+
+        with mock.patch('loans.streaming.upsert_customers', side_effect=fail_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                ingest_file('customers', path, chunk_size=100, batch_size=50)
+        self.assertEqual(Customer.objects.count(), 200)
+        self.assertEqual(IngestionCheckpoint.objects.get(kind='customers').rows_committed, 200)
+
+        stats = ingest_file('customers', path, chunk_size=100, batch_size=50)
+        self.assertEqual((stats['resumed_from'], stats['rows']), (200, 100))
+        self.assertEqual(Customer.objects.count(), 300)
+        self.assertTrue(IngestionCheckpoint.objects.get(kind='customers').completed)
+
+        # A completed checkpoint is not resumed: the next run ingests everything again
+        self.assertEqual(ingest_file('customers', path, chunk_size=100, batch_size=50)['rows'], 300)
+
+    def test_memory_ceiling_stops_run_resumably(self):
+        path = self.write(self.customers, 'customers.csv')
+        with mock.patch('loans.streaming.current_rss_bytes', return_value=10 * 1024 * 1024):
+            with self.assertRaises(MemoryLimitExceeded):
+                ingest_file('customers', path, chunk_size=100, batch_size=50, memory_limit_mb=8)
+        self.assertEqual(IngestionCheckpoint.objects.get(kind='customers').rows_committed, 100)
+
+    def test_streams_loans_from_csv(self):
+        ingest_file('customers', self.write(self.customers, 'customers.csv'), chunk_size=64, batch_size=32)
+        loans = pd.read_excel(BulkIngestionTests.loan_file)
+        ingest_file('loans', self.write(loans, 'loans.csv'), chunk_size=64, batch_size=32)
+        self.assertEqual(IngestionCheckpoint.objects.get(kind='loans').rows_committed, len(loans))
+        self.assertEqual(Loan.objects.count(), loans['Loan ID'].nunique())
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+
+
+class DeltaIngestionTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.customers = pd.read_excel(BulkIngestionTests.customer_file)
+
+    def write(self, df, name='customers.csv'):
+        path = os.path.join(self.tmp, name)
+        df.to_csv(path, index=False)
+        return path
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        ingest_file('customers', BulkIngestionTests.customer_file, chunk_size=100, batch_size=50)
+        # Same content from another format hashes identically
+        with CaptureQueriesContext(connection) as queries:
+            stats = ingest_file('customers', self.write(self.customers), chunk_size=100, batch_size=50, delta=True)
+        self.assertEqual((stats['inserted'], stats['updated'], stats['unchanged']), (0, 0, 300))
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "loans_customer"')])
+
+        changed = self.customers.copy()
+        changed.loc[[0, 1], 'First Name'] = 'Renamed'
+        changed.loc[len(changed)] = changed.iloc[2].to_dict() | {'Customer ID': 1000, 'Phone Number': 1234567890}
+        stats = ingest_file('customers', self.write(changed), chunk_size=100, batch_size=50, delta=True)
+        self.assertEqual((stats['inserted'], stats['updated'], stats['unchanged']), (1, 2, 298))
+        self.assertEqual(Customer.objects.filter(first_name='Renamed').count(), 2)
+
+    def test_missing_rows_are_reported_or_soft_deleted(self):
+        ingest_customer_data(self.write(self.customers))
+        make_customer(5000)  # created through the API, never part of the source
+        trimmed = self.write(self.customers[self.customers['Customer ID'] > 3])
+
+        report = ingest_customer_data(trimmed, delta=True, missing='report')
+        self.assertIn('3 rows no longer in the source (left in place): ids 1, 2, 3', report)
+        self.assertFalse(Customer.objects.filter(removed_from_source_at__isnull=False).exists())
+
+        ingest_customer_data(trimmed, delta=True, missing='soft-delete')
+        self.assertEqual(
+            sorted(Customer.objects.filter(removed_from_source_at__isnull=False).values_list('customer_id', flat=True)),
+            [1, 2, 3],
+        )
+
+        # Rows that come back are restored even though their content is unchanged
+        report = ingest_customer_data(self.write(self.customers), delta=True, missing='soft-delete')
+        self.assertIn('updated 3, unchanged 297', report)
+        self.assertFalse(Customer.objects.filter(removed_from_source_at__isnull=False).exists())
+
+    def test_parallel_delta_run_skips_profile_rebuild(self):
+        # loan_data.xlsx repeats some loan ids; each partition must fit in one chunk for its
+        # last occurrence to be the only one written
+        override = self.settings(INGEST_WORK_DIR=self.tmp, INGEST_CHUNK_SIZE=1000)
+        override.enable()
+        self.addCleanup(override.disable)
+        run_parallel_ingestion_locally(BulkIngestionTests.customer_file, BulkIngestionTests.loan_file, 2)
+
+        with mock.patch('loans.ingestion.rebuild_credit_profiles') as rebuild:
+            report = run_parallel_ingestion_locally(
+                BulkIngestionTests.customer_file, BulkIngestionTests.loan_file, 2, delta=True
+            )
+        self.assertIn('customers: 300 rows in 2 partitions', report)
+        self.assertIn('inserted 0, updated 0, unchanged 300', report)
+        self.assertIn(f"unchanged {Loan.objects.count()}", report)
+        rebuild.assert_not_called()
+
+
+class ColumnarCacheTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, 'cache')
+        self.path = os.path.join(tmp.name, 'loans.xlsx')
+        self.loans = pd.read_excel(BulkIngestionTests.loan_file)
+        self.loans.to_excel(self.path, index=False)
+
+    def read(self, **kwargs):
+        return pd.concat(ChunkReader(self.path, 300, cache_dir=self.cache_dir, **kwargs), ignore_index=True)
+
+    def test_cached_reads_match_workbook_without_parsing_it(self):
+        parsed = pd.concat(ChunkReader(self.path, 300), ignore_index=True)
+        pd.testing.assert_frame_equal(self.read(), parsed)
+        with mock.patch('openpyxl.load_workbook', side_effect=AssertionError('workbook parsed')):
+            pd.testing.assert_frame_equal(self.read(), parsed)
+            resumed = self.read(skip_rows=450)
+        self.assertEqual(resumed['Loan ID'].tolist(), parsed['Loan ID'].tolist()[450:])
+
+    def test_changed_workbook_replaces_its_cache(self):
+        self.read()
+        old_bundle = bundle_path(self.path, self.cache_dir)
+        self.loans.iloc[:10].to_excel(self.path, index=False)
+        self.assertEqual(len(self.read()), 10)
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(bundle_path(self.path, self.cache_dir))])
+        self.assertNotEqual(bundle_path(self.path, self.cache_dir), old_bundle)
+
+    def test_missing_text_values_round_trip(self):
+        customers = pd.read_excel(BulkIngestionTests.customer_file)
+        customers.loc[[3, 7], 'Last Name'] = None
+        customers.to_excel(self.path, index=False)
+        cached = self.read()
+        self.assertEqual(cached['Last Name'].isna().sum(), 2)
+        self.assertEqual(cached['Last Name'].tolist()[:3], customers['Last Name'].tolist()[:3])
+
+
+@contextmanager
+def eager_celery():
+    """Run Celery workflows in-process, storing chord results in memory instead of Redis"""
+    previous = celery_app.conf.task_always_eager
+    backend = CacheBackend(app=celery_app, url='memory://')
+    celery_app.conf.task_always_eager = True
+    try:
+        with mock.patch.object(type(celery_app), 'backend', new=property(lambda app: backend)):
+            yield
+    finally:
+        celery_app.conf.task_always_eager = previous
+
+
+class ParallelIngestionTests(TestCase):
+    def setUp(self):
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = work_dir.name
+        override = self.settings(INGEST_WORK_DIR=self.work_dir, INGEST_CHUNK_SIZE=100)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_split_keeps_duplicate_keys_and_customers_in_one_partition(self):
+        loans = pd.read_excel(BulkIngestionTests.loan_file)
+        owners = loans.drop_duplicates('Loan ID', keep='last').set_index('Loan ID')['Customer ID']
+        run_dir, paths = split_source('loans', BulkIngestionTests.loan_file, 4, self.work_dir, chunk_size=100)
+        parts = [pd.read_csv(path) for path in paths]
+        self.assertEqual(sum(len(part) for part in parts), len(loans))
+        for index, part in enumerate(parts):
+            # Repeated loan ids follow the customer of their last occurrence, which stays last
+            self.assertEqual(set(owners[part['Loan ID']] % 4), {int(os.path.basename(paths[index])[5:8])})
+            last = part.drop_duplicates('Loan ID', keep='last').set_index('Loan ID')['Customer ID']
+            self.assertTrue((last == owners[last.index]).all())
+        customer_parts = [set(part['Customer ID']) for part in parts]
+        repeated = loans[loans['Loan ID'].duplicated(keep=False)]['Customer ID']
+        for first, second in [(a, b) for a in customer_parts for b in customer_parts if a is not b]:
+            self.assertLessEqual(first & second, set(repeated))
+        # An unchanged source reuses the finished split
+        self.assertEqual(split_source('loans', BulkIngestionTests.loan_file, 4, self.work_dir, chunk_size=100), (run_dir, paths))
+
+    def test_workflow_loads_customers_before_loans(self):
+        with eager_celery():
+            report = parallel_ingestion(BulkIngestionTests.customer_file, BulkIngestionTests.loan_file, 3).apply().get()
+        self.assertIn('customers: 300 rows in 3 partitions', report)
+        self.assertEqual(Customer.objects.count(), 300)
+        self.assertEqual(Loan.objects.count(), pd.read_excel(BulkIngestionTests.loan_file)['Loan ID'].nunique())
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+        # Finished splits and their checkpoints are cleaned up
+        self.assertEqual(os.listdir(self.work_dir), [])
+        self.assertFalse(IngestionCheckpoint.objects.exists())
+
+    def test_command_waits_for_the_workflow_report(self):
+        def ingest(*options):
+            out = StringIO()
+            with eager_celery():
+                call_command(
+                    'ingest_data', '--customer-file', BulkIngestionTests.customer_file,
+                    '--loan-file', BulkIngestionTests.loan_file, '--partitions', '2', *options, stdout=out,
+                )
+            return out.getvalue()
+
+        output = ingest('--wait')
+        self.assertIn('customers: 300 rows in 2 partitions', output)
+        self.assertIn('inserted 300, updated 0, unchanged 0', output)
+        # Delta runs wait by default; other runs say where the counts are
+        self.assertIn('inserted 0, updated 0, unchanged 300', ingest('--delta'))
+        output = ingest('--restart')
+        self.assertNotIn('rows in 2 partitions', output)
+        self.assertIn('celery -A credit_approval_system result', output)
+        self.assertIn('rows in 2 partitions', ingest('--delta', '--missing', 'report'))
+        self.assertNotIn('rows in 2 partitions', ingest('--delta', '--no-wait'))
+
+    def test_loan_partitions_keep_profiles_current_without_a_final_rebuild(self):
+        for kind, source in (('customers', BulkIngestionTests.customer_file), ('loans', BulkIngestionTests.loan_file)):
+            run_dir, paths = split_source(kind, source, 3, self.work_dir, chunk_size=100)
+            for path in paths:
+                self.assertIsNone(ingest_partition(kind, path)['error'])
+        # finalize_ingestion has not run: every committed chunk refreshed its own customers
+        call_command('rebuild_credit_profiles', '--verify', stdout=StringIO())
+
+    def test_partition_errors_are_reported_and_split_is_kept(self):
+        with mock.patch('loans.tasks.ingest_file', side_effect=RuntimeError('disk full')):
+            report = run_parallel_ingestion_locally(BulkIngestionTests.customer_file, BulkIngestionTests.loan_file, 2)
+        self.assertIn('customers: 0 rows in 2 partitions', report)
+        self.assertEqual(report.count('disk full'), 4)
+        self.assertEqual(len(os.listdir(self.work_dir)), 2)
+
+        # Re-running resumes from the kept split
+        report = run_parallel_ingestion_locally(BulkIngestionTests.customer_file, BulkIngestionTests.loan_file, 2)
+        self.assertNotIn('disk full', report)
+        self.assertEqual(Customer.objects.count(), 300)
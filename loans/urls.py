@@ -1,11 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('', views.api_root, name='api_root'),
-    path('register', views.register_customer, name='register_customer'),
-    path('check-eligibility', views.check_eligibility, name='check_eligibility'),
-    path('create-loan', views.create_loan, name='create_loan'),
-    path('view-loan/<int:loan_id>', views.view_loan, name='view_loan'),
-    path('view-loans/<int:customer_id>', views.view_customer_loans, name='view_customer_loans'),
-]
\ No newline at end of file
+from . import async_views, views
+
+
+def api_urlpatterns(async_reads=False):
+    """The API's routes; with `async_reads` the read endpoints are served by loans.async_views"""
+    reads = async_views if async_reads else views
+    return [
+        path('', views.api_root, name='api_root'),
+        path('register', views.register_customer, name='register_customer'),
+        path('check-eligibility', reads.check_eligibility, name='check_eligibility'),
+        path('check-eligibility/batch', views.check_eligibility_batch, name='check_eligibility_batch'),
+        path('create-loan', views.create_loan, name='create_loan'),
+        path('view-loan/<int:loan_id>', reads.view_loan, name='view_loan'),
+        path('view-loan/<int:loan_id>/schedule', views.view_loan_schedule, name='view_loan_schedule'),
+        path('view-loans/<int:customer_id>', reads.view_customer_loans, name='view_customer_loans'),
+        path('view-loans/<int:customer_id>/schedules', views.view_customer_schedules, name='view_customer_schedules'),
+        path('metrics', views.metrics, name='metrics'),
+    ]
+
+
+urlpatterns = api_urlpatterns(settings.ASYNC_VIEWS)
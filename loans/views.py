@@ -1,10 +1,24 @@
+from django.conf import settings
+from django.db import connections, transaction
 from django.shortcuts import render, get_object_or_404
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
-from datetime import date, timedelta
-from decimal import Decimal
-from .models import Customer, Loan
+from rest_framework.settings import api_settings
+from .archive import read_archived_loans
+from .batch_eligibility import evaluate_eligibility_batch
+from .db_pool import pool_metrics
+from .db_router import customer_pin, loan_pin, pin_to_primary, read_alias, replica_metrics, replica_reads
+from . import flat_serializers
+from .eligibility import create_loan_if_eligible, evaluate_eligibility
+from .idempotency import idempotency_metrics, idempotent
+from .models import Customer, CustomerCreditProfile, Loan
+from .pagination import LoanCursorPagination, stream_json_array, stream_text
+from .renderers import CSVRenderer
+from .schedules import SCHEDULE_LOAN_FIELDS, schedule_cache_metrics, schedule_chunks
+from .response_cache import (
+    cached_response, customer_version, loan_list_version, loan_version, response_cache_metrics,
+)
 from .serializers import (
     CustomerRegistrationSerializer, CustomerSerializer,
     LoanEligibilitySerializer, LoanEligibilityResponseSerializer,
@@ -12,49 +26,7 @@ from .serializers import (
     LoanDetailSerializer, CustomerLoansSerializer
 )
 
-
-def calculate_credit_score(customer):
-    """Calculate credit score based on historical loan data"""
-    loans = Loan.objects.filter(customer=customer)
-    if not loans.exists():
-        return 0
-
-    score = 0
-
-    # Component 1: Past Loans paid on time (0-20 points)
-    total_emis = sum(loan.tenure for loan in loans)
-    paid_on_time = sum(loan.emis_paid_on_time for loan in loans)
-    if total_emis > 0:
-        on_time_percentage = (paid_on_time / total_emis) * 100
-        score += min(20, on_time_percentage * 0.2)
-
-    # Component 2: Number of loans taken (0-20 points)
-    num_loans = loans.count()
-    score += min(20, num_loans * 2)
-
-    # Component 3: Loan activity in current year (0-30 points)
-    current_year = date.today().year
-    current_year_loans = loans.filter(start_date__year=current_year)
-    current_year_volume = sum(float(loan.loan_amount) for loan in current_year_loans)
-    score += min(30, current_year_volume / 10000)  # 1 point per 10k
-
-    # Component 4: Loan approved volume (0-30 points)
-    total_volume = sum(float(loan.loan_amount) for loan in loans)
-    score += min(30, total_volume / 10000)  # 1 point per 10k
-
-    return min(100, score)
-
-
-def calculate_monthly_installment(loan_amount, interest_rate, tenure):
-    """Calculate monthly installment using compound interest"""
-    monthly_rate = float(interest_rate) / 100 / 12
-    num_payments = tenure
-
-    if monthly_rate == 0:
-        return loan_amount / num_payments
-
-    monthly_installment = loan_amount * (monthly_rate * (1 + monthly_rate) ** num_payments) / ((1 + monthly_rate) ** num_payments - 1)
-    return Decimal(str(round(monthly_installment, 2)))
+MAX_ELIGIBILITY_BATCH_SIZE = 10000
 
 
 @api_view(['POST'])
@@ -62,13 +34,29 @@ def register_customer(request):
     """Register a new customer"""
     serializer = CustomerRegistrationSerializer(data=request.data)
     if serializer.is_valid():
-        customer = serializer.save()
+        with transaction.atomic():
+            customer = serializer.save()
+            CustomerCreditProfile.objects.create(customer=customer)
+            pin_to_primary([customer_pin(customer.customer_id)])
         response_serializer = CustomerSerializer(customer)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def eligibility_data(result):
+    """The response data of an eligibility result; FAST_RESPONSES builds it with the flat serializer"""
+    if settings.FAST_RESPONSES:
+        return flat_serializers.eligibility(result)
+    return LoanEligibilityResponseSerializer(result).data
+
+
+def _application_pins(request):
+    applications = request.data if isinstance(request.data, list) else [request.data]
+    return [customer_pin(app.get('customer_id')) for app in applications if hasattr(app, 'get')]
+
+
 @api_view(['POST'])
+@replica_reads(_application_pins)
 def check_eligibility(request):
     """Check loan eligibility based on credit score"""
     serializer = LoanEligibilitySerializer(data=request.data)
@@ -82,76 +70,39 @@ def check_eligibility(request):
     tenure = data['tenure']
 
     try:
-        customer = Customer.objects.get(customer_id=customer_id)
+        customer = Customer.objects.select_related('credit_profile').get(customer_id=customer_id)
     except Customer.DoesNotExist:
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    # Check if sum of current loans > approved limit
-    current_loans = Loan.objects.filter(customer=customer)
-    current_debt = sum(float(loan.loan_amount) for loan in current_loans)
-    if current_debt + float(loan_amount) > float(customer.approved_limit):
-        response_data = {
-            'customer_id': customer_id,
-            'approval': False,
-            'interest_rate': interest_rate,
-            'tenure': tenure,
-            'monthly_installment': 0
-        }
-        response_serializer = LoanEligibilityResponseSerializer(response_data)
-        return Response(response_serializer.data)
+    response_data = evaluate_eligibility(customer, loan_amount, interest_rate, tenure)
+    return Response(eligibility_data(response_data))
 
-    # Check if sum of current EMIs > 50% of monthly salary
-    current_emis = sum(float(loan.monthly_installment) for loan in current_loans)
-    if current_emis > float(customer.monthly_salary) * 0.5:
-        response_data = {
-            'customer_id': customer_id,
-            'approval': False,
-            'interest_rate': interest_rate,
-            'tenure': tenure,
-            'monthly_installment': 0
-        }
-        response_serializer = LoanEligibilityResponseSerializer(response_data)
-        return Response(response_serializer.data)
-
-    # Calculate credit score
-    credit_score = calculate_credit_score(customer)
-
-    # Determine approval and interest rate correction
-    approval = False
-    corrected_interest_rate = interest_rate
-
-    if credit_score > 50:
-        approval = True
-    elif 30 < credit_score <= 50:
-        approval = True
-        if interest_rate < 12:
-            corrected_interest_rate = Decimal('12.00')
-    elif 10 < credit_score <= 30:
-        approval = True
-        if interest_rate < 16:
-            corrected_interest_rate = Decimal('16.00')
-    else:
-        approval = False
-
-    # Calculate monthly installment
-    monthly_installment = calculate_monthly_installment(loan_amount, corrected_interest_rate, tenure)
 
-    response_data = {
-        'customer_id': customer_id,
-        'approval': approval,
-        'interest_rate': interest_rate,
-        'corrected_interest_rate': corrected_interest_rate,
-        'tenure': tenure,
-        'monthly_installment': monthly_installment
-    }
+@api_view(['POST'])
+@replica_reads(_application_pins)
+def check_eligibility_batch(request):
+    """Check loan eligibility for a list of applications in one request"""
+    if isinstance(request.data, list) and len(request.data) > MAX_ELIGIBILITY_BATCH_SIZE:
+        return Response(
+            {'error': f'At most {MAX_ELIGIBILITY_BATCH_SIZE} applications per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    serializer = LoanEligibilitySerializer(data=request.data, many=True)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    response_serializer = LoanEligibilityResponseSerializer(response_data)
-    return Response(response_serializer.data)
+    results = evaluate_eligibility_batch(serializer.validated_data)
+    return Response([
+        result if 'error' in result else eligibility_data(result)
+        for result in results
+    ])
 
 
 @api_view(['POST'])
+@idempotent
 def create_loan(request):
-    """Create a new loan after eligibility check"""
+    """Create a new loan after eligibility check; retries sending the same Idempotency-Key are replayed"""
     serializer = LoanCreationSerializer(data=request.data)
     if not serializer.is_valid():
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -163,27 +114,11 @@ def create_loan(request):
     tenure = data['tenure']
 
     try:
-        customer = Customer.objects.get(customer_id=customer_id)
+        loan, _ = create_loan_if_eligible(customer_id, loan_amount, interest_rate, tenure)
     except Customer.DoesNotExist:
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    # First check eligibility
-    eligibility_data = {
-        'customer_id': customer_id,
-        'loan_amount': loan_amount,
-        'interest_rate': interest_rate,
-        'tenure': tenure
-    }
-
-    eligibility_request = type('Request', (), {'data': eligibility_data})()
-    eligibility_response = check_eligibility(eligibility_request)
-
-    if eligibility_response.status_code != 200:
-        return eligibility_response
-
-    eligibility_result = eligibility_response.data
-
-    if not eligibility_result['approval']:
+    if loan is None:
         response_data = {
             'loan_id': None,
             'customer_id': customer_id,
@@ -194,33 +129,12 @@ def create_loan(request):
         response_serializer = LoanCreationResponseSerializer(response_data)
         return Response(response_serializer.data)
 
-    # Create the loan
-    corrected_interest_rate = eligibility_result.get('corrected_interest_rate', interest_rate)
-    monthly_installment = eligibility_result['monthly_installment']
-
-    start_date = date.today()
-    end_date = start_date + timedelta(days=30 * tenure)
-
-    loan = Loan.objects.create(
-        customer=customer,
-        loan_amount=loan_amount,
-        tenure=tenure,
-        interest_rate=corrected_interest_rate,
-        monthly_installment=monthly_installment,
-        start_date=start_date,
-        end_date=end_date
-    )
-
-    # Update customer's current debt
-    customer.current_debt += loan_amount
-    customer.save()
-
     response_data = {
         'loan_id': loan.loan_id,
         'customer_id': customer_id,
         'loan_approved': True,
         'message': 'Loan approved and created successfully',
-        'monthly_installment': monthly_installment
+        'monthly_installment': loan.monthly_installment
     }
 
     response_serializer = LoanCreationResponseSerializer(response_data)
@@ -228,20 +142,118 @@ def create_loan(request):
 
 
 @api_view(['GET'])
+@replica_reads(lambda request, loan_id: [loan_pin(loan_id)])
 def view_loan(request, loan_id):
-    """View loan details"""
-    loan = get_object_or_404(Loan, loan_id=loan_id)
-    serializer = LoanDetailSerializer(loan)
-    return Response(serializer.data)
+    """View loan details; cached until the loan or its customer changes"""
+    def build():
+        if settings.FAST_RESPONSES:
+            row = get_object_or_404(
+                Loan.objects.in_source().values_list(*flat_serializers.LOAN_DETAIL_FIELDS), loan_id=loan_id
+            )
+            return flat_serializers.loan_detail(row)
+        loan = get_object_or_404(Loan.objects.in_source().select_related('customer'), loan_id=loan_id)
+        return LoanDetailSerializer(loan).data
+
+    def customer_versions():
+        customer_id = Loan.objects.filter(loan_id=loan_id).values_list('customer_id', flat=True).first()
+        return [] if customer_id is None else [customer_version(customer_id)]
+
+    return cached_response(
+        request, f'loan:{loan_id}', [loan_version(loan_id)], build, resolve_version_keys=customer_versions,
+    )
 
 
 @api_view(['GET'])
+@replica_reads(lambda request, customer_id: [customer_pin(customer_id)])
 def view_customer_loans(request, customer_id):
-    """View all loans for a customer"""
+    """View all loans for a customer; cached until the customer or one of its loans changes.
+
+    With `?page_size=` or `?cursor=` the loans come in keyset-paginated pages,
+    and with `?stream=true` the full list is streamed; neither is cached.
+    Otherwise `?archived=true` adds the customer's archived loans.
+    """
+    params = request.query_params
+    if 'page_size' in params or 'cursor' in params:
+        customer = get_object_or_404(Customer, customer_id=customer_id)
+        paginator = LoanCursorPagination()
+        page = paginator.paginate_queryset(Loan.objects.in_source().filter(customer=customer), request)
+        return paginator.get_paginated_response(CustomerLoansSerializer(page, many=True).data)
+    if params.get('stream', '').lower() in ('1', 'true'):
+        customer = get_object_or_404(Customer, customer_id=customer_id)
+        # The stream runs after @replica_reads has returned, so it is bound to the view's database here
+        loans = Loan.objects.using(read_alias()).in_source().filter(customer=customer)
+        return stream_json_array(request, loans, CustomerLoansSerializer)
+
+    archived = params.get('archived', '').lower() in ('1', 'true')
+
+    def build():
+        customer = get_object_or_404(Customer, customer_id=customer_id)
+        if settings.FAST_RESPONSES:
+            rows = list(
+                Loan.objects.in_source().filter(customer=customer).values_list(*flat_serializers.LOAN_ROW_FIELDS)
+            )
+            if archived:
+                current = {row[0] for row in rows}
+                rows += [
+                    flat_serializers.loan_row(loan)
+                    for loan in read_archived_loans(customer_id) if loan.loan_id not in current
+                ]
+            return flat_serializers.customer_loans(rows)
+        loans = list(Loan.objects.in_source().filter(customer=customer))
+        if archived:
+            # A run interrupted before its commit can leave a loan in both places
+            current = {loan.loan_id for loan in loans}
+            loans += [loan for loan in read_archived_loans(customer_id) if loan.loan_id not in current]
+        return CustomerLoansSerializer(loans, many=True).data
+
+    key = f'customer-loans:{customer_id}' + (':archived' if archived else '')
+    return cached_response(
+        request, key, [customer_version(customer_id), loan_list_version(customer_id)], build
+    )
+
+
+# Schedules come as JSON or, with `?format=csv` or `Accept: text/csv`, CSV
+SCHEDULE_RENDERER_CLASSES = [*api_settings.DEFAULT_RENDERER_CLASSES, CSVRenderer]
+
+
+def _stream_schedules(request, loans, many=True):
+    format = request.accepted_renderer.format
+    content_type = 'text/csv; charset=utf-8' if format == 'csv' else 'application/json'
+    return stream_text(request, schedule_chunks(loans, format, many), content_type)
+
+
+@api_view(['GET'])
+@renderer_classes(SCHEDULE_RENDERER_CLASSES)
+@replica_reads(lambda request, loan_id: [loan_pin(loan_id)])
+def view_loan_schedule(request, loan_id):
+    """View the month-by-month amortization schedule of a loan"""
+    loan = get_object_or_404(Loan.objects.in_source().values_list(*SCHEDULE_LOAN_FIELDS), loan_id=loan_id)
+    return _stream_schedules(request, [loan], many=False)
+
+
+@api_view(['GET'])
+@renderer_classes(SCHEDULE_RENDERER_CLASSES)
+@replica_reads(lambda request, customer_id: [customer_pin(customer_id)])
+def view_customer_schedules(request, customer_id):
+    """View the amortization schedules of all of a customer's loans, streamed"""
     customer = get_object_or_404(Customer, customer_id=customer_id)
-    loans = Loan.objects.filter(customer=customer)
-    serializer = CustomerLoansSerializer(loans, many=True)
-    return Response(serializer.data)
+    # Bound to the view's database, as the stream reads it after @replica_reads has returned
+    loans = Loan.objects.using(read_alias()).in_source().filter(customer=customer).order_by('loan_id').values_list(
+        *SCHEDULE_LOAN_FIELDS
+    )
+    return _stream_schedules(request, loans.iterator(chunk_size=settings.LOANS_STREAM_CHUNK_SIZE))
+
+
+@api_view(['GET'])
+def metrics(request):
+    """Operational counters"""
+    return Response({
+        'idempotency': idempotency_metrics(),
+        'response_cache': response_cache_metrics(),
+        'replica_reads': replica_metrics(),
+        'database': {alias: pool_metrics(alias) for alias in connections},
+        'schedule_cache': schedule_cache_metrics(),
+    })
 
 
 @api_view(['GET'])
@@ -252,8 +264,12 @@ def api_root(request):
         "endpoints": {
             "register": "POST /api/register - Register a new customer",
             "check-eligibility": "POST /api/check-eligibility - Check loan eligibility",
+            "check-eligibility-batch": "POST /api/check-eligibility/batch - Check eligibility for a list of applications",
             "create-loan": "POST /api/create-loan - Create a new loan",
             "view-loan": "GET /api/view-loan/<loan_id> - View loan details",
-            "view-loans": "GET /api/view-loans/<customer_id> - View customer loans"
+            "view-loan-schedule": "GET /api/view-loan/<loan_id>/schedule - View a loan's amortization schedule",
+            "view-loans": "GET /api/view-loans/<customer_id> - View customer loans",
+            "view-loans-schedules": "GET /api/view-loans/<customer_id>/schedules - View schedules of customer loans",
+            "metrics": "GET /api/metrics - Idempotency store and response cache counters"
         }
     })
@@ -0,0 +1,12 @@
+#!/bin/bash
+# Serve the API on $PORT: the development server with DEBUG=True, gunicorn otherwise.
+# SERVER_MODE=wsgi|asgi, workers, threads, recycling and keep-alive are set in
+# gunicorn.conf.py. Run from the project directory.
+
+export PORT=${PORT:-8000}
+if [ "$(echo "${DEBUG:-False}" | tr '[:upper:]' '[:lower:]')" = "true" ]; then
+    echo "Starting Django development server..."
+    exec python manage.py runserver 0.0.0.0:$PORT
+fi
+echo "Starting gunicorn (${SERVER_MODE:-wsgi})..."
+exec gunicorn --config gunicorn.conf.py